@@ -24,4 +24,6 @@ setup(
     include_package_data=True,
     python_requires=">=3.7",
     install_requires=install_requires,
+    # 'compression' for the plugin codecs (zstd, lz4, blosc-lz4, blosc-zstd), 'zarr' for the NWB-Zarr backend
+    extras_require=dict(compression=["hdf5plugin"], zarr=["zarr", "hdmf-zarr", "numcodecs"]),
 )
@@ -0,0 +1,140 @@
+"""
+Benchmark of the chunk compression of the imaging planes with the HDF5 gzip filter and with direct chunk writes.
+
+The planes of a synthetic interleaved TIFF are written with the single-pass plane reader into gzip compressed
+datasets, first through the HDF5 filter pipeline and then with the chunks compressed by 1 to N threads and
+written directly. The time and the throughput (of uncompressed data) are reported for each run.
+Run from 'src/microns_to_nwb' with 'python -m benchmarks.chunk_compression'.
+"""
+import os
+from argparse import ArgumentParser
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from typing import Optional
+
+import numpy as np
+from h5py import File
+from tifffile import imwrite
+
+from ophys.micronstiffplanereader import MicronsTiffPlaneReader
+
+
+def make_interleaved_scan(
+    file_path: str, num_frames: int = 2000, num_planes: int = 4, num_rows: int = 512, num_columns: int = 512
+):
+    """Write a TIFF of noisy, smooth frames where page i holds frame i // num_planes of plane i % num_planes."""
+    rng = np.random.default_rng(0)
+    rows, columns = np.meshgrid(np.arange(num_rows), np.arange(num_columns), indexing="ij")
+    background = (1000 + 500 * np.sin(rows / 40) * np.cos(columns / 30)).astype(np.int16)
+    pages = (
+        background + rng.integers(0, 64, size=(num_rows, num_columns), dtype=np.int16)
+        for _ in range(num_frames * num_planes)
+    )
+    imwrite(file_path, data=pages, shape=(num_frames * num_planes, num_rows, num_columns), dtype=np.int16)
+
+
+def _write_planes(
+    tiff_file_path: str,
+    nwbfile_path: str,
+    num_frames: int,
+    chunk_frames: int,
+    buffer_gb: float,
+    max_compression_workers: Optional[int],
+) -> float:
+    plane_reader = MicronsTiffPlaneReader(file_path=tiff_file_path, num_frames_per_plane=num_frames)
+    num_rows, num_columns = plane_reader.get_image_size()
+    with File(nwbfile_path, "w") as file:
+        datasets = [
+            file.create_dataset(
+                name=f"TwoPhotonSeries{plane_index + 1}",
+                shape=(num_frames, num_columns, num_rows),
+                dtype=np.int16,
+                chunks=(chunk_frames, num_columns, num_rows),
+                compression="gzip",
+            )
+            for plane_index in range(plane_reader.get_num_planes())
+        ]
+        start_time = perf_counter()
+        plane_reader.write_planes(
+            datasets=datasets, buffer_gb=buffer_gb, max_compression_workers=max_compression_workers
+        )
+        return perf_counter() - start_time
+
+
+def run_benchmark(
+    num_frames: int = 2000,
+    num_planes: int = 4,
+    num_rows: int = 512,
+    num_columns: int = 512,
+    chunk_frames: int = 2,
+    buffer_gb: float = 0.5,
+    max_workers: Optional[int] = None,
+) -> list:
+    max_workers = max_workers or os.cpu_count()
+
+    results = []
+    with TemporaryDirectory() as folder_path:
+        tiff_file_path = str(Path(folder_path) / "scan.tif")
+        make_interleaved_scan(
+            file_path=tiff_file_path,
+            num_frames=num_frames,
+            num_planes=num_planes,
+            num_rows=num_rows,
+            num_columns=num_columns,
+        )
+        data_size = Path(tiff_file_path).stat().st_size
+
+        runs = [("filter", None)] + [
+            (f"direct x{num_workers}", num_workers) for num_workers in range(1, max_workers + 1)
+        ]
+        for run_name, max_compression_workers in runs:
+            nwbfile_path = str(Path(folder_path) / "planes.h5")
+            seconds = _write_planes(
+                tiff_file_path=tiff_file_path,
+                nwbfile_path=nwbfile_path,
+                num_frames=num_frames,
+                chunk_frames=chunk_frames,
+                buffer_gb=buffer_gb,
+                max_compression_workers=max_compression_workers,
+            )
+            results.append(
+                dict(
+                    run=run_name,
+                    seconds=seconds,
+                    throughput_mb_per_s=data_size / 1e6 / seconds,
+                    file_size=Path(nwbfile_path).stat().st_size,
+                    data_size=data_size,
+                )
+            )
+            Path(nwbfile_path).unlink()
+
+    return results
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("--num-frames", type=int, default=2000, help="The number of frames per plane.")
+    parser.add_argument("--num-planes", type=int, default=4)
+    parser.add_argument("--num-rows", type=int, default=512)
+    parser.add_argument("--num-columns", type=int, default=512)
+    parser.add_argument("--chunk-frames", type=int, default=2)
+    parser.add_argument("--buffer-gb", type=float, default=0.5)
+    parser.add_argument("--max-workers", type=int, default=None, help="Defaults to the number of CPUs.")
+    args = parser.parse_args()
+
+    results = run_benchmark(
+        num_frames=args.num_frames,
+        num_planes=args.num_planes,
+        num_rows=args.num_rows,
+        num_columns=args.num_columns,
+        chunk_frames=args.chunk_frames,
+        buffer_gb=args.buffer_gb,
+        max_workers=args.max_workers,
+    )
+    print(f"Uncompressed data size {results[0]['data_size'] / 1e9:.2f} GB")
+    for result in results:
+        print(
+            f"{result['run']:>11}: {result['seconds']:7.2f} s, {result['throughput_mb_per_s']:7.1f} MB/s, "
+            f"compressed to {result['file_size'] / 1e9:.2f} GB"
+        )
@@ -0,0 +1,146 @@
+"""
+Benchmark of the compression codecs for each class of datasets in the NWB files.
+
+A sample of each dataset class (TwoPhotonSeries, RoiResponseSeries, image masks, timestamps, behavior and stimulus
+templates) is written with every codec, and the write throughput, the read throughput (both of uncompressed data) and
+the compression ratio are reported. The imaging sample is taken from the first frames of '--tiff-file-path' when
+specified, and synthetic otherwise. The plugin codecs are skipped when 'hdf5plugin' is not installed.
+Run from 'src/microns_to_nwb' with 'python -m benchmarks.codecs'.
+"""
+from argparse import ArgumentParser
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from typing import Optional
+
+import numpy as np
+from h5py import File
+from tifffile import memmap
+
+from tools.compression import DATASET_CLASSES, get_compression_kwargs
+
+CODECS = dict(
+    gzip_1=dict(codec="gzip", level=1),
+    gzip_4=dict(codec="gzip"),
+    gzip_4_shuffle=dict(codec="gzip", shuffle=True),
+    gzip_9=dict(codec="gzip", level=9),
+    lzf=dict(codec="lzf"),
+    zstd_3_shuffle=dict(codec="zstd", level=3, shuffle=True),
+    lz4_shuffle=dict(codec="lz4", shuffle=True),
+    blosc_lz4_5=dict(codec="blosc-lz4", level=5, shuffle=True),
+    blosc_zstd_5=dict(codec="blosc-zstd", level=5, shuffle=True),
+    none=dict(codec=None),
+)
+
+
+def make_samples(
+    tiff_file_path: Optional[str] = None,
+    num_frames: int = 1000,
+    num_rows: int = 256,
+    num_columns: int = 256,
+    num_rois: int = 500,
+    seed: int = 0,
+) -> dict:
+    """A sample of each dataset class, with the (frames, columns, rows) layout of the TwoPhotonSeries."""
+    rng = np.random.default_rng(seed)
+    if tiff_file_path is not None:
+        video = np.asarray(memmap(tiff_file_path, mode="r")[:num_frames])
+    else:
+        rows, columns = np.meshgrid(np.arange(num_rows), np.arange(num_columns), indexing="ij")
+        background = (1000 + 500 * np.sin(rows / 40) * np.cos(columns / 30)).astype(np.int16)
+        video = background + rng.integers(0, 64, size=(num_frames, num_rows, num_columns), dtype=np.int16)
+    num_frames, num_rows, num_columns = video.shape
+
+    traces = np.cumsum(rng.normal(size=(num_frames, num_rois)), axis=0).astype(np.float32)
+    image_masks = np.zeros((num_rois, num_columns, num_rows), dtype=np.float32)
+    for roi_index in range(num_rois):
+        x, y = rng.integers(0, num_columns - 10), rng.integers(0, num_rows - 10)
+        image_masks[roi_index, x : x + 10, y : y + 10] = rng.random((10, 10))
+    timestamps = np.cumsum(rng.normal(loc=1 / 6.3, scale=1e-4, size=num_frames * 10))
+    behavior = np.cumsum(rng.normal(size=num_frames * 10))
+    # The stimulus templates are 8-bit RGB frames of a smooth moving pattern
+    stimulus_rows, stimulus_columns = np.meshgrid(np.arange(144), np.arange(256), indexing="ij")
+    phases = np.arange(num_frames // 10)[:, np.newaxis, np.newaxis] / 10
+    pattern = 127 + 100 * np.sin(stimulus_rows / 12 + phases) * np.cos(stimulus_columns / 20 - phases)
+    stimulus = np.repeat(pattern.astype(np.uint8)[..., np.newaxis], 3, axis=-1)
+
+    return dict(
+        TwoPhotonSeries=video.transpose((0, 2, 1)),
+        RoiResponseSeries=traces,
+        image_masks=image_masks,
+        timestamps=timestamps,
+        behavior=behavior,
+        stimulus=stimulus,
+    )
+
+
+def _is_codec_available(codec_options: dict) -> bool:
+    try:
+        get_compression_kwargs(dataset_class="behavior", compression_options=dict(behavior=codec_options))
+    except ImportError:
+        return False
+    return True
+
+
+def run_benchmark(tiff_file_path: Optional[str] = None, **sample_kwargs) -> list:
+    samples = make_samples(tiff_file_path=tiff_file_path, **sample_kwargs)
+
+    results = []
+    with TemporaryDirectory() as folder_path:
+        for codec_name, codec_options in CODECS.items():
+            if not _is_codec_available(codec_options=codec_options):
+                continue
+            for dataset_class in DATASET_CLASSES:
+                data = samples[dataset_class]
+                compression_kwargs = get_compression_kwargs(
+                    dataset_class=dataset_class, compression_options={dataset_class: codec_options}
+                )
+                file_path = Path(folder_path) / f"{codec_name}_{dataset_class}.h5"
+
+                start_time = perf_counter()
+                with File(file_path, "w") as file:
+                    dataset = file.create_dataset(name="data", data=data, chunks=True, **compression_kwargs)
+                    storage_size = dataset.id.get_storage_size()
+                write_seconds = perf_counter() - start_time
+
+                start_time = perf_counter()
+                with File(file_path, "r") as file:
+                    file["data"][:]
+                read_seconds = perf_counter() - start_time
+
+                results.append(
+                    dict(
+                        codec=codec_name,
+                        dataset_class=dataset_class,
+                        write_mb_per_s=data.nbytes / 1e6 / write_seconds,
+                        read_mb_per_s=data.nbytes / 1e6 / read_seconds,
+                        compression_ratio=data.nbytes / storage_size,
+                    )
+                )
+                file_path.unlink()
+
+    return results
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("--tiff-file-path", type=str, default=None, help="A scan to take the imaging sample from.")
+    parser.add_argument("--num-frames", type=int, default=1000)
+    parser.add_argument("--num-rows", type=int, default=256)
+    parser.add_argument("--num-columns", type=int, default=256)
+    parser.add_argument("--num-rois", type=int, default=500)
+    args = parser.parse_args()
+
+    results = run_benchmark(
+        tiff_file_path=args.tiff_file_path,
+        num_frames=args.num_frames,
+        num_rows=args.num_rows,
+        num_columns=args.num_columns,
+        num_rois=args.num_rois,
+    )
+    print(f"{'dataset class':>17} {'codec':>15} {'write MB/s':>11} {'read MB/s':>10} {'ratio':>6}")
+    for result in sorted(results, key=lambda result: DATASET_CLASSES.index(result["dataset_class"])):
+        print(
+            f"{result['dataset_class']:>17} {result['codec']:>15} {result['write_mb_per_s']:11.1f} "
+            f"{result['read_mb_per_s']:10.1f} {result['compression_ratio']:6.2f}"
+        )
@@ -0,0 +1,167 @@
+"""
+Benchmark of aligning the functional coregistration table to the units of a field.
+
+Compares the previous per-unit loop with 'get_coregistration_columns' on a synthetic table, where the second match
+of a unit has differing 'pt_*' values (unless '--identical-duplicates'), and checks the columns (see 'check_columns').
+Run from 'src/microns_to_nwb' with 'python -m benchmarks.coregistration'.
+"""
+from argparse import ArgumentParser
+from time import perf_counter
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.synthetic import make_functional_coreg_table
+from tools.cave_client import MISSING_COREGISTRATION_VALUE, get_coregistration_columns
+from tools.cave_client.coregistration import POSITION_COLUMNS
+
+
+def get_coregistration_columns_per_unit(functional_coreg_table: pd.DataFrame, unit_ids: np.ndarray) -> dict:
+    """The per-unit loop that 'get_coregistration_columns' replaced, kept verbatim for comparison."""
+    pt_supervoxel_ids = []
+    pt_root_ids = []
+    pt_x_positions = []
+    pt_y_positions = []
+    pt_z_positions = []
+    cave_ids = []
+    for unit_id in unit_ids:
+        df = functional_coreg_table[functional_coreg_table["unit_id"] == unit_id]
+        if df.empty:
+            pt_supervoxel_ids.append(np.nan)
+            pt_root_ids.append(np.nan)
+            pt_x_positions.append(np.nan)
+            pt_y_positions.append(np.nan)
+            pt_z_positions.append(np.nan)
+            cave_ids.append([np.nan])
+
+        else:
+            pt_supervoxel_ids.extend(df["pt_supervoxel_id"].drop_duplicates().astype(np.float64).tolist())
+            pt_root_ids.extend(df["pt_root_id"].drop_duplicates().astype(np.float64).tolist())
+            pt_x_positions.extend(df["pt_position_x"].drop_duplicates().astype(np.float64).tolist())
+            pt_y_positions.extend(df["pt_position_y"].drop_duplicates().astype(np.float64).tolist())
+            pt_z_positions.extend(df["pt_position_z"].drop_duplicates().astype(np.float64).tolist())
+            cave_ids.append(df["id"].astype(np.float64).values.tolist())
+
+    return dict(
+        cave_ids=cave_ids,
+        pt_supervoxel_id=pt_supervoxel_ids,
+        pt_root_id=pt_root_ids,
+        pt_x_position=pt_x_positions,
+        pt_y_position=pt_y_positions,
+        pt_z_position=pt_z_positions,
+    )
+
+
+def get_first_matches(functional_coreg_table: pd.DataFrame, unit_ids: np.ndarray) -> dict:
+    """The 'pt_*' values of the first match of each unit, looked up one unit at a time (NaN without a match)."""
+    columns = {column_name: [] for column_name in POSITION_COLUMNS}
+    for unit_id in unit_ids:
+        df = functional_coreg_table[functional_coreg_table["unit_id"] == unit_id]
+        for column_name, coreg_column_name in POSITION_COLUMNS.items():
+            columns[column_name].append(df[coreg_column_name].iloc[0] if len(df) else np.nan)
+    return columns
+
+
+def check_columns(functional_coreg_table: pd.DataFrame, unit_ids: np.ndarray, per_unit: dict, merged: dict) -> list:
+    """
+    Check the columns of 'get_coregistration_columns' against the per-unit loop and the first match of each unit.
+
+    The 'cave_ids' must be identical to those of the loop, without its NaN entry for the units without a match. The
+    loop appends every distinct 'pt_*' value of a unit, so its columns are only aligned to the units when no unit has
+    differing matches, then they must be identical (with MISSING_COREGISTRATION_VALUE in place of NaN), otherwise
+    the 'pt_*' columns must hold the values of the first match. Returns the names of the misaligned columns.
+    """
+    matched_cave_ids = [ids for ids in per_unit["cave_ids"] if not np.isnan(ids).all()]
+    assert merged["cave_ids"].dtype == np.int64, "'cave_ids' is not stored as integers."
+    np.testing.assert_array_equal(merged["cave_ids"], np.concatenate(matched_cave_ids).astype(np.int64))
+    num_cave_ids = [0 if np.isnan(ids).all() else len(ids) for ids in per_unit["cave_ids"]]
+    np.testing.assert_array_equal(merged["cave_ids_index"], np.cumsum(num_cave_ids))
+
+    first_matches = get_first_matches(functional_coreg_table=functional_coreg_table, unit_ids=unit_ids)
+    misaligned_columns = []
+    for column_name in POSITION_COLUMNS:
+        assert merged[column_name].dtype == np.int64, f"'{column_name}' is not stored as integers."
+        if len(per_unit[column_name]) == len(unit_ids):
+            per_unit_values = np.nan_to_num(per_unit[column_name], nan=MISSING_COREGISTRATION_VALUE)
+            np.testing.assert_array_equal(merged[column_name], per_unit_values, err_msg=f"'{column_name}' differs.")
+        else:
+            misaligned_columns.append(column_name)
+        # Compare as integers, the float values of the loop do not hold the 18 digits of the root ids
+        first_match_values = [
+            MISSING_COREGISTRATION_VALUE if pd.isna(value) else value for value in first_matches[column_name]
+        ]
+        np.testing.assert_array_equal(merged[column_name], np.array(first_match_values, dtype=np.int64))
+    return misaligned_columns
+
+
+def _time(function, repeats, **kwargs):
+    durations = []
+    for _ in range(repeats):
+        start = perf_counter()
+        result = function(**kwargs)
+        durations.append(perf_counter() - start)
+    return min(durations), result
+
+
+def run_benchmark(
+    num_units: int = 8000, num_matches: int = 4000, repeats: int = 3, differing_duplicates: bool = True
+) -> dict:
+    functional_coreg_table = make_functional_coreg_table(
+        num_units=num_units, num_matches=num_matches, differing_duplicates=differing_duplicates
+    )
+    unit_ids = np.arange(1, num_units + 1)
+
+    per_unit_time, per_unit_columns = _time(
+        get_coregistration_columns_per_unit,
+        repeats=repeats,
+        functional_coreg_table=functional_coreg_table,
+        unit_ids=unit_ids,
+    )
+    merged_time, merged_columns = _time(
+        get_coregistration_columns,
+        repeats=repeats,
+        functional_coreg_table=functional_coreg_table,
+        unit_ids=unit_ids,
+    )
+    misaligned_columns = check_columns(
+        functional_coreg_table=functional_coreg_table,
+        unit_ids=unit_ids,
+        per_unit=per_unit_columns,
+        merged=merged_columns,
+    )
+
+    return dict(
+        num_units=num_units,
+        num_rows=len(functional_coreg_table),
+        per_unit_seconds=per_unit_time,
+        merged_seconds=merged_time,
+        speedup=per_unit_time / merged_time,
+        misaligned_columns=misaligned_columns,
+    )
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("--num-units", type=int, default=8000)
+    parser.add_argument("--num-matches", type=int, default=4000)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--identical-duplicates", action="store_true")
+    args = parser.parse_args()
+
+    results = run_benchmark(
+        num_units=args.num_units,
+        num_matches=args.num_matches,
+        repeats=args.repeats,
+        differing_duplicates=not args.identical_duplicates,
+    )
+    misaligned_columns = results["misaligned_columns"]
+    print(
+        f"{results['num_units']} units, {results['num_rows']} coregistration rows: "
+        f"per-unit loop {results['per_unit_seconds']:.3f} s, "
+        f"grouped merge {results['merged_seconds']:.4f} s ({results['speedup']:.0f}x), columns are checked. "
+        + (
+            f"The per-unit loop has more values than units in {misaligned_columns}."
+            if misaligned_columns
+            else "The columns of the per-unit loop are identical."
+        )
+    )
@@ -0,0 +1,266 @@
+"""
+Microbenchmarks of the hot paths of the conversion on synthetic inputs (see benchmarks.synthetic).
+
+Times the reading of the imaging extractor ('get_video' and 'get_frames'), the plane segmentation with both mask
+formats, the fluorescence traces, the functional coregistration columns, the trials of each stimulus type and the
+per-scan slices of the timestamps stores. Each benchmark is prepared outside of the timed call and repeated, and the
+minimum and median times are reported. The results can be saved with '--output-file-path' and compared with the
+saved results of a previous run with '--baseline-file-path', which lists the benchmarks that are slower by more
+than '--threshold' and exits with an error when there are any.
+Run from 'src/microns_to_nwb' with 'python -m benchmarks.hot_paths'.
+"""
+import json
+import platform
+import subprocess
+import sys
+from argparse import ArgumentParser
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from typing import Callable, Optional
+
+import numpy as np
+
+from benchmarks.synthetic import (
+    get_tiff_file_name,
+    make_field_data,
+    make_functional_coreg_table,
+    make_interleaved_tiff,
+    make_nwbfile_with_imaging_plane,
+    make_timestamps_pickles,
+    make_trial_times,
+    make_trials_data,
+)
+from ophys.micronstiffimagingextractor import MicronsTiffImagingExtractor
+from tools.intervals.intervals import add_trials_from_clip, add_trials_from_monet2, add_trials_from_trippy
+from tools.ophys.ophys import (
+    add_functional_coregistration_to_plane_segmentation,
+    add_plane_segmentation,
+    add_roi_response_series,
+)
+from tools.times.store import TimestampsStore, build_timestamps_store
+
+SCAN_KEY = dict(session=4, scan_idx=7)
+FIELD_KEY = dict(**SCAN_KEY, field=1)
+
+
+def make_inputs(folder_path: str, num_frames: int, num_planes: int, image_size: int, num_masks: int) -> dict:
+    """Generate the synthetic inputs that are shared by the benchmarks."""
+    folder_path = Path(folder_path)
+    tiff_file_path = folder_path / get_tiff_file_name(**SCAN_KEY)
+    make_interleaved_tiff(
+        file_path=str(tiff_file_path),
+        num_frames=num_frames,
+        num_planes=num_planes,
+        num_rows=image_size,
+        num_columns=image_size,
+    )
+    timestamps_file_paths = make_timestamps_pickles(
+        folder_path=folder_path, scan_keys=[SCAN_KEY], num_frames=num_frames
+    )
+    store_paths = {
+        name: build_timestamps_store(file_path=file_path) for name, file_path in timestamps_file_paths.items()
+    }
+    field_data = make_field_data(
+        num_masks=num_masks, num_frames=num_frames, image_height=image_size, image_width=image_size
+    )
+    return dict(
+        tiff_file_path=str(tiff_file_path),
+        num_frames=num_frames,
+        num_planes=num_planes,
+        store_paths=store_paths,
+        field_data=field_data,
+        frame_times=np.arange(num_frames) / 6.3,
+        functional_coreg_table=make_functional_coreg_table(num_units=num_masks, num_matches=num_masks // 2),
+        trials_data=make_trials_data(),
+        trial_times=make_trial_times(scan_key=SCAN_KEY),
+    )
+
+
+def _make_extractor(inputs: dict) -> MicronsTiffImagingExtractor:
+    return MicronsTiffImagingExtractor(
+        file_path=inputs["tiff_file_path"],
+        sampling_frequency=6.3,
+        plane_index=inputs["num_planes"] - 1,
+        num_frames_per_plane=inputs["num_frames"],
+    )
+
+
+def prepare_get_video(inputs: dict) -> Callable:
+    imaging_extractor = _make_extractor(inputs)
+    return lambda: np.asarray(imaging_extractor.get_video())
+
+
+def prepare_get_frames(inputs: dict) -> Callable:
+    imaging_extractor = _make_extractor(inputs)
+    frame_indices = np.sort(np.random.default_rng(0).choice(inputs["num_frames"], inputs["num_frames"] // 10))
+    return lambda: np.asarray(imaging_extractor.get_frames(frame_idxs=frame_indices))
+
+
+def _prepare_plane_segmentation(inputs: dict, mask_format: str) -> Callable:
+    nwbfile, imaging_plane, image_segmentation = make_nwbfile_with_imaging_plane()
+    return lambda: add_plane_segmentation(
+        field_key=FIELD_KEY,
+        nwb=nwbfile,
+        imaging_plane=imaging_plane,
+        image_segmentation=image_segmentation,
+        field_data=inputs["field_data"],
+        mask_format=mask_format,
+    )
+
+
+def _add_pixel_mask_segmentation(inputs: dict) -> tuple:
+    nwbfile, imaging_plane, image_segmentation = make_nwbfile_with_imaging_plane()
+    plane_segmentation = add_plane_segmentation(
+        field_key=FIELD_KEY,
+        nwb=nwbfile,
+        imaging_plane=imaging_plane,
+        image_segmentation=image_segmentation,
+        field_data=inputs["field_data"],
+        mask_format="pixel_mask",
+    )
+    return nwbfile, plane_segmentation
+
+
+def prepare_roi_response_series(inputs: dict) -> Callable:
+    nwbfile, plane_segmentation = _add_pixel_mask_segmentation(inputs)
+    return lambda: add_roi_response_series(
+        field_key=FIELD_KEY,
+        nwb=nwbfile,
+        plane_segmentation=plane_segmentation,
+        timestamps=inputs["frame_times"],
+        field_data=inputs["field_data"],
+    )
+
+
+def prepare_functional_coregistration(inputs: dict) -> Callable:
+    _, plane_segmentation = _add_pixel_mask_segmentation(inputs)
+    return lambda: add_functional_coregistration_to_plane_segmentation(
+        field_key=FIELD_KEY,
+        functional_coreg_table=inputs["functional_coreg_table"],
+        plane_segmentation=plane_segmentation,
+        unit_ids=inputs["field_data"]["unit_ids"],
+    )
+
+
+def _prepare_trials(inputs: dict, add_trials_function: Callable, stimulus_type: str) -> Callable:
+    nwbfile, _, _ = make_nwbfile_with_imaging_plane()
+    trial_times = inputs["trial_times"]
+    return lambda: add_trials_function(
+        nwbfile,
+        scan_key=SCAN_KEY,
+        trial_times=trial_times[trial_times["type"] == f"stimulus.{stimulus_type}"],
+        trial_data=inputs["trials_data"][stimulus_type],
+    )
+
+
+def prepare_timestamps(inputs: dict) -> Callable:
+    def get_scans():
+        for store_path in inputs["store_paths"].values():
+            TimestampsStore(store_path=store_path).get_scan(scan_key=SCAN_KEY)
+
+    return get_scans
+
+
+BENCHMARKS = dict(
+    extractor_get_video=prepare_get_video,
+    extractor_get_frames=prepare_get_frames,
+    add_plane_segmentation_image_mask=lambda inputs: _prepare_plane_segmentation(inputs, mask_format="image_mask"),
+    add_plane_segmentation_pixel_mask=lambda inputs: _prepare_plane_segmentation(inputs, mask_format="pixel_mask"),
+    add_roi_response_series=prepare_roi_response_series,
+    add_functional_coregistration_to_plane_segmentation=prepare_functional_coregistration,
+    add_trials_from_trippy=lambda inputs: _prepare_trials(inputs, add_trials_from_trippy, stimulus_type="Trippy"),
+    add_trials_from_clip=lambda inputs: _prepare_trials(inputs, add_trials_from_clip, stimulus_type="Clip"),
+    add_trials_from_monet2=lambda inputs: _prepare_trials(inputs, add_trials_from_monet2, stimulus_type="Monet2"),
+    timestamps_get_scan=prepare_timestamps,
+)
+
+
+def _get_git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True, cwd=Path(__file__).parent
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(
+    num_frames: int = 1000,
+    num_planes: int = 4,
+    image_size: int = 256,
+    num_masks: int = 1000,
+    repeats: int = 5,
+    benchmark_names: Optional[list] = None,
+) -> dict:
+    parameters = dict(num_frames=num_frames, num_planes=num_planes, image_size=image_size, num_masks=num_masks)
+    results = dict()
+    with TemporaryDirectory() as folder_path:
+        inputs = make_inputs(folder_path=folder_path, **parameters)
+        for benchmark_name in benchmark_names or BENCHMARKS:
+            durations = []
+            for _ in range(repeats):
+                run = BENCHMARKS[benchmark_name](inputs)
+                start_time = perf_counter()
+                run()
+                durations.append(perf_counter() - start_time)
+            results[benchmark_name] = dict(min_seconds=min(durations), median_seconds=float(np.median(durations)))
+
+    return dict(
+        parameters=dict(**parameters, repeats=repeats),
+        environment=dict(python=sys.version.split()[0], platform=platform.platform(), commit=_get_git_commit()),
+        results=results,
+    )
+
+
+def compare_to_baseline(results: dict, baseline: dict) -> dict:
+    """The ratio of the minimum time of each benchmark to the baseline, for the benchmarks in both."""
+    if results["parameters"] != baseline["parameters"]:
+        print(f"The baseline was run with other parameters: {baseline['parameters']}")
+    ratios = dict()
+    for benchmark_name, result in results["results"].items():
+        if benchmark_name in baseline["results"]:
+            ratios[benchmark_name] = result["min_seconds"] / baseline["results"][benchmark_name]["min_seconds"]
+    return ratios
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("--num-frames", type=int, default=1000, help="The number of frames per plane.")
+    parser.add_argument("--num-planes", type=int, default=4)
+    parser.add_argument("--image-size", type=int, default=256, help="The number of rows and columns of the frames.")
+    parser.add_argument("--num-masks", type=int, default=1000)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--benchmarks", nargs="+", choices=list(BENCHMARKS), help="By default all the benchmarks.")
+    parser.add_argument("--output-file-path", type=str, help="The JSON file to save the results to.")
+    parser.add_argument("--baseline-file-path", type=str, help="The JSON file of the results to compare with.")
+    parser.add_argument("--threshold", type=float, default=1.2, help="The slowdown to report as a regression.")
+    args = parser.parse_args()
+
+    run_results = run_benchmarks(
+        num_frames=args.num_frames,
+        num_planes=args.num_planes,
+        image_size=args.image_size,
+        num_masks=args.num_masks,
+        repeats=args.repeats,
+        benchmark_names=args.benchmarks,
+    )
+    if args.output_file_path is not None:
+        with open(args.output_file_path, "w") as f:
+            json.dump(run_results, f, indent=2)
+
+    baseline_ratios = dict()
+    if args.baseline_file_path is not None:
+        with open(args.baseline_file_path, "r") as f:
+            baseline_ratios = compare_to_baseline(results=run_results, baseline=json.load(f))
+
+    for name, benchmark_result in run_results["results"].items():
+        ratio = f", {baseline_ratios[name]:5.2f}x the baseline" if name in baseline_ratios else ""
+        print(
+            f"{name:>52}: min {benchmark_result['min_seconds'] * 1e3:9.2f} ms, "
+            f"median {benchmark_result['median_seconds'] * 1e3:9.2f} ms{ratio}"
+        )
+
+    regressions = [name for name, ratio in baseline_ratios.items() if ratio > args.threshold]
+    if regressions:
+        sys.exit(f"Slower than the baseline by more than {args.threshold}x: {', '.join(regressions)}")
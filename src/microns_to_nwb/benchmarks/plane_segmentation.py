@@ -0,0 +1,85 @@
+"""
+Benchmark of the dense 'image_mask' and the sparse 'pixel_mask' storage of the plane segmentation.
+
+Each mode is run in a fresh process on the same synthetic field, and the peak resident memory, the time to
+build and write the PlaneSegmentation and the size of the written file are reported.
+Run from 'src/microns_to_nwb' with 'python -m benchmarks.plane_segmentation'.
+"""
+import multiprocessing
+import resource
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+from pynwb import NWBHDF5IO
+
+from benchmarks.synthetic import make_nwbfile_with_imaging_plane, make_segmentation
+from tools.ophys.ophys import add_plane_segmentation
+
+
+def _get_peak_rss_in_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _run_mode(mask_format: str, nwbfile_path: str, **segmentation_kwargs) -> dict:
+    field_data = make_segmentation(**segmentation_kwargs)
+    baseline_rss = _get_peak_rss_in_mb()
+
+    start_time = perf_counter()
+    nwbfile, imaging_plane, image_segmentation = make_nwbfile_with_imaging_plane(identifier=mask_format)
+    add_plane_segmentation(
+        field_key=dict(session=4, scan_idx=7, field=1),
+        nwb=nwbfile,
+        imaging_plane=imaging_plane,
+        image_segmentation=image_segmentation,
+        field_data=field_data,
+        mask_format=mask_format,
+    )
+    with NWBHDF5IO(nwbfile_path, mode="w") as io:
+        io.write(nwbfile)
+
+    return dict(
+        mask_format=mask_format,
+        seconds=perf_counter() - start_time,
+        peak_rss_mb=_get_peak_rss_in_mb() - baseline_rss,
+        file_size_mb=Path(nwbfile_path).stat().st_size / 1024**2,
+    )
+
+
+def run_benchmark(**segmentation_kwargs) -> list:
+    results = []
+    with TemporaryDirectory() as folder_path:
+        for mask_format in ("image_mask", "pixel_mask"):
+            # A fresh process per mode, so that the peak memory of one mode does not mask the other
+            with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+                future = executor.submit(
+                    _run_mode,
+                    mask_format=mask_format,
+                    nwbfile_path=str(Path(folder_path) / f"{mask_format}.nwb"),
+                    **segmentation_kwargs,
+                )
+                results.append(future.result())
+    return results
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("--num-masks", type=int, default=2000)
+    parser.add_argument("--image-height", type=int, default=512)
+    parser.add_argument("--image-width", type=int, default=512)
+    parser.add_argument("--pixels-per-mask", type=int, default=300)
+    args = parser.parse_args()
+
+    for result in run_benchmark(
+        num_masks=args.num_masks,
+        image_height=args.image_height,
+        image_width=args.image_width,
+        pixels_per_mask=args.pixels_per_mask,
+    ):
+        print(
+            f"{result['mask_format']:>10}: {result['seconds']:6.1f} s, "
+            f"peak RSS +{result['peak_rss_mb']:8.1f} MB, file size {result['file_size_mb']:8.1f} MB"
+        )
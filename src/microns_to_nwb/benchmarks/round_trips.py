@@ -0,0 +1,104 @@
+"""
+Benchmark of the database round-trips for the ophys data and the imaging metadata of a scan.
+
+Compares the previous per-field fetches (each field, and the imaging interface, queried the tables separately)
+with the bulk queries of 'tools.database.SessionData' on the same scan, and checks that both fetch identical data.
+The connection to the database is configured by importing 'convert_session'.
+Run from 'src/microns_to_nwb' with 'python -m benchmarks.round_trips'.
+"""
+from argparse import ArgumentParser
+from time import perf_counter
+
+import numpy as np
+
+import convert_session  # noqa: F401
+from tools.database import SessionData, fetch, fetch1, get_num_round_trips
+
+
+def fetch_per_field(scan_key: dict, fetch_traces: bool = True) -> list:
+    """The fetches of 'fetch_ophys_data' and of the imaging interface before the data of a session was shared."""
+    all_field_data = fetch("Field", scan_key, as_dict=True)
+    for field_data in all_field_data:
+        field_key = {**scan_key, **dict(field=field_data["field"])}
+        (
+            field_data["mask_pixels"],
+            field_data["mask_weights"],
+            field_data["mask_ids"],
+            field_data["mask_types"],
+        ) = fetch(
+            ("Segmentation", "MaskClassification"),
+            field_key,
+            "pixels",
+            "weights",
+            "mask_id",
+            "mask_type",
+            order_by="mask_id",
+        )
+        field_data["unit_ids"] = fetch("ScanUnit", field_key, "unit_id")
+        if fetch_traces:
+            field_data["traces"] = fetch("Fluorescence", field_key, "trace", order_by="mask_id")
+        field_data["correlation_image"], field_data["average_image"] = fetch1(
+            "SummaryImages", field_key, "correlation", "average"
+        )
+
+    # MicronsTiffImagingInterface.get_metadata and run_conversion
+    fetch("Field", scan_key, as_dict=True)
+    fetch1("Scan", scan_key, "fps")
+    fetch1("Scan", scan_key, "nframes", "nfields", "fps")
+
+    return all_field_data
+
+
+def fetch_per_session(scan_key: dict, fetch_traces: bool = True) -> list:
+    session_data = SessionData(scan_key)
+    all_field_data = [dict(field_data) for field_data in session_data.get_fields()]
+    for field_data in all_field_data:
+        field_data.update(session_data.get_field_data(field_data["field"], fetch_traces=fetch_traces))
+
+    session_data.get_fields()
+    session_data.get_scan()
+
+    return all_field_data
+
+
+def _is_equal(first, second) -> bool:
+    if isinstance(first, np.ndarray) and first.dtype == object:
+        return len(first) == len(second) and all(_is_equal(a, b) for a, b in zip(first, second))
+    return np.array_equal(first, second)
+
+
+def run_benchmark(scan_key: dict, fetch_traces: bool = True) -> dict:
+    results = dict()
+    all_field_data = dict()
+    for mode, fetch_data in (("per_field", fetch_per_field), ("per_session", fetch_per_session)):
+        num_round_trips = get_num_round_trips()
+        start_time = perf_counter()
+        all_field_data[mode] = fetch_data(scan_key=scan_key, fetch_traces=fetch_traces)
+        results[f"{mode}_seconds"] = perf_counter() - start_time
+        results[f"{mode}_round_trips"] = get_num_round_trips() - num_round_trips
+
+    for field_data, session_field_data in zip(all_field_data["per_field"], all_field_data["per_session"]):
+        for name, value in field_data.items():
+            if not _is_equal(value, session_field_data[name]):
+                raise AssertionError(f"The '{name}' of field {field_data['field']} differs between the modes.")
+    results["num_fields"] = len(all_field_data["per_field"])
+
+    return results
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("--session", type=int, default=4)
+    parser.add_argument("--scan-idx", type=int, default=7)
+    parser.add_argument("--without-traces", action="store_true", help="Skip the traces, as when they are streamed.")
+    args = parser.parse_args()
+
+    results = run_benchmark(
+        scan_key=dict(session=args.session, scan_idx=args.scan_idx), fetch_traces=not args.without_traces
+    )
+    print(
+        f"{results['num_fields']} fields: "
+        f"per field {results['per_field_round_trips']} round-trips in {results['per_field_seconds']:.2f} s, "
+        f"per session {results['per_session_round_trips']} round-trips in {results['per_session_seconds']:.2f} s, "
+        "the fetched data is identical."
+    )
@@ -0,0 +1,325 @@
+"""
+Synthetic inputs with the shapes of the real data, for running the benchmarks without the databases.
+
+Generates interleaved multi-field TIFFs (as exported from ScanImage), the stimulus movies, the v8 timestamps
+pickles read by 'tools.times', the segmentation, traces and summary images of a field, the functional
+coregistration table and the trials of each stimulus type. The inputs of a session can be written to a folder with
+'python -m benchmarks.synthetic --folder-path <folder>', run from 'src/microns_to_nwb'.
+"""
+from argparse import ArgumentParser
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from pynwb import NWBFile
+from pynwb.ophys import ImageSegmentation, OpticalChannel
+from tifffile import imwrite
+
+from tools.intervals.intervals import _STIMULUS_ATTRIBUTES
+
+STIMULUS_TYPES = ("Trippy", "Clip", "Monet2")
+
+
+def get_tiff_file_name(animal_id: int = 17797, session: int = 4, scan_idx: int = 7) -> str:
+    """The name of the TIFF of a scan, from which 'convert_session' parses the session and the scan index."""
+    return f"functional_scan_{animal_id}_{session}_{scan_idx}_v2.tif"
+
+
+def make_interleaved_tiff(
+    file_path: str, num_frames: int = 500, num_planes: int = 4, num_rows: int = 256, num_columns: int = 256
+):
+    """Write a TIFF where page i holds frame i // num_planes of plane i % num_planes."""
+    rng = np.random.default_rng(0)
+    pages = (
+        rng.integers(0, 2**12, size=(num_rows, num_columns), dtype=np.int16) for _ in range(num_frames * num_planes)
+    )
+    imwrite(file_path, data=pages, shape=(num_frames * num_planes, num_rows, num_columns), dtype=np.int16)
+
+
+def make_segmentation(
+    num_masks: int = 2000, image_height: int = 512, image_width: int = 512, pixels_per_mask: int = 300, seed: int = 0
+) -> dict:
+    """Field data with the segmentation attributes of 'nda.Segmentation' and 'nda.MaskClassification'."""
+    rng = np.random.default_rng(seed)
+    mask_pixels = np.empty(num_masks, dtype=object)
+    mask_weights = np.empty(num_masks, dtype=object)
+    for mask_index in range(num_masks):
+        num_pixels = rng.integers(pixels_per_mask // 2, pixels_per_mask * 3 // 2)
+        # One-based indices into the column-major flattened image
+        mask_pixels[mask_index] = np.sort(rng.choice(image_height * image_width, num_pixels, replace=False)) + 1
+        mask_weights[mask_index] = rng.random(num_pixels).astype(np.float32)
+
+    return dict(
+        px_height=image_height,
+        px_width=image_width,
+        mask_pixels=mask_pixels,
+        mask_weights=mask_weights,
+        mask_ids=np.arange(1, num_masks + 1),
+        mask_types=np.array(["soma"] * num_masks, dtype=object),
+    )
+
+
+def make_field_data(
+    field: int = 1,
+    num_masks: int = 2000,
+    num_frames: int = 1000,
+    image_height: int = 512,
+    image_width: int = 512,
+    pixels_per_mask: int = 300,
+    seed: int = 0,
+) -> dict:
+    """The data of a field as returned by 'fetch_ophys_data', with one trace of 'num_frames' per mask."""
+    rng = np.random.default_rng(seed)
+    field_data = make_segmentation(
+        num_masks=num_masks,
+        image_height=image_height,
+        image_width=image_width,
+        pixels_per_mask=pixels_per_mask,
+        seed=seed,
+    )
+    traces = np.empty(num_masks, dtype=object)
+    for mask_index in range(num_masks):
+        traces[mask_index] = rng.random(num_frames).astype(np.float32)
+
+    field_data.update(
+        field=field,
+        traces=traces,
+        # The units are numbered across the fields of a scan
+        unit_ids=np.arange(1, num_masks + 1) + (field - 1) * num_masks,
+        correlation_image=rng.random((image_height, image_width)),
+        average_image=rng.random((image_height, image_width)),
+    )
+    return field_data
+
+
+def make_functional_coreg_table(
+    num_units: int = 8000, num_matches: int = 4000, seed: int = 0, differing_duplicates: bool = False
+) -> pd.DataFrame:
+    """
+    A table with the columns of 'functional_coreg', where some units are matched to more than one CAVE id.
+
+    With 'differing_duplicates', the second match of a unit is a different segment, with its own 'pt_*' values.
+    """
+    rng = np.random.default_rng(seed)
+    matched_unit_ids = np.sort(rng.choice(np.arange(1, num_units + 1), size=num_matches, replace=False))
+    # Roughly 5% of the matched units have a second entry
+    duplicated_unit_ids = rng.choice(matched_unit_ids, size=num_matches // 20, replace=False)
+    unit_ids = np.concatenate([matched_unit_ids, duplicated_unit_ids])
+
+    num_rows = len(unit_ids)
+    supervoxel_ids = dict(zip(matched_unit_ids, rng.integers(7e16, 9e16, size=num_matches)))
+    root_ids = dict(zip(matched_unit_ids, rng.integers(8.6e17, 8.7e17, size=num_matches)))
+    positions = dict(zip(matched_unit_ids, rng.integers(0, 300000, size=(num_matches, 3))))
+    functional_coreg_table = pd.DataFrame(
+        dict(
+            id=np.arange(num_rows) + 1,
+            session=np.full(num_rows, 4),
+            scan_idx=np.full(num_rows, 7),
+            unit_id=unit_ids,
+            pt_supervoxel_id=[supervoxel_ids[unit_id] for unit_id in unit_ids],
+            pt_root_id=[root_ids[unit_id] for unit_id in unit_ids],
+            pt_position_x=[positions[unit_id][0] for unit_id in unit_ids],
+            pt_position_y=[positions[unit_id][1] for unit_id in unit_ids],
+            pt_position_z=[positions[unit_id][2] for unit_id in unit_ids],
+        )
+    )
+    if differing_duplicates:
+        duplicates = np.arange(num_matches, num_rows)
+        num_duplicates = len(duplicates)
+        functional_coreg_table.loc[duplicates, "pt_supervoxel_id"] = rng.integers(7e16, 9e16, size=num_duplicates)
+        functional_coreg_table.loc[duplicates, "pt_root_id"] = rng.integers(8.6e17, 8.7e17, size=num_duplicates)
+        functional_coreg_table.loc[duplicates, ["pt_position_x", "pt_position_y", "pt_position_z"]] = rng.integers(
+            0, 300000, size=(num_duplicates, 3)
+        )
+    return functional_coreg_table
+
+
+def make_trials_data(num_trials: int = 300, seed: int = 0) -> dict:
+    """The attributes of the join of 'nda.Trial' with each stimulus table, for trials cycling through the types."""
+    rng = np.random.default_rng(seed)
+    trials_data = dict()
+    for stimulus_index, stimulus_type in enumerate(STIMULUS_TYPES):
+        trial_indices = np.arange(stimulus_index, num_trials, len(STIMULUS_TYPES))
+        num_stimulus_trials = len(trial_indices)
+        # A few conditions are repeated across the trials
+        condition_hashes = np.array([f"{stimulus_type[0]}{index:019d}" for index in range(20)], dtype=object)
+        values = dict(
+            trial_idx=trial_indices,
+            condition_hash=condition_hashes[rng.integers(0, len(condition_hashes), size=num_stimulus_trials)],
+            type=np.array([f"stimulus.{stimulus_type}"] * num_stimulus_trials, dtype=object),
+            rng_seed=rng.integers(0, 1000, size=num_stimulus_trials),
+            duration=rng.uniform(10.0, 15.0, size=num_stimulus_trials).astype(np.float32),
+            tex_ydim=np.full(num_stimulus_trials, 90),
+            tex_xdim=np.full(num_stimulus_trials, 160),
+            xnodes=np.full(num_stimulus_trials, 8),
+            ynodes=np.full(num_stimulus_trials, 6),
+            up_factor=np.full(num_stimulus_trials, 24),
+            temp_freq=np.full(num_stimulus_trials, 4.0),
+            temp_kernel_length=np.full(num_stimulus_trials, 61),
+            spatial_freq=np.full(num_stimulus_trials, 0.06),
+            movie_name=np.array(["cinematic/clip.mp4"] * num_stimulus_trials, dtype=object),
+            short_movie_name=np.array(["cinematic"] * num_stimulus_trials, dtype=object),
+            blue_green_saturation=np.zeros(num_stimulus_trials, dtype=np.float32),
+            pattern_width=np.full(num_stimulus_trials, 64),
+            pattern_aspect=np.full(num_stimulus_trials, 1.7),
+            temp_kernel=np.array(["half-hamming"] * num_stimulus_trials, dtype=object),
+            temp_bandwidth=np.full(num_stimulus_trials, 4.0, dtype=np.float32),
+            ori_coherence=np.full(num_stimulus_trials, 2.5, dtype=np.float32),
+            ori_fraction=np.full(num_stimulus_trials, 0.4),
+            ori_mix=np.full(num_stimulus_trials, 1.0),
+            n_dirs=np.full(num_stimulus_trials, 16),
+        )
+        trials_data[stimulus_type] = {name: values[name] for name in _STIMULUS_ATTRIBUTES[stimulus_type]}
+    return trials_data
+
+
+def make_trial_times(scan_key: dict, num_trials: int = 300) -> pd.DataFrame:
+    """The rows of 'Trial.pkl' for a scan, with consecutive trials of 15 seconds."""
+    start_frame_times = np.arange(num_trials) * 15.0 + 10.0
+    return pd.DataFrame(
+        dict(
+            session=np.full(num_trials, int(scan_key["session"])),
+            scan_idx=np.full(num_trials, int(scan_key["scan_idx"])),
+            trial_idx=np.arange(num_trials),
+            type=[f"stimulus.{STIMULUS_TYPES[trial_index % len(STIMULUS_TYPES)]}" for trial_index in range(num_trials)],
+            start_frame_time=start_frame_times,
+            end_frame_time=start_frame_times + 14.9,
+        )
+    )
+
+
+def make_timestamps_pickles(
+    folder_path: str,
+    scan_keys: list,
+    num_frames: int = 1000,
+    frame_rate: float = 6.3,
+    num_movie_frames: int = 5000,
+    num_trials: int = 300,
+) -> dict:
+    """Write 'ScanTimes.pkl', 'v8_movie_timestamps.pkl' and 'Trial.pkl' with the rows of each of the 'scan_keys'."""
+    folder_path = Path(folder_path)
+    folder_path.mkdir(parents=True, exist_ok=True)
+    sessions = [int(scan_key["session"]) for scan_key in scan_keys]
+    scan_indices = [int(scan_key["scan_idx"]) for scan_key in scan_keys]
+
+    file_paths = dict(
+        ophys_timestamps_file_path=folder_path / "ScanTimes.pkl",
+        stimulus_movie_timestamps_file_path=folder_path / "v8_movie_timestamps.pkl",
+        trial_timestamps_file_path=folder_path / "Trial.pkl",
+    )
+    pd.DataFrame(
+        dict(
+            session=sessions,
+            scan_idx=scan_indices,
+            frame_times=[np.arange(num_frames) / frame_rate for _ in scan_keys],
+        )
+    ).to_pickle(file_paths["ophys_timestamps_file_path"])
+    pd.DataFrame(
+        dict(
+            session=sessions,
+            scan_idx=scan_indices,
+            full_flips=[np.arange(num_movie_frames) / 60.0 for _ in scan_keys],
+        )
+    ).to_pickle(file_paths["stimulus_movie_timestamps_file_path"])
+    pd.concat([make_trial_times(scan_key=scan_key, num_trials=num_trials) for scan_key in scan_keys]).to_pickle(
+        file_paths["trial_timestamps_file_path"]
+    )
+    return file_paths
+
+
+def get_stimulus_movie_file_name(animal_id: int = 17797, session: int = 4, scan_idx: int = 7) -> str:
+    return f"stimulus_{animal_id}_{session}_{scan_idx}_v4.avi"
+
+
+def make_stimulus_movie(
+    file_path: str,
+    num_frames: int = 5000,
+    num_rows: int = 144,
+    num_columns: int = 256,
+    fps: float = 60.0,
+    codec: str = "MJPG",
+):
+    """Write an AVI of a smooth moving RGB pattern, like the natural clips of the stimulus, in the FourCC 'codec'."""
+    import cv2
+
+    rows, columns = np.meshgrid(np.arange(num_rows), np.arange(num_columns), indexing="ij")
+    video_writer = cv2.VideoWriter(file_path, cv2.VideoWriter_fourcc(*codec), fps, (num_columns, num_rows))
+    if not video_writer.isOpened():
+        raise ValueError(f"The '{codec}' codec is not available to write '{file_path}'.")
+    try:
+        for frame_index in range(num_frames):
+            phase = frame_index / 10
+            pattern = 127 + 100 * np.sin(rows / 12 + phase) * np.cos(columns / 20 - phase)
+            video_writer.write(np.repeat(pattern.astype(np.uint8)[..., np.newaxis], 3, axis=-1))
+    finally:
+        video_writer.release()
+
+
+def make_nwbfile_with_imaging_plane(identifier: str = "benchmark") -> tuple:
+    """An NWBFile with an imaging plane and an ImageSegmentation to add the plane segmentations to."""
+    nwbfile = NWBFile(
+        session_description="Synthetic session for the benchmarks.",
+        identifier=identifier,
+        session_start_time=datetime(2018, 3, 4).astimezone(),
+    )
+    device = nwbfile.create_device(name="Microscope")
+    imaging_plane = nwbfile.create_imaging_plane(
+        name="ImagingPlane1",
+        optical_channel=OpticalChannel(name="OpticalChannel", description="an optical channel", emission_lambda=500.0),
+        description="The imaging plane for the benchmark.",
+        device=device,
+        excitation_lambda=920.0,
+        imaging_rate=np.nan,
+        indicator="GCaMP6",
+        location="VISp",
+    )
+    ophys = nwbfile.create_processing_module("ophys", "processed 2p data")
+    image_segmentation = ImageSegmentation()
+    ophys.add(image_segmentation)
+    return nwbfile, imaging_plane, image_segmentation
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("--folder-path", type=str, required=True)
+    parser.add_argument("--session", type=int, default=4)
+    parser.add_argument("--scan-idx", type=int, default=7)
+    parser.add_argument("--num-frames", type=int, default=1000, help="The number of frames per plane.")
+    parser.add_argument("--num-planes", type=int, default=4)
+    parser.add_argument("--num-rows", type=int, default=256)
+    parser.add_argument("--num-columns", type=int, default=256)
+    parser.add_argument("--num-movie-frames", type=int, default=5000)
+    parser.add_argument("--num-trials", type=int, default=300)
+    args = parser.parse_args()
+
+    folder_path = Path(args.folder_path)
+    folder_path.mkdir(parents=True, exist_ok=True)
+    scan_key = dict(session=args.session, scan_idx=args.scan_idx)
+    tiff_file_path = folder_path / get_tiff_file_name(session=args.session, scan_idx=args.scan_idx)
+    make_interleaved_tiff(
+        file_path=str(tiff_file_path),
+        num_frames=args.num_frames,
+        num_planes=args.num_planes,
+        num_rows=args.num_rows,
+        num_columns=args.num_columns,
+    )
+    stimulus_movie_file_path = folder_path / get_stimulus_movie_file_name(session=args.session, scan_idx=args.scan_idx)
+    make_stimulus_movie(file_path=str(stimulus_movie_file_path), num_frames=args.num_movie_frames)
+    timestamps_file_paths = make_timestamps_pickles(
+        folder_path=folder_path,
+        scan_keys=[scan_key],
+        num_frames=args.num_frames,
+        num_movie_frames=args.num_movie_frames,
+        num_trials=args.num_trials,
+    )
+    make_functional_coreg_table(num_units=2000 * args.num_planes, num_matches=1000 * args.num_planes).to_pickle(
+        folder_path / "functional_coreg.pkl"
+    )
+    for file_path in [
+        tiff_file_path,
+        stimulus_movie_file_path,
+        *timestamps_file_paths.values(),
+        folder_path / "functional_coreg.pkl",
+    ]:
+        print(file_path)
@@ -0,0 +1,158 @@
+"""
+Benchmark of the per-plane and the single-pass reading of an interleaved multi-field TIFF.
+
+Both readers fill one (frames, columns, rows) HDF5 dataset per plane from the same synthetic TIFF. The file is
+evicted from the page cache before each reader, and the time, throughput and the bytes read from storage
+(from '/proc/self/io', when available) are reported.
+Run from 'src/microns_to_nwb' with 'python -m benchmarks.tiff_reader'.
+"""
+import os
+from argparse import ArgumentParser
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from typing import Optional
+
+import numpy as np
+from h5py import File
+from neuroconv.tools.roiextractors.imagingextractordatachunkiterator import ImagingExtractorDataChunkIterator
+
+from ophys.micronstiffimagingextractor import MicronsTiffImagingExtractor
+from benchmarks.synthetic import make_interleaved_tiff
+from ophys.micronstiffplanereader import MicronsTiffPlaneReader
+
+
+def _get_storage_bytes_read() -> Optional[int]:
+    try:
+        with open("/proc/self/io", "r") as f:
+            io_counters = dict(line.split(": ") for line in f.read().splitlines())
+    except OSError:
+        return None
+    return int(io_counters["read_bytes"])
+
+
+def _evict_from_page_cache(file_path: str):
+    file_descriptor = os.open(file_path, os.O_RDONLY)
+    try:
+        os.fsync(file_descriptor)
+        os.posix_fadvise(file_descriptor, 0, 0, os.POSIX_FADV_DONTNEED)
+    finally:
+        os.close(file_descriptor)
+
+
+def _create_datasets(file: File, num_planes: int, num_frames: int, num_rows: int, num_columns: int, dtype) -> list:
+    return [
+        file.create_dataset(
+            name=f"TwoPhotonSeries{plane_index + 1}",
+            shape=(num_frames, num_columns, num_rows),
+            dtype=dtype,
+            chunks=(min(num_frames, 16), num_columns, num_rows),
+        )
+        for plane_index in range(num_planes)
+    ]
+
+
+def _read_per_plane(tiff_file_path: str, datasets: list, num_frames: int, buffer_gb: float) -> int:
+    bytes_requested = 0
+    for plane_index, dataset in enumerate(datasets):
+        imaging_extractor = MicronsTiffImagingExtractor(
+            file_path=tiff_file_path,
+            sampling_frequency=30.0,
+            plane_index=plane_index,
+            num_frames_per_plane=num_frames,
+        )
+        frames_iterator = ImagingExtractorDataChunkIterator(imaging_extractor=imaging_extractor, buffer_gb=buffer_gb)
+        for data_chunk in frames_iterator:
+            dataset[data_chunk.selection] = data_chunk.data
+            bytes_requested += data_chunk.data.nbytes
+    return bytes_requested
+
+
+def _read_single_pass(tiff_file_path: str, datasets: list, num_frames: int, buffer_gb: float) -> int:
+    plane_reader = MicronsTiffPlaneReader(file_path=tiff_file_path, num_frames_per_plane=num_frames)
+    plane_reader.write_planes(datasets=datasets, buffer_gb=buffer_gb)
+    return plane_reader.bytes_read
+
+
+def run_benchmark(
+    num_frames: int = 500, num_planes: int = 4, num_rows: int = 256, num_columns: int = 256, buffer_gb: float = 0.1
+) -> list:
+    results = []
+    with TemporaryDirectory() as folder_path:
+        tiff_file_path = str(Path(folder_path) / "scan.tif")
+        make_interleaved_tiff(
+            file_path=tiff_file_path,
+            num_frames=num_frames,
+            num_planes=num_planes,
+            num_rows=num_rows,
+            num_columns=num_columns,
+        )
+        file_size = Path(tiff_file_path).stat().st_size
+
+        for reader_name, read in (("per_plane", _read_per_plane), ("single_pass", _read_single_pass)):
+            _evict_from_page_cache(file_path=tiff_file_path)
+            storage_bytes_read = _get_storage_bytes_read()
+            with File(Path(folder_path) / f"{reader_name}.h5", "w") as file:
+                datasets = _create_datasets(
+                    file=file,
+                    num_planes=num_planes,
+                    num_frames=num_frames,
+                    num_rows=num_rows,
+                    num_columns=num_columns,
+                    dtype=np.int16,
+                )
+                start_time = perf_counter()
+                bytes_requested = read(
+                    tiff_file_path=tiff_file_path, datasets=datasets, num_frames=num_frames, buffer_gb=buffer_gb
+                )
+                seconds = perf_counter() - start_time
+
+            if storage_bytes_read is not None:
+                storage_bytes_read = _get_storage_bytes_read() - storage_bytes_read
+            results.append(
+                dict(
+                    reader=reader_name,
+                    seconds=seconds,
+                    throughput_mb_per_s=file_size / 1e6 / seconds,
+                    bytes_requested=bytes_requested,
+                    storage_bytes_read=storage_bytes_read,
+                    file_size=file_size,
+                )
+            )
+
+        with File(Path(folder_path) / "per_plane.h5", "r") as per_plane, File(
+            Path(folder_path) / "single_pass.h5", "r"
+        ) as single_pass:
+            for dataset_name in per_plane:
+                for start_frame in range(0, num_frames, 100):
+                    frames_selection = slice(start_frame, start_frame + 100)
+                    np.testing.assert_array_equal(
+                        per_plane[dataset_name][frames_selection], single_pass[dataset_name][frames_selection]
+                    )
+
+    return results
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("--num-frames", type=int, default=500, help="The number of frames per plane.")
+    parser.add_argument("--num-planes", type=int, default=4)
+    parser.add_argument("--num-rows", type=int, default=256)
+    parser.add_argument("--num-columns", type=int, default=256)
+    parser.add_argument("--buffer-gb", type=float, default=0.1)
+    args = parser.parse_args()
+
+    for result in run_benchmark(
+        num_frames=args.num_frames,
+        num_planes=args.num_planes,
+        num_rows=args.num_rows,
+        num_columns=args.num_columns,
+        buffer_gb=args.buffer_gb,
+    ):
+        storage_bytes_read = result["storage_bytes_read"]
+        storage_mb_read = "n/a" if storage_bytes_read is None else f"{storage_bytes_read / 1e6:8.1f} MB"
+        print(
+            f"{result['reader']:>11}: {result['seconds']:6.2f} s, {result['throughput_mb_per_s']:8.1f} MB/s, "
+            f"requested {result['bytes_requested'] / 1e6:8.1f} MB, read from storage {storage_mb_read} "
+            f"(file size {result['file_size'] / 1e6:.1f} MB)"
+        )
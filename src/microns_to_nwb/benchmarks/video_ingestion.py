@@ -0,0 +1,149 @@
+"""
+Benchmark of the ingestion of the stimulus movie with the VideoInterface and with the MicronsVideoInterface.
+
+The same movie and timestamps are written into an NWB file by the VideoInterface (frames decoded one by one on a
+single core, timestamps passed as a list) and by the MicronsVideoInterface with each number of '--max-decode-workers'
+(frames decoded in parallel frame ranges and streamed in buffers of '--buffer-gb'). The movie is a real stimulus movie
+given with '--movie-file-path', or a synthetic one encoded with the FourCC '--codec'. The default 'XVID' has inter-frame
+compression, for which the seeking of each frame range is not frame accurate with every backend, unlike MJPEG, then the
+MicronsVideoInterface decodes the movie in a single pass (reported as 'seek accurate: False'). Each ingestion runs in a
+fresh process, and its time, throughput of decoded frames and peak resident memory are reported. The written frames are
+compared with those of the VideoInterface, which reads the movie sequentially.
+Run from 'src/microns_to_nwb' with 'python -m benchmarks.video_ingestion'.
+"""
+import multiprocessing
+import resource
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from typing import Optional
+
+import numpy as np
+from h5py import File
+from neuroconv.datainterfaces import VideoInterface
+
+from benchmarks.synthetic import get_stimulus_movie_file_name, make_nwbfile_with_imaging_plane, make_stimulus_movie
+from video import MicronsVideoDataChunkIterator, MicronsVideoInterface
+
+
+def _ingest(
+    movie_file_path: str,
+    nwbfile_path: str,
+    num_frames: int,
+    max_decode_workers: Optional[int] = None,
+    buffer_gb: float = 1.0,
+) -> dict:
+    """Write the movie into a new NWB file, in the process that is measured."""
+    peak_rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    timestamps = np.arange(num_frames) / 60.0
+    # The jitter of the real movie timestamps, which are stored as timestamps rather than with a rate
+    timestamps += np.random.default_rng(0).normal(scale=1e-4, size=len(timestamps))
+    nwbfile, _, _ = make_nwbfile_with_imaging_plane()
+
+    start_time = perf_counter()
+    if max_decode_workers is None:
+        interface = VideoInterface(file_paths=[movie_file_path])
+        conversion_options = dict(timestamps=timestamps.tolist())
+    else:
+        interface = MicronsVideoInterface(file_paths=[movie_file_path])
+        conversion_options = dict(timestamps=timestamps, max_decode_workers=max_decode_workers, buffer_gb=buffer_gb)
+    interface.run_conversion(
+        nwbfile_path=nwbfile_path,
+        nwbfile=nwbfile,
+        metadata=interface.get_metadata(),
+        overwrite=True,
+        external_mode=False,
+        **conversion_options,
+    )
+    seconds = perf_counter() - start_time
+
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return dict(seconds=seconds, peak_rss_mb=peak_rss / 1e3, peak_rss_delta_mb=(peak_rss - peak_rss_before) / 1e3)
+
+
+def run_benchmark(
+    num_frames: int = 5000,
+    num_rows: int = 144,
+    num_columns: int = 256,
+    max_decode_workers: tuple = (1, 4),
+    buffer_gb: float = 0.1,
+    codec: str = "XVID",
+    movie_file_path: Optional[str] = None,
+) -> list:
+    results = []
+    with TemporaryDirectory() as folder_path:
+        if movie_file_path is None:
+            movie_file_path = str(Path(folder_path) / get_stimulus_movie_file_name())
+            make_stimulus_movie(
+                file_path=movie_file_path,
+                num_frames=num_frames,
+                num_rows=num_rows,
+                num_columns=num_columns,
+                codec=codec,
+            )
+        # The VideoInterface writes every frame of the movie
+        movie_iterator = MicronsVideoDataChunkIterator(file_path=movie_file_path)
+        movie_shape = movie_iterator.maxshape
+        num_frames, movie_mb = movie_shape[0], int(np.prod(movie_shape)) / 1e6
+
+        ingestions = dict(video_interface=None)
+        ingestions.update({f"streamed_{num_workers}_workers": num_workers for num_workers in max_decode_workers})
+        for ingestion_name, num_workers in ingestions.items():
+            nwbfile_path = str(Path(folder_path) / f"{ingestion_name}.nwb")
+            with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+                result = executor.submit(
+                    _ingest,
+                    movie_file_path=movie_file_path,
+                    nwbfile_path=nwbfile_path,
+                    num_frames=num_frames,
+                    max_decode_workers=num_workers,
+                    buffer_gb=buffer_gb,
+                ).result()
+            results.append(
+                dict(
+                    ingestion=ingestion_name,
+                    throughput_mb_per_s=movie_mb / result["seconds"],
+                    seek_is_accurate=movie_iterator.seek_is_accurate,
+                    **result,
+                )
+            )
+
+        with File(Path(folder_path) / "video_interface.nwb", "r") as expected_file:
+            expected_data = expected_file["acquisition"][f"Video: {Path(movie_file_path).stem}"]["data"]
+            for ingestion_name in list(ingestions)[1:]:
+                with File(Path(folder_path) / f"{ingestion_name}.nwb", "r") as file:
+                    data = file["acquisition"][f"Video: {Path(movie_file_path).stem}"]["data"]
+                    for start_frame in range(0, num_frames, 500):
+                        frames_selection = slice(start_frame, start_frame + 500)
+                        np.testing.assert_array_equal(data[frames_selection], expected_data[frames_selection])
+
+    return results
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("--num-frames", type=int, default=5000)
+    parser.add_argument("--num-rows", type=int, default=144)
+    parser.add_argument("--num-columns", type=int, default=256)
+    parser.add_argument("--max-decode-workers", type=int, nargs="+", default=[1, 4])
+    parser.add_argument("--buffer-gb", type=float, default=0.1)
+    parser.add_argument("--codec", default="XVID")
+    parser.add_argument("--movie-file-path", default=None)
+    args = parser.parse_args()
+
+    for result in run_benchmark(
+        num_frames=args.num_frames,
+        num_rows=args.num_rows,
+        num_columns=args.num_columns,
+        max_decode_workers=tuple(args.max_decode_workers),
+        buffer_gb=args.buffer_gb,
+        codec=args.codec,
+        movie_file_path=args.movie_file_path,
+    ):
+        print(
+            f"{result['ingestion']:>20}: {result['seconds']:6.2f} s, {result['throughput_mb_per_s']:8.1f} MB/s, "
+            f"peak RSS {result['peak_rss_mb']:8.1f} MB (+{result['peak_rss_delta_mb']:.1f} MB), "
+            f"seek accurate: {result['seek_is_accurate']}"
+        )
@@ -0,0 +1,186 @@
+"""
+Round-trip check of the 'zarr' backend against the direct HDF5 output.
+
+The same synthetic session (the plane segmentations, the fluorescence traces that share their timestamps and a
+behavioral series) is written directly to HDF5 and as an NWB-Zarr store that is exported to HDF5. Both files are read
+with pynwb and every dataset of every object is compared, along with the objects that they link to. The time of each
+path is reported. Requires 'hdmf-zarr'. Run from 'src/microns_to_nwb' with 'python -m benchmarks.zarr_round_trip'.
+"""
+from argparse import ArgumentParser
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from typing import Optional
+
+import h5py
+import numpy as np
+from hdmf.container import AbstractContainer, Data
+from pynwb import NWBHDF5IO, TimeSeries
+
+from benchmarks.synthetic import make_field_data, make_nwbfile_with_imaging_plane
+from tools.compression import make_data_io
+from tools.ophys.ophys import add_plane_segmentation, add_roi_response_series
+from tools.zarr_backend import export_to_hdf5, write_zarr_nwbfile
+
+COMPRESSION_OPTIONS = dict(
+    RoiResponseSeries=dict(codec="gzip", level=4, shuffle=True),
+    image_masks=dict(codec="gzip", level=1),
+    behavior=dict(codec="gzip"),
+)
+
+
+def make_nwbfile(num_masks: int, num_frames: int, image_size: int, compression_options: Optional[dict] = None):
+    nwbfile, imaging_plane, image_segmentation = make_nwbfile_with_imaging_plane(identifier="zarr_round_trip")
+    # Irregular frame times, which the traces of the second field link to
+    timestamps = np.cumsum(np.random.default_rng(0).uniform(0.1, 0.2, size=num_frames))
+    timestamps_series = None
+    for field, mask_format in ((1, "image_mask"), (2, "pixel_mask")):
+        field_data = make_field_data(
+            field=field,
+            num_masks=num_masks,
+            num_frames=num_frames,
+            image_height=image_size,
+            image_width=image_size,
+            pixels_per_mask=20,
+            seed=field,
+        )
+        field_key = dict(session=4, scan_idx=7, field=field)
+        plane_segmentation = add_plane_segmentation(
+            field_key=field_key,
+            nwb=nwbfile,
+            imaging_plane=imaging_plane,
+            image_segmentation=image_segmentation,
+            field_data=field_data,
+            mask_format=mask_format,
+            compression_options=compression_options,
+        )
+        timestamps_series = add_roi_response_series(
+            field_key=field_key,
+            nwb=nwbfile,
+            plane_segmentation=plane_segmentation,
+            timestamps=timestamps,
+            field_data=field_data,
+            compression_options=compression_options,
+            timestamps_series=timestamps_series,
+        )
+
+    nwbfile.add_acquisition(
+        TimeSeries(
+            name="treadmill_velocity",
+            data=make_data_io(np.cumsum(np.ones(num_frames * 10)), "behavior", compression_options),
+            unit="m/s",
+            starting_time=0.0,
+            rate=100.0,
+        )
+    )
+    return nwbfile
+
+
+def _get_object_path(neurodata_object: AbstractContainer) -> str:
+    names = []
+    while neurodata_object.parent is not None:
+        names.append(neurodata_object.name)
+        neurodata_object = neurodata_object.parent
+    return "/".join(reversed(names))
+
+
+def _get_values(nwbfile) -> dict:
+    """The dataset, linked object or other value of each field of each object, by the path of the object."""
+    values = dict()
+    for neurodata_object in nwbfile.objects.values():
+        fields = dict(neurodata_object.fields)
+        if isinstance(neurodata_object, Data):
+            fields.update(data=neurodata_object.data)
+        object_values = dict()
+        for field_name, value in fields.items():
+            if isinstance(value, AbstractContainer):
+                object_values[field_name] = ("object", _get_object_path(value))
+            elif isinstance(value, (h5py.Dataset, np.ndarray)):
+                object_values[field_name] = ("dataset", value[()])
+            elif isinstance(value, dict):
+                object_values[field_name] = ("children", sorted(value))
+            elif not isinstance(value, (list, tuple)) or all(np.isscalar(item) for item in value):
+                object_values[field_name] = ("value", value)
+        values[_get_object_path(neurodata_object)] = object_values
+    return values
+
+
+def _are_equal(expected, actual) -> bool:
+    if isinstance(expected, np.ndarray) or isinstance(actual, np.ndarray):
+        expected, actual = np.asarray(expected), np.asarray(actual)
+        return (
+            expected.shape == actual.shape
+            and expected.dtype == actual.dtype
+            and np.array_equal(expected, actual, equal_nan=expected.dtype.kind == "f")
+        )
+    if isinstance(expected, float) and isinstance(actual, float):
+        return expected == actual or (np.isnan(expected) and np.isnan(actual))
+    return bool(expected == actual)
+
+
+def compare_nwbfiles(expected_path: str, actual_path: str) -> list:
+    """The (object path, field name) of each difference between the objects of two NWB files read with pynwb."""
+    with NWBHDF5IO(expected_path, mode="r") as expected_io, NWBHDF5IO(actual_path, mode="r") as actual_io:
+        expected_values = _get_values(nwbfile=expected_io.read())
+        actual_values = _get_values(nwbfile=actual_io.read())
+        differences = [(object_path, None) for object_path in expected_values.keys() ^ actual_values.keys()]
+        for object_path in expected_values.keys() & actual_values.keys():
+            expected_fields, actual_fields = expected_values[object_path], actual_values[object_path]
+            differences.extend(
+                (object_path, field_name)
+                for field_name in expected_fields.keys() | actual_fields.keys()
+                if field_name not in expected_fields
+                or field_name not in actual_fields
+                or expected_fields[field_name][0] != actual_fields[field_name][0]
+                or not _are_equal(expected_fields[field_name][1], actual_fields[field_name][1])
+            )
+    return sorted(differences, key=str)
+
+
+def run_benchmark(num_masks: int = 200, num_frames: int = 2000, image_size: int = 128, codecs: bool = True) -> dict:
+    compression_options = COMPRESSION_OPTIONS if codecs else None
+    with TemporaryDirectory() as folder_path:
+        hdf5_path = str(Path(folder_path) / "direct.nwb")
+        zarr_path = str(Path(folder_path) / "zarr.nwb.zarr")
+        exported_path = str(Path(folder_path) / "exported.nwb")
+
+        start_time = perf_counter()
+        nwbfile = make_nwbfile(num_masks, num_frames, image_size, compression_options=compression_options)
+        with NWBHDF5IO(hdf5_path, mode="w") as io:
+            io.write(nwbfile)
+        hdf5_seconds = perf_counter() - start_time
+
+        start_time = perf_counter()
+        nwbfile = make_nwbfile(num_masks, num_frames, image_size, compression_options=compression_options)
+        write_zarr_nwbfile(nwbfile=nwbfile, nwbfile_path=zarr_path)
+        zarr_seconds = perf_counter() - start_time
+        start_time = perf_counter()
+        export_to_hdf5(zarr_path=zarr_path, nwbfile_path=exported_path)
+        export_seconds = perf_counter() - start_time
+
+        differences = compare_nwbfiles(expected_path=hdf5_path, actual_path=exported_path)
+
+    return dict(
+        hdf5_seconds=hdf5_seconds, zarr_seconds=zarr_seconds, export_seconds=export_seconds, differences=differences
+    )
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("--num-masks", type=int, default=200)
+    parser.add_argument("--num-frames", type=int, default=2000)
+    parser.add_argument("--image-size", type=int, default=128)
+    parser.add_argument("--no-codecs", action="store_true")
+    args = parser.parse_args()
+
+    results = run_benchmark(
+        num_masks=args.num_masks, num_frames=args.num_frames, image_size=args.image_size, codecs=not args.no_codecs
+    )
+    print(
+        f"direct HDF5 {results['hdf5_seconds']:.2f} s, "
+        f"Zarr {results['zarr_seconds']:.2f} s + export to HDF5 {results['export_seconds']:.2f} s."
+    )
+    for object_path, field_name in results["differences"]:
+        print(f"'{object_path}' differs" + (f" in '{field_name}'." if field_name else "."))
+    assert not results["differences"], "The export of the NWB-Zarr store differs from the direct HDF5 output."
+    print("The datasets of the exported NWB-Zarr store are identical to the direct HDF5 output.")
@@ -1,11 +1,17 @@
+import json
 import os
-from concurrent.futures import as_completed, ProcessPoolExecutor
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
 from pathlib import Path
+from shutil import rmtree
+from time import perf_counter, time
+from typing import Callable, Optional
 from warnings import warn
 
-from neuroconv.tools.data_transfers import automatic_dandi_upload
-from nwbinspector import inspect_nwb
-from nwbinspector.inspector_tools import format_messages, save_report
+import numpy as np
+from h5py import File
+from nwbinspector import Importance
+from pynwb import NWBFile
 from tqdm import tqdm
 import datajoint as dj
 
@@ -13,14 +19,42 @@ dj.config["database.host"] = "tutorial-db.datajoint.io"
 dj.config["database.user"] = "microns"
 dj.config["database.password"] = "microns2021"
 
-from phase3 import nda
-from tools.intervals import add_trials
+from tools.cave_client import cache_functional_coreg_table, get_latest_cached_version
+from tools.clocks import CLOCK_ALIGNMENT_MODES, align_clocks
+from tools.database import (
+    clear_session_data,
+    close_connection,
+    close_thread_connections,
+    get_num_round_trips,
+    get_scans,
+    set_cache_mode,
+)
+from tools.inspection import (
+    INSPECTION_MODES,
+    get_report_path,
+    inspect_nwbfile_object,
+    inspect_written_nwbfile,
+    raise_for_critical_messages,
+    save_inspection_report,
+)
+from tools.intervals import add_trials, fetch_trials_data
+from tools.manifest import SessionManifest, get_file_fingerprint, get_file_hash, get_manifest_path
+from tools.metrics import StageMetrics, get_metrics_path, get_size_in_bytes, read_metrics, summarize_metrics
 from tools.nwb_helpers import start_nwb
-from tools.ophys import add_ophys
-from tools.times import get_stimulus_times, get_frame_times, get_trial_times
+from tools.ophys import add_ophys, fetch_ophys_data
+from tools.pipeline import estimate_session_resources, get_available_memory_gb, run_pipeline, upload_to_dandi
+from tools.stimulus import STIMULUS_STORAGE_MODES, add_stimulus_templates
+from tools.stub import get_num_samples_until, get_stub_end_time, stub_ophys_data, stub_series_data, stub_trials
+from tools.times import get_stimulus_times, get_frame_times, get_trial_times, load_timestamps_store
+from tools.zarr_backend import export_to_hdf5 as export_zarr_to_hdf5
 
 from micronsnwbconverter import MICrONSNWBConverter
-from tools.behavior import find_earliest_timestamp, add_eye_tracking, add_treadmill
+from tools.behavior import (
+    add_eye_tracking,
+    add_treadmill,
+    fetch_eye_tracking_data,
+    fetch_treadmill_data,
+)
 
 
 def convert_session(
@@ -30,112 +64,616 @@ def convert_session(
     stimulus_movie_file_path: str,
     stimulus_movie_timestamps_file_path: str,
     trial_timestamps_file_path: str,
+    coreg_materialization_version: Optional[int] = None,
+    concurrent_stages: bool = False,
+    mask_format: str = "image_mask",
+    trace_buffer_gb: Optional[float] = None,
+    plane_reader: str = "per_plane",
+    max_plane_workers: Optional[int] = None,
+    max_compression_workers: Optional[int] = None,
+    max_write_workers: Optional[int] = None,
+    compression_options: Optional[dict] = None,
+    backend: str = "hdf5",
+    export_to_hdf5: bool = True,
+    database_cache_mode: Optional[str] = None,
+    stub_duration: Optional[float] = None,
+    stub_frames: Optional[int] = None,
+    stimulus_storage: str = "movie",
+    max_decode_workers: Optional[int] = None,
+    clock_alignment: str = "copy",
+    jitter_tolerance: Optional[float] = None,
+    run_inspection: bool = True,
+    inspection_mode: str = "sampled",
+    upload_function: Optional[Callable] = upload_to_dandi,
+    profile_stage: Optional[str] = None,
+    profiler: str = "cprofile",
+    timestamps_file_hashes: Optional[dict] = None,
     verbose: bool = True,
 ):
-    """Wrap converter for parallel execution."""
+    """
+    Wrap converter for parallel execution.
 
-    scan_key = dict(
+    The timestamps, behavior, trials, ophys data and imaging metadata are fetched in a thread pool when
+    'concurrent_stages' is True. The ROIs and the fluorescence traces are added with 'mask_format' and
+    'trace_buffer_gb' (see tools.ophys.add_ophys), the imaging planes are written with 'plane_reader' (see
+    MicronsTiffImagingInterface.run_conversion) and the datasets are compressed with 'compression_options' (see
+    tools.compression.get_compression_kwargs).
+
+    With backend="zarr", the session is written as an NWB-Zarr store at 'nwbfile_path' with a '.zarr' suffix (see
+    tools.zarr_backend.write_zarr_nwbfile), which is exported to 'nwbfile_path' and removed when 'export_to_hdf5' is
+    True, otherwise it is kept and neither inspected nor uploaded. The phase3.nda fetches use the local cache per
+    'database_cache_mode' (see tools.database.set_cache_mode), and the 'replay' mode also uses the latest cached
+    coregistration table, so that the conversion runs without the databases. The coregistration table is otherwise
+    that of 'coreg_materialization_version', by default the current version of the datastack.
+
+    Only the start of the session is converted when 'stub_duration' or 'stub_frames' is specified (see
+    tools.stub.get_stub_end_time). The stimulus movie is stored per 'stimulus_storage' (see
+    tools.stimulus.add_stimulus_templates) and decoded by 'max_decode_workers' threads when it is specified (see
+    video.MicronsVideoDataChunkIterator). The clocks are aligned with 'clock_alignment' (see
+    tools.clocks.align_clocks) and written with a starting time and rate when they are regular within
+    'jitter_tolerance' (see tools.clocks.get_timing_kwargs).
+
+    The NWB file is inspected per 'inspection_mode' when 'run_inspection' is True (see inspect_session), then
+    uploaded with 'upload_function' unless it is None (see upload_session). The completed stages are recorded in a
+    manifest next to the NWB file (see tools.manifest.SessionManifest), so that a rerun skips a finished session and
+    resumes an interrupted one. The timestamps files are compared by their SHA-256, which are passed as
+    'timestamps_file_hashes' when they are computed once for many sessions (see parallel_convert_sessions). The
+    metrics of each stage are appended next to the NWB file and the stage named 'profile_stage' is profiled with
+    'profiler' (see tools.metrics.StageMetrics). Returns the time spent in each stage in seconds.
+    """
+    assert inspection_mode in INSPECTION_MODES, f"The inspection mode must be one of {INSPECTION_MODES}!"
+    assert stimulus_storage in STIMULUS_STORAGE_MODES, f"The stimulus storage must be one of {STIMULUS_STORAGE_MODES}!"
+    assert clock_alignment in CLOCK_ALIGNMENT_MODES, f"The clock alignment must be one of {CLOCK_ALIGNMENT_MODES}!"
+    if database_cache_mode is not None:
+        set_cache_mode(database_cache_mode)
+    # The coregistration version is part of the fingerprints, so that a new materialization invalidates the manifest
+    if coreg_materialization_version is None:
+        if database_cache_mode == "replay":
+            coreg_materialization_version = get_latest_cached_version()
+        else:
+            coreg_materialization_version = cache_functional_coreg_table()
+
+    scan_key = _get_scan_key(ophys_file_path)
+
+    manifest = SessionManifest(file_path=get_manifest_path(nwbfile_path))
+    final_stage = "cleaned_up" if upload_function is not None else "inspected" if run_inspection else "converted"
+    if backend == "zarr" and not export_to_hdf5:
+        final_stage = "converted"
+    source_fingerprints = dict(
+        ophys_file=get_file_fingerprint(ophys_file_path),
+        stimulus_movie_file=get_file_fingerprint(stimulus_movie_file_path),
+        **(
+            timestamps_file_hashes
+            or _get_timestamps_file_hashes(
+                ophys_timestamps_file_path=ophys_timestamps_file_path,
+                stimulus_movie_timestamps_file_path=stimulus_movie_timestamps_file_path,
+                trial_timestamps_file_path=trial_timestamps_file_path,
+            )
+        ),
+    )
+    # The source files that are removed after the upload are compared by their recorded fingerprints
+    source_fingerprints = {
+        name: manifest.get_fingerprint(name) if fingerprint is None else fingerprint
+        for name, fingerprint in source_fingerprints.items()
+    }
+    manifest.validate(
+        fingerprints=dict(
+            **source_fingerprints,
+            coreg_materialization_version=coreg_materialization_version,
+            options=dict(
+                mask_format=mask_format,
+                trace_buffer_gb=trace_buffer_gb,
+                plane_reader=plane_reader,
+                compression_options=compression_options,
+                backend=backend,
+                export_to_hdf5=export_to_hdf5,
+                stub_duration=stub_duration,
+                stub_frames=stub_frames,
+                stimulus_storage=stimulus_storage,
+                jitter_tolerance=jitter_tolerance,
+            ),
+        )
+    )
+    zarr_path = Path(f"{nwbfile_path}.zarr")
+    conversion_path = str(zarr_path) if backend == "zarr" else nwbfile_path
+    if backend == "hdf5" and manifest.is_done("processed") and not manifest.is_done("converted"):
+        # A run that is killed while writing the imaging planes can leave an HDF5 file that cannot be opened again
+        if not _is_readable_hdf5(conversion_path):
+            warn(f"The partially written NWB file '{conversion_path}' cannot be read, the session is converted again.")
+            manifest.reset()
+    if manifest.is_done(final_stage):
+        if verbose:
+            print(f"The session is already {final_stage.replace('_', ' ')}, it is skipped.")
+        return dict()
+
+    source_data = dict(Ophys=dict(file_path=ophys_file_path, scan_key=scan_key))
+    if stimulus_storage == "movie":
+        source_data.update(Video=dict(file_paths=[stimulus_movie_file_path]))
+
+    converter = MICrONSNWBConverter(source_data=source_data)
+    ophys_interface = converter.data_interface_objects["Ophys"]
+
+    metrics = StageMetrics(
+        file_path=get_metrics_path(nwbfile_path),
+        session_id=Path(nwbfile_path).stem,
+        profile_stage=profile_stage,
+        profiler=profiler,
+    )
+    if not manifest.is_done("processed"):
+        nwbfile, metadata, conversion_options = _assemble_session(
+            converter=converter,
+            scan_key=scan_key,
+            stimulus_movie_file_path=stimulus_movie_file_path,
+            ophys_timestamps_file_path=ophys_timestamps_file_path,
+            stimulus_movie_timestamps_file_path=stimulus_movie_timestamps_file_path,
+            trial_timestamps_file_path=trial_timestamps_file_path,
+            metrics=metrics,
+            coreg_materialization_version=coreg_materialization_version,
+            concurrent_stages=concurrent_stages,
+            mask_format=mask_format,
+            trace_buffer_gb=trace_buffer_gb,
+            plane_reader=plane_reader,
+            max_plane_workers=max_plane_workers,
+            max_compression_workers=max_compression_workers,
+            compression_options=compression_options,
+            stub_duration=stub_duration,
+            stub_frames=stub_frames,
+            stimulus_storage=stimulus_storage,
+            max_decode_workers=max_decode_workers,
+            clock_alignment=clock_alignment,
+            jitter_tolerance=jitter_tolerance,
+            verbose=verbose,
+        )
+
+    try:
+        if not manifest.is_done("processed"):
+            before_write = None
+            if inspection_mode in ("pre_write", "sampled"):
+                before_write = partial(_inspect_before_write, nwbfile_path=nwbfile_path, metrics=metrics)
+            # The 'per_plane' plane reader writes the planes with the file, one at a time with the 'hdf5' backend
+            if backend == "hdf5":
+                ophys_interface.set_plane_measurement(
+                    lambda two_photon_series_name: metrics.measure(
+                        f"planes/{two_photon_series_name}", output_path=conversion_path
+                    )
+                )
+            # The processed data and the empty imaging planes are written first, the planes are checkpointed separately
+            with metrics.measure("conversion", output_path=conversion_path):
+                converter.run_conversion(
+                    nwbfile=nwbfile,
+                    nwbfile_path=conversion_path,
+                    metadata=metadata,
+                    overwrite=True,
+                    conversion_options=conversion_options,
+                    backend=backend,
+                    max_write_workers=max_write_workers,
+                    write_planes=False,
+                    before_write=before_write,
+                )
+            # The streamed traces are fetched by the write threads of the 'zarr' backend, which have ended
+            close_thread_connections()
+            manifest.set_done("processed", ophys_interface.get_planes_to_write())
+        else:
+            ophys_interface.set_planes_to_write(manifest.get("processed"))
+
+        if not manifest.is_done("converted"):
+            written_planes = manifest.get("planes", [])
+            planes_to_write = manifest.get("processed") or dict()
+            last_plane = dict(time=perf_counter(), size=get_size_in_bytes(conversion_path))
+
+            def on_plane_written(two_photon_series_name: str):
+                written_planes.append(two_photon_series_name)
+                manifest.set_done("planes", written_planes)
+                # The single pass reads the planes interleaved, so only the bytes of each plane are recorded
+                if planes_to_write.get("plane_reader") == "single_pass":
+                    plane_sizes = ophys_interface.get_plane_sizes(
+                        nwbfile_path=conversion_path, two_photon_series_names=[two_photon_series_name], backend=backend
+                    )
+                    metrics.record(
+                        stage_name=f"planes/{two_photon_series_name}", bytes_written=plane_sizes[two_photon_series_name]
+                    )
+                    return
+                # The planes that are written concurrently are measured from the previous one that was completed
+                size = get_size_in_bytes(conversion_path)
+                metrics.record(
+                    stage_name=f"planes/{two_photon_series_name}",
+                    wall_time=perf_counter() - last_plane["time"],
+                    bytes_written=size - last_plane["size"],
+                )
+                last_plane.update(time=perf_counter(), size=size)
+
+            all_two_photon_series_names = planes_to_write.get("two_photon_series_names", [])
+            with metrics.measure("planes", output_path=conversion_path):
+                ophys_interface.write_planes(
+                    nwbfile_path=conversion_path,
+                    verbose=verbose,
+                    backend=backend,
+                    two_photon_series_names=[
+                        name for name in all_two_photon_series_names if name not in written_planes
+                    ],
+                    on_plane_written=on_plane_written,
+                )
+
+            if backend == "zarr" and export_to_hdf5:
+                with metrics.measure("export", output_path=nwbfile_path):
+                    export_zarr_to_hdf5(zarr_path=zarr_path, nwbfile_path=nwbfile_path)
+                    rmtree(zarr_path)
+            manifest.set_done("converted")
+            if verbose:
+                print("Conversion successful.")
+
+        if backend == "zarr" and not export_to_hdf5:
+            return metrics.get_wall_times()
+
+        if run_inspection and not manifest.is_done("inspected"):
+            with metrics.measure("inspection"):
+                inspect_session(nwbfile_path=nwbfile_path, inspection_mode=inspection_mode)
+            manifest.set_done("inspected")
+        if upload_function is not None:
+            with metrics.measure("upload"):
+                upload_session(
+                    nwbfile_path=nwbfile_path,
+                    source_file_paths=[ophys_file_path, stimulus_movie_file_path],
+                    upload_function=upload_function,
+                    manifest=manifest,
+                    verbose=verbose,
+                )
+
+    except Exception as e:
+        warn(
+            "There was an error during conversion. The source files are not removed and a rerun resumes from the "
+            f"last completed stage. The full traceback: {e}"
+        )
+    finally:
+        clear_session_data(scan_key)
+
+    return metrics.get_wall_times()
+
+
+def _is_readable_hdf5(file_path: str) -> bool:
+    try:
+        with File(file_path, "r"):
+            return True
+    except OSError:
+        return False
+
+
+def _get_scan_key(ophys_file_path: str) -> dict:
+    return dict(
         session=Path(ophys_file_path).stem.split("_")[3],
         scan_idx=Path(ophys_file_path).stem.split("_")[4],
     )
 
-    source_data = dict(
-        Ophys=dict(file_path=ophys_file_path, scan_key=scan_key),
-        Video=dict(file_paths=[stimulus_movie_file_path]),
-    )
 
-    # Fetch v8 timestamps from the pickle files
-    movie_times = get_stimulus_times(scan_key=scan_key, file_path=stimulus_movie_timestamps_file_path)
-    frame_times = get_frame_times(scan_key=scan_key, file_path=ophys_timestamps_file_path)
-    trial_times = get_trial_times(scan_key=scan_key, file_path=trial_timestamps_file_path)
+def _assemble_session(
+    converter: MICrONSNWBConverter,
+    scan_key: dict,
+    stimulus_movie_file_path: str,
+    ophys_timestamps_file_path: str,
+    stimulus_movie_timestamps_file_path: str,
+    trial_timestamps_file_path: str,
+    metrics: StageMetrics,
+    coreg_materialization_version: Optional[int] = None,
+    concurrent_stages: bool = False,
+    mask_format: str = "image_mask",
+    trace_buffer_gb: Optional[float] = None,
+    plane_reader: str = "per_plane",
+    max_plane_workers: Optional[int] = None,
+    max_compression_workers: Optional[int] = None,
+    compression_options: Optional[dict] = None,
+    stub_duration: Optional[float] = None,
+    stub_frames: Optional[int] = None,
+    stimulus_storage: str = "movie",
+    max_decode_workers: Optional[int] = None,
+    clock_alignment: str = "copy",
+    jitter_tolerance: Optional[float] = None,
+    verbose: bool = True,
+):
+    """Fetch the data of a session and assemble the NWBFile, the metadata and the conversion options."""
+    # The fetches of the sections are independent of each other, only the assembly into the NWBFile is serial
+    stages = dict(
+        # Fetch v8 timestamps from the pickle files
+        movie_times=partial(get_stimulus_times, scan_key=scan_key, file_path=stimulus_movie_timestamps_file_path),
+        frame_times=partial(get_frame_times, scan_key=scan_key, file_path=ophys_timestamps_file_path),
+        trial_times=partial(get_trial_times, scan_key=scan_key, file_path=trial_timestamps_file_path),
+        eye_tracking=partial(fetch_eye_tracking_data, scan_key=scan_key),
+        treadmill=partial(fetch_treadmill_data, scan_key=scan_key),
+        trials=partial(fetch_trials_data, scan_key=scan_key),
+        # The traces are streamed per field while writing when 'trace_buffer_gb' is specified, so only the masks and
+        # the other data of the fields are fetched for the whole scan
+        ophys=partial(
+            fetch_ophys_data,
+            scan_key=scan_key,
+            coreg_materialization_version=coreg_materialization_version,
+            fetch_traces=trace_buffer_gb is None,
+        ),
+        metadata=converter.get_metadata,
+    )
+    num_round_trips = get_num_round_trips()
+    with metrics.measure("fetch_wall_time"):
+        stage_results = _run_stages(stages=stages, metrics=metrics, concurrent=concurrent_stages)
 
-    # Shifting times to earliest provided behavioral timestamp when necessary
-    pupil_timestamps = (nda.RawManualPupil & scan_key).fetch1("pupil_times")
-    treadmill_timestamps = (nda.RawTreadmill & scan_key).fetch1("treadmill_timestamps")
+    movie_times = stage_results["movie_times"]
+    frame_times = stage_results["frame_times"]
+    trial_times = stage_results["trial_times"]
+    metadata = stage_results["metadata"]
+    eye_tracking_data = stage_results["eye_tracking"]
+    treadmill_data = stage_results["treadmill"]
+    trials_data = stage_results["trials"]
+    ophys_data = stage_results["ophys"]
 
-    earliest_timestamp_in_behavior = find_earliest_timestamp(
-        behavior_timestamps_arrays=[pupil_timestamps, treadmill_timestamps],
+    # Shifting times to earliest provided behavioral timestamp when necessary, once for each clock
+    clocks, clock_offset = align_clocks(
+        clocks=dict(
+            pupil=eye_tracking_data["pupil_times"],
+            treadmill=treadmill_data["treadmill_timestamps"],
+            frames=frame_times,
+            movie=movie_times,
+            trials={name: trial_times[name].to_numpy() for name in ("start_frame_time", "end_frame_time")},
+        ),
+        behavior_clock_names=["pupil", "treadmill"],
+        mode=clock_alignment,
     )
-    if earliest_timestamp_in_behavior < 0:
+    if clock_offset:
         warn(
             "Writing behavior data to NWB with negative timestamps is not recommended,"
-            f"times are shifted to the earliest behavioral timestamp by {abs(earliest_timestamp_in_behavior)} seconds."
+            f"times are shifted to the earliest behavioral timestamp by {clock_offset} seconds."
         )
-        pupil_timestamps = pupil_timestamps + abs(earliest_timestamp_in_behavior)
-        treadmill_timestamps = treadmill_timestamps + abs(earliest_timestamp_in_behavior)
-        frame_times = frame_times + abs(earliest_timestamp_in_behavior)
-        movie_times = movie_times + abs(earliest_timestamp_in_behavior)
-        trial_times["start_frame_time"] = trial_times["start_frame_time"] + abs(earliest_timestamp_in_behavior)
-        trial_times["end_frame_time"] = trial_times["end_frame_time"] + abs(earliest_timestamp_in_behavior)
-
-    # Create the NWBFile
-    nwbfile = start_nwb(scan_key)
-    # Add eye position and pupil radius
-    add_eye_tracking(scan_key, nwbfile, timestamps=pupil_timestamps)
-    # Add the velocity of the treadmill
-    add_treadmill(scan_key, nwbfile, timestamps=treadmill_timestamps)
-    # Add trials
-    add_trials(scan_key, nwbfile, trial_times=trial_times)
-    # Add fluorescence traces, image masks and summary images to NWB
-    add_ophys(scan_key, nwbfile, timestamps=frame_times)
+    pupil_timestamps = clocks["pupil"]
+    treadmill_timestamps = clocks["treadmill"]
+    frame_times = clocks["frames"]
+    movie_times = clocks["movie"]
+    trial_times = trial_times.assign(**clocks["trials"])
 
-    if verbose:
-        print("Behavior, trials, and Fluorescence traces are added from datajoint.")
+    num_stub_frames = 0
+    stubbed = stub_duration is not None or stub_frames is not None
+    if stubbed:
+        end_time = get_stub_end_time(frame_times=frame_times, stub_duration=stub_duration, stub_frames=stub_frames)
+        eye_tracking_data, pupil_timestamps = stub_series_data(eye_tracking_data, pupil_timestamps, end_time)
+        treadmill_data, treadmill_timestamps = stub_series_data(treadmill_data, treadmill_timestamps, end_time)
+        trial_times, trials_data = stub_trials(trial_times=trial_times, trials_data=trials_data, end_time=end_time)
+        num_stub_frames = get_num_samples_until(timestamps=frame_times, end_time=end_time)
+        frame_times = frame_times[:num_stub_frames]
+        ophys_data = stub_ophys_data(ophys_data=ophys_data, num_frames=num_stub_frames)
+        movie_times = movie_times[: get_num_samples_until(timestamps=movie_times, end_time=end_time)]
+        if verbose:
+            print(f"The session is stubbed to the first {num_stub_frames} imaging frames ({end_time:.2f} s).")
 
-    converter = MICrONSNWBConverter(source_data=source_data)
-    metadata = converter.get_metadata()
+    with metrics.measure("assembly"):
+        # Create the NWBFile
+        with metrics.measure("start_nwb"):
+            nwbfile = start_nwb(scan_key)
+        # Add eye position and pupil radius
+        with metrics.measure("add_eye_tracking"):
+            add_eye_tracking(
+                scan_key,
+                nwbfile,
+                timestamps=pupil_timestamps,
+                eye_tracking_data=eye_tracking_data,
+                compression_options=compression_options,
+                jitter_tolerance=jitter_tolerance,
+            )
+        # Add the velocity of the treadmill
+        with metrics.measure("add_treadmill"):
+            add_treadmill(
+                scan_key,
+                nwbfile,
+                timestamps=treadmill_timestamps,
+                treadmill_data=treadmill_data,
+                compression_options=compression_options,
+                jitter_tolerance=jitter_tolerance,
+            )
+        # Add trials
+        with metrics.measure("add_trials"):
+            add_trials(scan_key, nwbfile, trial_times=trial_times, trials_data=trials_data)
+        # Add fluorescence traces, image masks and summary images to NWB
+        with metrics.measure("add_ophys"):
+            add_ophys(
+                scan_key,
+                nwbfile,
+                timestamps=frame_times,
+                ophys_data=ophys_data,
+                mask_format=mask_format,
+                trace_buffer_gb=trace_buffer_gb,
+                compression_options=compression_options,
+                jitter_tolerance=jitter_tolerance,
+            )
+        # Add the unique frames of the stimulus conditions and the index of the frame shown at each time, unless the
+        # stub session has no frame of the movie
+        if stimulus_storage == "templates" and len(movie_times):
+            with metrics.measure("add_stimulus_templates"):
+                add_stimulus_templates(
+                    nwbfile,
+                    movie_file_path=stimulus_movie_file_path,
+                    movie_times=movie_times,
+                    trial_times=trial_times,
+                    trials_data=trials_data,
+                    compression_options=compression_options,
+                    jitter_tolerance=jitter_tolerance,
+                )
 
-    metadata["Behavior"]["Movies"][0].update(
-        description="The visual stimulus is composed of natural movie clips ~60 fps.",
-    )
+    if verbose:
+        print("Behavior, trials, and Fluorescence traces are added from datajoint.")
+        print(_format_stage_times(stage_times=metrics.get_wall_times(), fetch_stage_names=list(stages)))
+        print(f"{'round-trips':>16}: {get_num_round_trips() - num_round_trips:8d} database queries")
 
     metadata["NWBFile"].update(
         session_start_time=nwbfile.session_start_time,
     )
 
+    if stimulus_storage == "movie":
+        metadata["Behavior"]["Movies"][0].update(
+            description="The visual stimulus is composed of natural movie clips ~60 fps.",
+        )
+
     conversion_options = dict(
-        Ophys=dict(stub_test=False),
-        Video=dict(
-            external_mode=False,
-            timestamps=movie_times.tolist(),
+        Ophys=dict(
+            stub_test=stubbed,
+            stub_frames=num_stub_frames,
+            plane_reader=plane_reader,
+            max_plane_workers=max_plane_workers,
+            max_compression_workers=max_compression_workers,
+            compression_options=compression_options,
         ),
     )
-
-    try:
-        converter.run_conversion(
-            nwbfile=nwbfile,
-            nwbfile_path=nwbfile_path,
-            metadata=metadata,
-            conversion_options=conversion_options,
-        )
-        if verbose:
-            print("Conversion successful.")
-
-        nwbfile_path = Path(nwbfile_path)
-        # Run inspection for nwbfile
-        results = list(inspect_nwb(nwbfile_path=nwbfile_path))
-        report_path = nwbfile_path.parent / f"{nwbfile_path.stem}_report.txt"
-        save_report(
-            report_file_path=report_path,
-            formatted_messages=format_messages(
-                results,
-                levels=["importance", "file_path"],
-            ),
+    if stimulus_storage == "movie":
+        conversion_options.update(
+            Video=dict(
+                external_mode=False,
+                timestamps=movie_times,
+                stub_test=stubbed,
+                stub_frames=len(movie_times) if stubbed else None,
+                max_decode_workers=max_decode_workers,
+                jitter_tolerance=jitter_tolerance,
+            )
         )
-        # Upload nwbfile to DANDI
-        automatic_dandi_upload(
-            dandiset_id="000402",
-            nwb_folder_path=nwbfile_path.parent,
-            cleanup=False,
+
+    return nwbfile, metadata, conversion_options
+
+
+def inspect_session(nwbfile_path: str, inspection_mode: str = "sampled"):
+    """
+    Inspect a written NWB file and save the report next to it (see tools.inspection.inspect_written_nwbfile).
+
+    With the 'pre_write' and 'sampled' modes, the conversion also inspects the NWBFile in memory before anything is
+    written and stops on critical issues. The 'pre_write' mode only does that, so the written file is not inspected.
+    The 'sampled' mode then inspects the metadata and a sample of the chunks of the written file, the 'full' mode
+    all of it.
+    """
+    if inspection_mode == "pre_write":
+        return
+    messages = inspect_written_nwbfile(nwbfile_path=nwbfile_path, mode=inspection_mode)
+    save_inspection_report(report_file_path=get_report_path(nwbfile_path), messages=messages)
+    if any(message.importance == Importance.CRITICAL for message in messages):
+        warn(f"The inspection of '{nwbfile_path}' found critical issues, see '{get_report_path(nwbfile_path)}'.")
+
+
+def _inspect_before_write(nwbfile: NWBFile, nwbfile_path: str, metrics: StageMetrics):
+    with metrics.measure("pre_write_inspection"):
+        messages = inspect_nwbfile_object(nwbfile=nwbfile)
+    save_inspection_report(report_file_path=get_report_path(nwbfile_path, suffix="pre_write_report"), messages=messages)
+    raise_for_critical_messages(messages)
+
+
+def upload_session(
+    nwbfile_path: str,
+    source_file_paths: list,
+    upload_function: Callable = upload_to_dandi,
+    manifest: Optional[SessionManifest] = None,
+    verbose: bool = True,
+):
+    """
+    Upload an NWB file with 'upload_function' and remove its source files once it is uploaded.
+
+    The 'uploaded' and 'cleaned_up' stages are recorded in the 'manifest', and an uploaded file is not uploaded again.
+    """
+    if manifest is None or not manifest.is_done("uploaded"):
+        upload_function(nwbfile_path)
+        if manifest is not None:
+            manifest.set_done("uploaded")
+
+    if verbose:
+        print("Cleaning up after successful upload ...")
+    for source_file_path in source_file_paths:
+        # The files that are already removed by an interrupted run are skipped
+        try:
+            Path(source_file_path).unlink()
+        except FileNotFoundError:
+            pass
+    if manifest is not None:
+        manifest.set_done("cleaned_up")
+
+
+def _run_stages(stages: dict, metrics: StageMetrics, concurrent: bool = False) -> dict:
+    """Call each of the independent 'stages', in a thread pool when 'concurrent', and measure them."""
+
+    def run_stage(stage_name: str):
+        with metrics.measure(stage_name, concurrent=concurrent):
+            return stages[stage_name]()
+
+    if concurrent:
+        with ThreadPoolExecutor(max_workers=len(stages)) as executor:
+            futures = {stage_name: executor.submit(run_stage, stage_name) for stage_name in stages}
+        # The threads of the pool have ended, their connections to the database are closed
+        close_thread_connections()
+        return {stage_name: future.result() for stage_name, future in futures.items()}
+    return {stage_name: run_stage(stage_name) for stage_name in stages}
+
+
+def _format_stage_times(stage_times: dict, fetch_stage_names: list) -> str:
+    total_fetch_time = sum(stage_times[name] for name in fetch_stage_names)
+    lines = [f"{stage_name:>16}: {stage_times[stage_name]:8.2f} s" for stage_name in fetch_stage_names]
+    lines.append(
+        f"{'fetch wall time':>16}: {stage_times['fetch_wall_time']:8.2f} s "
+        f"(saved {total_fetch_time - stage_times['fetch_wall_time']:.2f} s of {total_fetch_time:.2f} s)"
+    )
+    lines.append(f"{'assembly':>16}: {stage_times['assembly']:8.2f} s")
+    return "\n".join(lines)
+
+
+def _format_metrics_summary(summary: dict) -> str:
+    columns = f"{'count':>6} {'wall (s)':>10} {'cpu (s)':>10} {'peak rss (MB)':>14} {'queries':>8} {'MB written':>11}"
+    lines = [f"{'stage':>28} {columns}"]
+    for stage_name, stage_summary in summary.items():
+        peak_rss = stage_summary["max_peak_rss_mb"]
+        lines.append(
+            f"{stage_name:>28} {stage_summary['count']:6d} {stage_summary['wall_time']:10.2f} "
+            f"{stage_summary['cpu_time']:10.2f} {peak_rss if peak_rss is not None else float('nan'):14.1f} "
+            f"{stage_summary['round_trips']:8d} {stage_summary['bytes_written'] / 1e6:11.1f}"
         )
+    return "\n".join(lines)
 
-        if verbose:
-            print("Cleaning up after successful upload to DANDI ...")
-        Path(ophys_file_path).unlink()
-        Path(stimulus_movie_file_path).unlink()
 
-    except Exception as e:
-        warn(f"There was an error during conversion. The source files are not removed. The full traceback: {e}")
+def _get_job_metrics(job: dict, profile_stage: Optional[str] = None, profiler: str = "cprofile") -> StageMetrics:
+    return StageMetrics(
+        file_path=get_metrics_path(job["nwbfile_path"]),
+        session_id=Path(job["nwbfile_path"]).stem,
+        profile_stage=profile_stage,
+        profiler=profiler,
+    )
+
+
+def _get_timestamps_file_hashes(
+    ophys_timestamps_file_path: str, stimulus_movie_timestamps_file_path: str, trial_timestamps_file_path: str
+) -> dict:
+    """The SHA-256 of the timestamps files, which are shared by all the sessions."""
+    return dict(
+        ophys_timestamps_file=get_file_hash(ophys_timestamps_file_path),
+        stimulus_movie_timestamps_file=get_file_hash(stimulus_movie_timestamps_file_path),
+        trial_timestamps_file=get_file_hash(trial_timestamps_file_path),
+    )
+
+
+def _convert_job(job: dict, **conversion_options) -> dict:
+    stage_times = convert_session(
+        **job, **conversion_options, run_inspection=False, upload_function=None, verbose=False
+    )
+    # convert_session warns about the errors instead of raising them
+    if not SessionManifest(file_path=get_manifest_path(job["nwbfile_path"])).is_done("converted"):
+        raise RuntimeError(f"The conversion of '{job['nwbfile_path']}' failed.")
+    return stage_times
+
+
+def _inspect_job(
+    job: dict, inspection_mode: str = "sampled", profile_stage: Optional[str] = None, profiler: str = "cprofile"
+):
+    manifest = SessionManifest(file_path=get_manifest_path(job["nwbfile_path"]))
+    if not manifest.is_done("inspected"):
+        with _get_job_metrics(job=job, profile_stage=profile_stage, profiler=profiler).measure("inspection"):
+            inspect_session(nwbfile_path=job["nwbfile_path"], inspection_mode=inspection_mode)
+        manifest.set_done("inspected")
+
+
+def _upload_job(job: dict, upload_function: Callable, profile_stage: Optional[str] = None, profiler: str = "cprofile"):
+    # The uploads run in threads of the pipeline, alongside each other
+    with _get_job_metrics(job=job, profile_stage=profile_stage, profiler=profiler).measure("upload", concurrent=True):
+        upload_session(
+            nwbfile_path=job["nwbfile_path"],
+            source_file_paths=[job["ophys_file_path"], job["stimulus_movie_file_path"]],
+            upload_function=upload_function,
+            manifest=SessionManifest(file_path=get_manifest_path(job["nwbfile_path"])),
+            verbose=False,
+        )
 
 
 def parallel_convert_sessions(
@@ -146,30 +684,182 @@ def parallel_convert_sessions(
     stimulus_movie_timestamps_file_path: str,
     ophys_timestamps_file_path: str,
     trial_timestamps_file_path: str,
-):
-    with ProcessPoolExecutor(max_workers=num_parallel_jobs) as executor:
-        with tqdm(total=len(ophys_file_paths), position=0, leave=False) as progress_bar:
-            futures = []
-            for nwbfile_path, ophys_file_path, stimulus_movie_file_path in zip(
-                nwbfile_list,
-                ophys_file_paths,
-                stimulus_movie_file_paths,
-            ):
-                futures.append(
-                    executor.submit(
-                        convert_session,
-                        nwbfile_path=str(nwbfile_path),
-                        ophys_file_path=str(ophys_file_path),
-                        stimulus_movie_file_path=str(stimulus_movie_file_path),
-                        stimulus_movie_timestamps_file_path=str(stimulus_movie_timestamps_file_path),
-                        ophys_timestamps_file_path=str(ophys_timestamps_file_path),
-                        trial_timestamps_file_path=str(trial_timestamps_file_path),
-                        verbose=False,
-                    )
-                )
-            for future in as_completed(futures):
-                future.result()
-                progress_bar.update(1)
+    concurrent_stages: bool = False,
+    mask_format: str = "image_mask",
+    trace_buffer_gb: Optional[float] = None,
+    plane_reader: str = "per_plane",
+    max_plane_workers: Optional[int] = None,
+    max_compression_workers: Optional[int] = None,
+    max_write_workers: Optional[int] = None,
+    compression_options: Optional[dict] = None,
+    backend: str = "hdf5",
+    export_to_hdf5: bool = True,
+    database_cache_mode: Optional[str] = None,
+    stub_duration: Optional[float] = None,
+    stub_frames: Optional[int] = None,
+    stimulus_storage: str = "movie",
+    max_decode_workers: Optional[int] = None,
+    clock_alignment: str = "copy",
+    jitter_tolerance: Optional[float] = None,
+    inspection_mode: str = "sampled",
+    max_inspection_workers: int = 1,
+    max_upload_workers: int = 1,
+    max_pending_sessions: Optional[int] = None,
+    upload_function: Callable = upload_to_dandi,
+    memory_budget_gb: Optional[float] = None,
+    profile_stage: Optional[str] = None,
+    profiler: str = "cprofile",
+    metrics_file_path: Optional[str] = None,
+    invalidate_coreg_cache: bool = False,
+    verbose: bool = True,
+) -> list:
+    """
+    Convert, inspect and upload the sessions in a pipeline of separate worker pools.
+
+    The sessions are converted by 'num_parallel_jobs' processes, inspected by 'max_inspection_workers' processes
+    and uploaded with 'upload_function' by 'max_upload_workers' threads, so that the conversion of a session
+    overlaps the inspection and the upload of the previous ones. At most 'max_pending_sessions' (by default twice
+    'num_parallel_jobs') sessions are converted but not yet uploaded at a time, which bounds the disk usage.
+    The sessions are converted longest first, and only while their total estimated peak memory stays under
+    'memory_budget_gb' (by default the memory available at the start), see tools.pipeline.estimate_session_resources.
+    The written files are inspected with 'inspection_mode', only the time window of 'stub_duration' or 'stub_frames'
+    is converted when either is specified, and the stimulus movie is stored with 'stimulus_storage' and decoded by
+    'max_decode_workers' threads, and the clocks are aligned with 'clock_alignment' and stored as a rate when they are
+    regular within 'jitter_tolerance' (see convert_session).
+    The metrics of the stages of all the sessions in this run are summarized by stage (printed when 'verbose'), and
+    also gathered into 'metrics_file_path' as JSON lines when it is specified (see convert_session for
+    'profile_stage' and 'profiler'). The functional coregistration table is cached once for all sessions, and the
+    other cached versions are removed when 'invalidate_coreg_cache' is True. Returns the results of the stages of
+    each session (see tools.pipeline.run_pipeline).
+    """
+    # Compile the timestamp pickles once so that the workers only read the slice for their own scan
+    for timestamps_file_path in (
+        stimulus_movie_timestamps_file_path,
+        ophys_timestamps_file_path,
+        trial_timestamps_file_path,
+    ):
+        load_timestamps_store(file_path=timestamps_file_path)
+    # Download the functional coregistration table once for all sessions, unless the cached one is replayed
+    coreg_materialization_version = None
+    if database_cache_mode != "replay":
+        coreg_materialization_version = cache_functional_coreg_table(invalidate_other_versions=invalidate_coreg_cache)
+
+    jobs = [
+        dict(
+            nwbfile_path=str(nwbfile_path),
+            ophys_file_path=str(ophys_file_path),
+            stimulus_movie_file_path=str(stimulus_movie_file_path),
+        )
+        for nwbfile_path, ophys_file_path, stimulus_movie_file_path in zip(
+            nwbfile_list, ophys_file_paths, stimulus_movie_file_paths
+        )
+    ]
+
+    if database_cache_mode is not None:
+        set_cache_mode(database_cache_mode)
+    memory_budget_gb = memory_budget_gb or get_available_memory_gb()
+    scans = get_scans([_get_scan_key(job["ophys_file_path"]) for job in jobs])
+    # The conversion processes are forked from this one, and open connections of their own to the database
+    close_connection()
+    estimates = []
+    for job, scan in zip(jobs, scans):
+        num_frames = scan["nframes"]
+        if stub_frames is not None:
+            num_frames = min(num_frames, stub_frames)
+        elif stub_duration is not None:
+            num_frames = min(num_frames, int(np.ceil(stub_duration * scan["fps"])) + 1)
+        estimates.append(
+            estimate_session_resources(
+                ophys_file_path=job["ophys_file_path"],
+                num_frames=num_frames,
+                num_fields=scan["nfields"],
+                mask_format=mask_format,
+                trace_buffer_gb=trace_buffer_gb,
+                plane_reader=plane_reader,
+                max_plane_workers=max_plane_workers,
+            )
+        )
+    # The longest sessions start first so that they do not end up last on their own
+    order = sorted(range(len(jobs)), key=lambda job_index: estimates[job_index]["runtime_s"], reverse=True)
+    profile_options = dict(profile_stage=profile_stage, profiler=profiler)
+    convert_job = partial(
+        _convert_job,
+        stimulus_movie_timestamps_file_path=str(stimulus_movie_timestamps_file_path),
+        ophys_timestamps_file_path=str(ophys_timestamps_file_path),
+        trial_timestamps_file_path=str(trial_timestamps_file_path),
+        coreg_materialization_version=coreg_materialization_version,
+        # The timestamps files are hashed once here rather than in each conversion process
+        timestamps_file_hashes=_get_timestamps_file_hashes(
+            ophys_timestamps_file_path=str(ophys_timestamps_file_path),
+            stimulus_movie_timestamps_file_path=str(stimulus_movie_timestamps_file_path),
+            trial_timestamps_file_path=str(trial_timestamps_file_path),
+        ),
+        concurrent_stages=concurrent_stages,
+        mask_format=mask_format,
+        trace_buffer_gb=trace_buffer_gb,
+        plane_reader=plane_reader,
+        max_plane_workers=max_plane_workers,
+        max_compression_workers=max_compression_workers,
+        max_write_workers=max_write_workers,
+        compression_options=compression_options,
+        backend=backend,
+        export_to_hdf5=export_to_hdf5,
+        database_cache_mode=database_cache_mode,
+        stub_duration=stub_duration,
+        stub_frames=stub_frames,
+        stimulus_storage=stimulus_storage,
+        max_decode_workers=max_decode_workers,
+        clock_alignment=clock_alignment,
+        jitter_tolerance=jitter_tolerance,
+        inspection_mode=inspection_mode,
+        **profile_options,
+    )
+
+    start_time = time()
+    with ProcessPoolExecutor(max_workers=num_parallel_jobs) as conversion_executor, ProcessPoolExecutor(
+        max_workers=max_inspection_workers
+    ) as inspection_executor, ThreadPoolExecutor(max_workers=max_upload_workers) as upload_executor:
+        stages = [("conversion", convert_job, conversion_executor)]
+        # The NWB-Zarr stores that are not exported are only converted
+        if backend != "zarr" or export_to_hdf5:
+            stages.extend(
+                [
+                    (
+                        "inspection",
+                        partial(_inspect_job, inspection_mode=inspection_mode, **profile_options),
+                        inspection_executor,
+                    ),
+                    (
+                        "upload",
+                        partial(_upload_job, upload_function=upload_function, **profile_options),
+                        upload_executor,
+                    ),
+                ]
+            )
+        with tqdm(total=len(jobs), position=0, leave=False) as progress_bar:
+            results = run_pipeline(
+                jobs=[jobs[job_index] for job_index in order],
+                stages=stages,
+                max_pending_jobs=max_pending_sessions or 2 * num_parallel_jobs,
+                on_job_done=lambda _: progress_bar.update(1),
+                job_costs=[estimates[job_index]["memory_gb"] for job_index in order],
+                max_total_cost=memory_budget_gb,
+            )
+
+    # The metrics files of the sessions also hold the records of the previous runs
+    records = [
+        record
+        for job in jobs
+        for record in read_metrics(get_metrics_path(job["nwbfile_path"]))
+        if record["end_time"] >= start_time
+    ]
+    if metrics_file_path is not None:
+        with open(metrics_file_path, "w") as f:
+            f.writelines(json.dumps(record) + "\n" for record in records)
+    if verbose:
+        print(_format_metrics_summary(summarize_metrics(records)))
+
+    return [results[order.index(job_index)] for job_index in range(len(jobs))]
 
 
 if __name__ == "__main__":
@@ -199,7 +889,7 @@ if __name__ == "__main__":
 
     # Run parallel conversion
     parallel_convert_sessions(
-        num_parallel_jobs=len(file_paths),
+        num_parallel_jobs=min(len(file_paths), os.cpu_count()),
         nwbfile_list=nwbfile_list,
         ophys_file_paths=file_paths,
         stimulus_movie_file_paths=movie_file_paths,
@@ -1,6 +1,12 @@
+from typing import Callable, Optional
+
 from neuroconv import NWBConverter
-from neuroconv.datainterfaces import VideoInterface
+from neuroconv.tools.nwb_helpers import make_or_load_nwbfile
+from pynwb import NWBFile
+
 from ophys import MicronsTiffImagingInterface
+from video import MicronsVideoInterface
+from tools.zarr_backend import write_zarr_nwbfile
 
 
 class MICrONSNWBConverter(NWBConverter):
@@ -8,8 +14,66 @@ class MICrONSNWBConverter(NWBConverter):
 
     data_interface_classes = dict(
         Ophys=MicronsTiffImagingInterface,
-        Video=VideoInterface,
+        Video=MicronsVideoInterface,
     )
 
     def __init__(self, source_data):
         super().__init__(source_data)
+
+    def run_conversion(
+        self,
+        nwbfile_path: Optional[str] = None,
+        nwbfile: Optional[NWBFile] = None,
+        metadata: Optional[dict] = None,
+        overwrite: bool = False,
+        conversion_options: Optional[dict] = None,
+        backend: str = "hdf5",
+        max_write_workers: Optional[int] = None,
+        write_planes: bool = True,
+        before_write: Optional[Callable[[NWBFile], None]] = None,
+    ) -> NWBFile:
+        """
+        Run the conversion into an HDF5 file or, with the 'zarr' backend, into an NWB-Zarr store.
+
+        With the 'zarr' backend, the NWBFile is assembled in memory and written with 'write_zarr_nwbfile', where
+        the streamed datasets are written by a pool of 'max_write_workers' threads. When 'write_planes' is False,
+        the imaging planes are left empty to be written with the 'write_planes' of the 'Ophys' interface.
+        When 'before_write' is specified, it is called with the assembled NWBFile before it is written (e.g. to
+        inspect it), and nothing is written when it raises.
+        """
+        if backend not in ("hdf5", "zarr"):
+            raise ValueError(f"The backend must be either 'hdf5' or 'zarr', not '{backend}'.")
+
+        if backend == "hdf5" and before_write is None:
+            nwbfile_out = super().run_conversion(
+                nwbfile_path=nwbfile_path,
+                nwbfile=nwbfile,
+                metadata=metadata,
+                overwrite=overwrite,
+                conversion_options=conversion_options,
+            )
+        else:
+            nwbfile_out = super().run_conversion(
+                nwbfile=nwbfile,
+                metadata=metadata,
+                conversion_options=conversion_options,
+            )
+            if before_write is not None:
+                before_write(nwbfile_out)
+            if nwbfile_path is not None and backend == "hdf5":
+                # The in-memory NWBFile is written when the context exits
+                with make_or_load_nwbfile(
+                    nwbfile_path=nwbfile_path, nwbfile=nwbfile_out, overwrite=overwrite, verbose=self.verbose
+                ):
+                    pass
+            elif nwbfile_path is not None:
+                write_zarr_nwbfile(
+                    nwbfile=nwbfile_out, nwbfile_path=nwbfile_path, overwrite=overwrite, max_workers=max_write_workers
+                )
+        # The imaging planes are filled from a single pass over the TIFF once the file is written
+        if nwbfile_path is not None and write_planes:
+            self.data_interface_objects["Ophys"].write_planes(
+                nwbfile_path=nwbfile_path, verbose=self.verbose, backend=backend
+            )
+
+        return nwbfile_out
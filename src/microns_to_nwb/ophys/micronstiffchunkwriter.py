@@ -0,0 +1,115 @@
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from itertools import product
+
+import numpy as np
+from h5py import Dataset, h5z
+
+
+def _validate_block(dataset, start_frame: int, frames: np.ndarray):
+    if start_frame % dataset.chunks[0] != 0:
+        raise ValueError(
+            f"The start frame ({start_frame}) must be a multiple of the chunk length ({dataset.chunks[0]})."
+        )
+    if start_frame + frames.shape[0] > dataset.shape[0] or frames.shape[1:] != dataset.shape[1:]:
+        raise ValueError(
+            f"The frames of shape {frames.shape} from frame {start_frame} do not fit into the dataset of "
+            f"shape {dataset.shape}."
+        )
+
+
+class CompressedChunkWriter:
+    """
+    Write blocks of frames into a chunked dataset with the chunks compressed in a thread pool.
+
+    The chunks of each block are compressed concurrently (zlib releases the GIL, so the threads scale with the
+    cores), while the compressed bytes are written from the calling thread with direct chunk writes, bypassing the
+    HDF5 filter pipeline. The blocks must start at a chunk boundary along the frames axis.
+    """
+
+    def __init__(self, dataset: Dataset, executor: ThreadPoolExecutor):
+        if dataset.chunks is None:
+            raise ValueError(f"The dataset '{dataset.name}' must be chunked to write chunks directly.")
+        dataset_creation_properties = dataset.id.get_create_plist()
+        filter_ids = [
+            dataset_creation_properties.get_filter(index)[0]
+            for index in range(dataset_creation_properties.get_nfilters())
+        ]
+        if not set(filter_ids) <= {h5z.FILTER_DEFLATE}:
+            raise ValueError(
+                f"The dataset '{dataset.name}' must be either uncompressed or compressed only with 'gzip' "
+                "to write chunks directly."
+            )
+
+        self.dataset = dataset
+        self._executor = executor
+        self._compression_level = dataset.compression_opts if dataset.compression == "gzip" else None
+
+    def _compress(self, chunk: np.ndarray) -> bytes:
+        if self._compression_level is None:
+            return chunk.tobytes()
+        return zlib.compress(chunk.tobytes(), self._compression_level)
+
+    def _get_chunk(self, frames: np.ndarray, chunk_offset: tuple) -> np.ndarray:
+        chunk_selection = tuple(
+            slice(offset, offset + chunk_length) for offset, chunk_length in zip(chunk_offset, self.dataset.chunks)
+        )
+        chunk = np.ascontiguousarray(frames[chunk_selection], dtype=self.dataset.dtype)
+        if chunk.shape != self.dataset.chunks:
+            # The edge chunks are stored with the full chunk shape
+            chunk = np.pad(chunk, [(0, length - size) for length, size in zip(self.dataset.chunks, chunk.shape)])
+        return chunk
+
+    def write(self, start_frame: int, frames: np.ndarray):
+        """Write the 'frames' into the dataset starting from 'start_frame'."""
+        _validate_block(dataset=self.dataset, start_frame=start_frame, frames=frames)
+
+        chunk_offsets = list(
+            product(
+                *[range(0, length, chunk_length) for length, chunk_length in zip(frames.shape, self.dataset.chunks)]
+            )
+        )
+        compressed_chunks = self._executor.map(
+            lambda chunk_offset: self._compress(self._get_chunk(frames=frames, chunk_offset=chunk_offset)),
+            chunk_offsets,
+        )
+        for chunk_offset, compressed_chunk in zip(chunk_offsets, compressed_chunks):
+            dataset_offset = (start_frame + chunk_offset[0],) + chunk_offset[1:]
+            self.dataset.id.write_direct_chunk(dataset_offset, compressed_chunk)
+
+
+class ZarrChunkWriter:
+    """
+    Write blocks of frames into a chunked Zarr array with the chunks compressed and written in a thread pool.
+
+    Each chunk of a Zarr array is stored as a separate object, so the slabs of chunks along the frames axis are
+    compressed and written concurrently. The blocks must start at a chunk boundary along the frames axis.
+    """
+
+    def __init__(self, dataset, executor: ThreadPoolExecutor):
+        self.dataset = dataset
+        self._executor = executor
+
+    def _write_slab(self, start_frame: int, frames: np.ndarray):
+        self.dataset[start_frame : start_frame + frames.shape[0]] = frames
+
+    def write(self, start_frame: int, frames: np.ndarray):
+        """Write the 'frames' into the dataset starting from 'start_frame'."""
+        _validate_block(dataset=self.dataset, start_frame=start_frame, frames=frames)
+
+        num_frames_per_chunk = self.dataset.chunks[0]
+        futures = [
+            self._executor.submit(
+                self._write_slab, start_frame + offset, frames[offset : offset + num_frames_per_chunk]
+            )
+            for offset in range(0, frames.shape[0], num_frames_per_chunk)
+        ]
+        for future in futures:
+            future.result()
+
+
+def make_chunk_writer(dataset, executor: ThreadPoolExecutor):
+    """Return the chunk writer of an HDF5 dataset or of a Zarr array."""
+    if isinstance(dataset, Dataset):
+        return CompressedChunkWriter(dataset=dataset, executor=executor)
+    return ZarrChunkWriter(dataset=dataset, executor=executor)
@@ -1,14 +1,76 @@
-from typing import Optional
+import multiprocessing
+from concurrent.futures import as_completed, ProcessPoolExecutor
+from contextlib import contextmanager
+from copy import deepcopy
+from functools import partial
+from pathlib import Path
+from typing import Callable, ContextManager, List, Optional
 
+import numpy as np
+from h5py import File
+from hdmf.data_utils import AbstractDataChunkIterator
 from neuroconv.basedatainterface import BaseDataInterface
 from neuroconv.tools.nwb_helpers import make_or_load_nwbfile, get_module
-from neuroconv.tools.roiextractors import add_two_photon_series
-from neuroconv.utils import FilePathType, get_base_schema, get_schema_from_hdmf_class
-from phase3 import nda
-from pynwb import NWBFile
+from neuroconv.tools.roiextractors.roiextractors import _imaging_frames_to_hdmf_iterator
+from neuroconv.tools.roiextractors.imagingextractordatachunkiterator import ImagingExtractorDataChunkIterator
+from neuroconv.utils import FilePathType, get_base_schema, get_schema_from_hdmf_class, calculate_regular_series_rate
+from pynwb import NWBFile, TimeSeries
 from pynwb.ophys import ImagingPlane, TwoPhotonSeries
 
 from ophys.micronstiffimagingextractor import MicronsTiffImagingExtractor
+from ophys.micronstiffplanereader import MicronsTiffPlaneReader
+from ophys.micronstiffplanewriter import assemble_planes, write_plane_to_file, write_plane_to_zarr
+from tools.clocks import get_timing_kwargs
+from tools.compression import make_data_io
+from tools.database import get_session_data
+from tools.nwb_helpers import allow_none_for_optional_options
+
+
+class _EmptyImagingExtractorDataChunkIterator(ImagingExtractorDataChunkIterator):
+    """Allocate the full chunked dataset of an imaging extractor without reading or writing any of its frames."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buffer_selection_generator = iter(())
+
+
+class _MeasuredDataChunkIterator(AbstractDataChunkIterator):
+    """Iterate the chunks of 'iterator' in the context of 'measure', which is entered once the first chunk is read."""
+
+    def __init__(self, iterator: AbstractDataChunkIterator, measure: Callable[[], ContextManager]):
+        self._iterator = iterator
+        self._measure = measure
+        self._context = None
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._context is None:
+            self._context = self._measure()
+            self._context.__enter__()
+        try:
+            return next(self._iterator)
+        except StopIteration:
+            self._context.__exit__(None, None, None)
+            raise
+        except BaseException as e:
+            self._context.__exit__(type(e), e, e.__traceback__)
+            raise
+
+    def recommended_chunk_shape(self):
+        return self._iterator.recommended_chunk_shape()
+
+    def recommended_data_shape(self):
+        return self._iterator.recommended_data_shape()
+
+    @property
+    def dtype(self):
+        return self._iterator.dtype
+
+    @property
+    def maxshape(self):
+        return self._iterator.maxshape
 
 
 class MicronsTiffImagingInterface(BaseDataInterface):
@@ -23,6 +85,14 @@ class MicronsTiffImagingInterface(BaseDataInterface):
             file_path=file_path,
             scan_key=scan_key,
         )
+        self._planes_to_write = None
+        self._measure_plane = None
+
+    @classmethod
+    def get_conversion_options_schema(cls):
+        return allow_none_for_optional_options(
+            conversion_options_schema=super().get_conversion_options_schema(), run_conversion=cls.run_conversion
+        )
 
     def get_metadata_schema(self):
         metadata_schema = super().get_metadata_schema()
@@ -54,8 +124,9 @@ class MicronsTiffImagingInterface(BaseDataInterface):
     def get_metadata(self):
         """Child DataInterface classes should override this to match their metadata."""
         metadata = dict(Ophys=dict(TwoPhotonSeries=[], ImagingPlane=[]))
-        all_field_data = (nda.Field() & self.source_data["scan_key"]).fetch(as_dict=True)
-        imaging_rate = (nda.Scan() & self.source_data["scan_key"]).fetch1("fps")
+        session_data = get_session_data(self.source_data["scan_key"])
+        all_field_data = session_data.get_fields()
+        imaging_rate = session_data.get_scan()["fps"]
         for field_data in all_field_data:
             two_photon_series_name = f"TwoPhotonSeries{field_data['field']}"
             imaging_plane_name = f"ImagingPlane{field_data['field']}"
@@ -90,10 +161,39 @@ class MicronsTiffImagingInterface(BaseDataInterface):
         verbose: bool = True,
         iterator_type: Optional[str] = "v2",
         iterator_options: Optional[dict] = None,
+        plane_reader: str = "per_plane",
+        max_plane_workers: Optional[int] = None,
+        max_compression_workers: Optional[int] = None,
+        compression_options: Optional[dict] = None,
     ):
-        num_frames, num_fields, sampling_frequency = (nda.Scan & self.source_data["scan_key"]).fetch1(
-            "nframes", "nfields", "fps"
-        )
+        """
+        Add a TwoPhotonSeries for each field of the scan.
+
+        With the 'per_plane' plane reader (the default), the data of each field is read and written separately.
+        With the 'single_pass' plane reader, the TwoPhotonSeries are added with empty datasets that are filled from
+        one sequential pass over the interleaved TIFF once the file is written (see 'write_planes').
+        With the 'parallel' plane reader, each plane is written into its own HDF5 file by a separate process
+        (at most 'max_plane_workers' at a time) and the compressed datasets are copied into the NWB file.
+        Until 'write_planes' completes, the file written with these two plane readers has zero-filled TwoPhotonSeries,
+        so they require the chunks of the 'v2' iterator_type.
+        For the 'single_pass' and 'parallel' plane readers, 'max_compression_workers' compresses the chunks in a pool
+        of that many threads and writes them directly, bypassing the HDF5 filter pipeline.
+        The 'compression_options' select the codecs of the 'TwoPhotonSeries' data and of the 'timestamps'
+        (see tools.compression.get_compression_kwargs), the 'per_plane' plane reader always uses gzip.
+        """
+        if plane_reader not in ("single_pass", "parallel", "per_plane"):
+            raise ValueError(
+                f"The plane reader must be one of 'single_pass', 'parallel' or 'per_plane', not '{plane_reader}'."
+            )
+        if plane_reader != "per_plane" and iterator_type != "v2":
+            raise ValueError(
+                f"The '{plane_reader}' plane reader requires the 'v2' iterator_type, not '{iterator_type}'."
+            )
+        if plane_reader == "per_plane" and "TwoPhotonSeries" in (compression_options or dict()):
+            raise ValueError("The codec of the TwoPhotonSeries cannot be selected with the 'per_plane' plane reader.")
+
+        scan = get_session_data(self.source_data["scan_key"]).get_scan()
+        num_frames, num_fields, sampling_frequency = scan["nframes"], scan["nfields"], scan["fps"]
 
         with make_or_load_nwbfile(
             nwbfile_path=nwbfile_path,
@@ -103,9 +203,12 @@ class MicronsTiffImagingInterface(BaseDataInterface):
             verbose=verbose,
         ) as nwbfile_out:
             ophys = get_module(nwbfile_out, "ophys")
-            frame_times = (
-                ophys.get_data_interface("Fluorescence").roi_response_series["RoiResponseSeries1"].timestamps[:]
-            )
+            # The TwoPhotonSeries link to the frame times that are stored by the first RoiResponseSeries
+            frame_times_series = ophys.get_data_interface("Fluorescence").roi_response_series["RoiResponseSeries1"]
+            if frame_times_series.timestamps is not None:
+                frame_times = frame_times_series.timestamps[:]
+            else:
+                frame_times = frame_times_series.starting_time + np.arange(num_frames) / frame_times_series.rate
             for plane_index in range(num_fields):
                 imaging_extractor = MicronsTiffImagingExtractor(
                     file_path=self.source_data["file_path"],
@@ -114,18 +217,275 @@ class MicronsTiffImagingInterface(BaseDataInterface):
                     num_frames_per_plane=num_frames,
                 )
 
-                imaging_extractor.set_times(times=frame_times)
-
                 if stub_test:
-                    extractor = imaging_extractor.frame_slice(0, stub_frames)
+                    imaging_extractor = imaging_extractor.frame_slice(0, stub_frames)
+                imaging_extractor.set_times(times=frame_times[: imaging_extractor.get_num_frames()])
 
-                add_two_photon_series(
-                    imaging=extractor if stub_test else imaging_extractor,
+                # The planes of the other plane readers are written once the file is written
+                if plane_reader == "per_plane":
+                    frames_iterator = _imaging_frames_to_hdmf_iterator(
+                        imaging=imaging_extractor, iterator_type=iterator_type, iterator_options=iterator_options
+                    )
+                    if self._measure_plane is not None:
+                        frames_iterator = _MeasuredDataChunkIterator(
+                            iterator=frames_iterator,
+                            measure=partial(
+                                self._measure_plane, metadata["Ophys"]["TwoPhotonSeries"][plane_index]["name"]
+                            ),
+                        )
+                else:
+                    frames_iterator = _EmptyImagingExtractorDataChunkIterator(
+                        imaging_extractor=imaging_extractor, **(iterator_options or dict())
+                    )
+                self._add_two_photon_series(
+                    imaging=imaging_extractor,
                     nwbfile=nwbfile_out,
                     metadata=metadata,
                     two_photon_series_index=plane_index,
-                    iterator_type=iterator_type,
-                    iterator_options=iterator_options,
+                    frames_iterator=frames_iterator,
+                    compression_options=compression_options,
+                    timestamps_series=frame_times_series,
                 )
-                if verbose:
+                if verbose and plane_reader == "per_plane":
                     print(f"TwoPhotonSeries data for plane {plane_index + 1} is added to nwbfile.")
+
+            if plane_reader != "per_plane":
+                self._planes_to_write = dict(
+                    plane_reader=plane_reader,
+                    max_workers=max_plane_workers,
+                    max_compression_workers=max_compression_workers,
+                    compression_options=compression_options,
+                    sampling_frequency=sampling_frequency,
+                    two_photon_series_names=[
+                        two_photon_series_metadata["name"]
+                        for two_photon_series_metadata in metadata["Ophys"]["TwoPhotonSeries"][:num_fields]
+                    ],
+                    num_frames_per_plane=num_frames,
+                    num_frames=stub_frames if stub_test else num_frames,
+                    buffer_gb=(iterator_options or dict()).get("buffer_gb", 1.0),
+                )
+
+        if nwbfile_path is not None:
+            self.write_planes(nwbfile_path=nwbfile_path, verbose=verbose)
+
+    def _add_two_photon_series(
+        self,
+        imaging: MicronsTiffImagingExtractor,
+        nwbfile: NWBFile,
+        metadata: dict,
+        two_photon_series_index: int,
+        frames_iterator: AbstractDataChunkIterator,
+        compression_options: Optional[dict] = None,
+        timestamps_series: Optional[TimeSeries] = None,
+    ):
+        """
+        Add a TwoPhotonSeries with the frames of 'frames_iterator', like 'add_two_photon_series' of neuroconv.
+
+        The timestamps of an irregular series are linked to those of 'timestamps_series' (a series of the same clock)
+        when it is specified and has the same timestamps, rather than stored again, and the series has the starting
+        time and rate of 'timestamps_series' when it has them (see tools.clocks.get_timing_kwargs).
+        """
+        two_photon_series_kwargs = deepcopy(metadata["Ophys"]["TwoPhotonSeries"][two_photon_series_index])
+        two_photon_series_kwargs.update(
+            imaging_plane=nwbfile.get_imaging_plane(name=two_photon_series_kwargs["imaging_plane"]),
+            dimension=imaging.get_image_size(),
+        )
+        two_photon_series_kwargs.update(data=make_data_io(frames_iterator, "TwoPhotonSeries", compression_options))
+
+        timestamps = imaging.frame_to_time(np.arange(imaging.get_num_frames()))
+        estimated_rate = calculate_regular_series_rate(series=timestamps)
+        if estimated_rate and (timestamps_series is None or timestamps_series.rate is None):
+            two_photon_series_kwargs.update(starting_time=timestamps[0], rate=estimated_rate)
+        else:
+            two_photon_series_kwargs.update(rate=None)
+            two_photon_series_kwargs.update(
+                get_timing_kwargs(
+                    timestamps,
+                    description=two_photon_series_kwargs.get("description", "no description"),
+                    compression_options=compression_options,
+                    timestamps_series=timestamps_series,
+                )
+            )
+
+        nwbfile.add_acquisition(TwoPhotonSeries(**two_photon_series_kwargs))
+
+    def get_planes_to_write(self) -> Optional[dict]:
+        """The options of the planes that 'write_planes' fills, to resume writing them from another interface."""
+        return deepcopy(self._planes_to_write)
+
+    def set_planes_to_write(self, planes_to_write: Optional[dict]):
+        self._planes_to_write = deepcopy(planes_to_write)
+
+    def set_plane_measurement(self, measure_plane: Optional[Callable[[str], ContextManager]]):
+        """
+        Write each plane of the 'per_plane' plane reader in the context returned by 'measure_plane' for its name.
+
+        The planes are written one at a time when the file is written, so this measures each of them exactly as long
+        as the datasets are written sequentially (i.e. with the 'hdf5' backend).
+        """
+        self._measure_plane = measure_plane
+
+    @classmethod
+    def get_plane_sizes(
+        cls, nwbfile_path: FilePathType, two_photon_series_names: List[str], backend: str = "hdf5"
+    ) -> dict:
+        """The number of bytes that are stored for the data of each of the 'two_photon_series_names'."""
+        with cls._open_nwbfile(nwbfile_path=nwbfile_path, backend=backend) as file:
+            datasets = {name: file["acquisition"][name]["data"] for name in two_photon_series_names}
+            if backend == "zarr":
+                return {name: dataset.nbytes_stored for name, dataset in datasets.items()}
+            return {name: dataset.id.get_storage_size() for name, dataset in datasets.items()}
+
+    def write_planes(
+        self,
+        nwbfile_path: FilePathType,
+        verbose: bool = True,
+        backend: str = "hdf5",
+        two_photon_series_names: Optional[List[str]] = None,
+        on_plane_written: Optional[Callable[[str], None]] = None,
+    ):
+        """
+        Fill the empty TwoPhotonSeries datasets of the written NWB file with the planes of the TIFF.
+
+        With the 'zarr' backend, the NWB file is an NWB-Zarr store whose chunks the 'parallel' plane reader writes
+        directly from each process. Only the 'two_photon_series_names' are written when specified (e.g. the planes
+        that are missing after an interrupted run), and 'on_plane_written' is called with the name of each plane
+        once it is written.
+        """
+        if self._planes_to_write is None:
+            return
+
+        all_two_photon_series_names = self._planes_to_write["two_photon_series_names"]
+        if two_photon_series_names is None:
+            two_photon_series_names = all_two_photon_series_names
+        planes = {
+            plane_index: two_photon_series_name
+            for plane_index, two_photon_series_name in enumerate(all_two_photon_series_names)
+            if two_photon_series_name in two_photon_series_names
+        }
+        on_plane_written = on_plane_written or (lambda two_photon_series_name: None)
+        if not planes:
+            self._planes_to_write = None
+            return
+
+        if self._planes_to_write["plane_reader"] == "parallel":
+            if backend == "zarr":
+                self._write_planes_to_zarr_in_parallel(
+                    nwbfile_path=nwbfile_path, planes=planes, on_plane_written=on_plane_written
+                )
+            else:
+                self._write_planes_in_parallel(
+                    nwbfile_path=nwbfile_path, planes=planes, on_plane_written=on_plane_written
+                )
+            if verbose:
+                print(f"TwoPhotonSeries data for {len(planes)} planes is written to nwbfile in parallel.")
+            self._planes_to_write = None
+            return
+
+        plane_reader = MicronsTiffPlaneReader(
+            file_path=self.source_data["file_path"],
+            num_frames_per_plane=self._planes_to_write["num_frames_per_plane"],
+        )
+        with self._open_nwbfile(nwbfile_path=nwbfile_path, backend=backend) as file:
+            # The planes that are not written are still read, as they are interleaved with the others
+            datasets = [
+                file["acquisition"][planes[plane_index]]["data"] if plane_index in planes else None
+                for plane_index in range(len(all_two_photon_series_names))
+            ]
+            plane_reader.write_planes(
+                datasets=datasets,
+                buffer_gb=self._planes_to_write["buffer_gb"],
+                num_frames=self._planes_to_write["num_frames"],
+                max_compression_workers=self._planes_to_write["max_compression_workers"],
+            )
+        for two_photon_series_name in planes.values():
+            on_plane_written(two_photon_series_name)
+        self._planes_to_write = None
+
+        if verbose:
+            print(f"TwoPhotonSeries data for {len(planes)} planes is written to nwbfile from a single pass.")
+
+    @staticmethod
+    @contextmanager
+    def _open_nwbfile(nwbfile_path: FilePathType, backend: str = "hdf5"):
+        if backend == "zarr":
+            import zarr
+
+            yield zarr.open(str(nwbfile_path), mode="r+")
+            return
+        with File(nwbfile_path, "r+") as file:
+            yield file
+
+    def _write_planes_to_zarr_in_parallel(self, nwbfile_path: FilePathType, planes: dict, on_plane_written: Callable):
+        with ProcessPoolExecutor(
+            max_workers=self._planes_to_write["max_workers"], mp_context=multiprocessing.get_context("spawn")
+        ) as executor:
+            futures = {
+                executor.submit(
+                    write_plane_to_zarr,
+                    tiff_file_path=self.source_data["file_path"],
+                    nwbfile_path=str(nwbfile_path),
+                    two_photon_series_name=two_photon_series_name,
+                    plane_index=plane_index,
+                    num_frames_per_plane=self._planes_to_write["num_frames_per_plane"],
+                    sampling_frequency=self._planes_to_write["sampling_frequency"],
+                    num_frames=self._planes_to_write["num_frames"],
+                    buffer_gb=self._planes_to_write["buffer_gb"],
+                    max_compression_workers=self._planes_to_write["max_compression_workers"],
+                ): two_photon_series_name
+                for plane_index, two_photon_series_name in planes.items()
+            }
+            for future in as_completed(futures):
+                future.result()
+                on_plane_written(futures[future])
+
+    def _write_planes_in_parallel(self, nwbfile_path: FilePathType, planes: dict, on_plane_written: Callable):
+        nwbfile_path = Path(nwbfile_path)
+        two_photon_series_names = list(planes.values())
+        plane_file_paths = {
+            two_photon_series_name: nwbfile_path.parent / f".{nwbfile_path.stem}_{two_photon_series_name}.h5"
+            for two_photon_series_name in two_photon_series_names
+        }
+
+        # The planes are written with the same chunks as the empty datasets in the NWB file
+        with File(nwbfile_path, "r") as file:
+            chunks = {
+                two_photon_series_name: file["acquisition"][two_photon_series_name]["data"].chunks
+                for two_photon_series_name in two_photon_series_names
+            }
+
+        try:
+            with ProcessPoolExecutor(
+                max_workers=self._planes_to_write["max_workers"], mp_context=multiprocessing.get_context("spawn")
+            ) as executor:
+                futures = {
+                    executor.submit(
+                        write_plane_to_file,
+                        tiff_file_path=self.source_data["file_path"],
+                        plane_file_path=str(plane_file_paths[two_photon_series_name]),
+                        plane_index=plane_index,
+                        num_frames_per_plane=self._planes_to_write["num_frames_per_plane"],
+                        sampling_frequency=self._planes_to_write["sampling_frequency"],
+                        num_frames=self._planes_to_write["num_frames"],
+                        buffer_gb=self._planes_to_write["buffer_gb"],
+                        max_compression_workers=self._planes_to_write["max_compression_workers"],
+                        chunks=chunks[two_photon_series_name],
+                        compression_options=self._planes_to_write["compression_options"],
+                    ): two_photon_series_name
+                    for plane_index, two_photon_series_name in planes.items()
+                }
+                # Each plane is copied into the NWB file as soon as it is written
+                for future in as_completed(futures):
+                    future.result()
+                    two_photon_series_name = futures[future]
+                    assemble_planes(
+                        nwbfile_path=nwbfile_path,
+                        plane_file_paths={two_photon_series_name: plane_file_paths[two_photon_series_name]},
+                    )
+                    on_plane_written(two_photon_series_name)
+        finally:
+            for plane_file_path in plane_file_paths.values():
+                try:
+                    plane_file_path.unlink()
+                except FileNotFoundError:
+                    pass
@@ -0,0 +1,108 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
+
+import numpy as np
+from h5py import Dataset
+from neuroconv.utils import FilePathType
+from tifffile import memmap, TiffFile
+
+from ophys.micronstiffchunkwriter import make_chunk_writer
+
+
+class MicronsTiffPlaneReader:
+    """
+    Read all the planes of an interleaved MICrONS TIFF in a single sequential pass.
+
+    The pages of the TIFF alternate between the fields (page i belongs to plane i % num_planes). The file is read
+    in blocks of consecutive pages, and each page of a block is routed to the buffer of its plane.
+    """
+
+    def __init__(self, file_path: FilePathType, num_frames_per_plane: int):
+        self.file_path = file_path
+
+        with TiffFile(self.file_path) as tif:
+            shape = tif.series[0].shape
+            self._dtype = tif.series[0].dtype
+
+        self._video = memmap(self.file_path, mode="r")
+
+        assert shape[0] % num_frames_per_plane == 0
+        self._num_frames = num_frames_per_plane
+        self._num_planes = int(shape[0] / num_frames_per_plane)
+        self._num_rows, self._num_columns = shape[1:]
+
+        self.bytes_read = 0
+
+    def get_num_planes(self) -> int:
+        return self._num_planes
+
+    def get_num_frames(self) -> int:
+        return self._num_frames
+
+    def get_image_size(self) -> Tuple[int, int]:
+        return self._num_rows, self._num_columns
+
+    def get_frame_size_in_bytes(self) -> int:
+        return self._num_rows * self._num_columns * self._dtype.itemsize
+
+    def iter_blocks(self, num_frames_per_block: int, num_frames: Optional[int] = None):
+        """Yield the start frame and the (frames, rows, columns) frames of each plane for consecutive blocks."""
+        num_frames = num_frames or self._num_frames
+        assert 0 < num_frames <= self._num_frames
+
+        for start_frame in range(0, num_frames, num_frames_per_block):
+            end_frame = min(start_frame + num_frames_per_block, num_frames)
+            block = np.asarray(self._video[start_frame * self._num_planes : end_frame * self._num_planes])
+            self.bytes_read += block.nbytes
+            yield start_frame, [block[plane_index :: self._num_planes] for plane_index in range(self._num_planes)]
+
+    def write_planes(
+        self,
+        datasets: List[Optional[Dataset]],
+        buffer_gb: float = 1.0,
+        num_frames: Optional[int] = None,
+        max_compression_workers: Optional[int] = None,
+    ):
+        """
+        Fill the pre-allocated (frames, columns, rows) HDF5 dataset or Zarr array of each plane in one pass over the
+        TIFF.
+
+        The blocks hold as many frames of every plane as fit into 'buffer_gb', aligned to the chunks of the datasets.
+        The planes whose dataset is None (e.g. already written) are read but not written.
+        When 'max_compression_workers' is specified, the chunks are compressed in a pool of that many threads and
+        written with direct chunk writes (or written by the threads into the Zarr arrays).
+        """
+        assert len(datasets) == self._num_planes, "A dataset (or None) must be specified for each plane!"
+        first_dataset = next(dataset for dataset in datasets if dataset is not None)
+        num_frames = num_frames or first_dataset.shape[0]
+
+        num_frames_per_block = max(1, int(buffer_gb * 1e9 // (self._num_planes * self.get_frame_size_in_bytes())))
+        num_frames_per_chunk = first_dataset.chunks[0] if first_dataset.chunks is not None else 1
+        if max_compression_workers is not None:
+            # Direct chunk writes need blocks of whole chunks
+            num_frames_per_block = max(num_frames_per_block, num_frames_per_chunk)
+        if num_frames_per_block > num_frames_per_chunk:
+            num_frames_per_block -= num_frames_per_block % num_frames_per_chunk
+
+        if max_compression_workers is None:
+            for start_frame, frames_for_each_plane in self.iter_blocks(
+                num_frames_per_block=num_frames_per_block, num_frames=num_frames
+            ):
+                for dataset, frames in zip(datasets, frames_for_each_plane):
+                    if dataset is None:
+                        continue
+                    dataset[start_frame : start_frame + len(frames)] = frames.transpose((0, 2, 1))
+            return
+
+        with ThreadPoolExecutor(max_workers=max_compression_workers) as executor:
+            chunk_writers = [
+                make_chunk_writer(dataset=dataset, executor=executor) if dataset is not None else None
+                for dataset in datasets
+            ]
+            for start_frame, frames_for_each_plane in self.iter_blocks(
+                num_frames_per_block=num_frames_per_block, num_frames=num_frames
+            ):
+                for chunk_writer, frames in zip(chunk_writers, frames_for_each_plane):
+                    if chunk_writer is None:
+                        continue
+                    chunk_writer.write(start_frame=start_frame, frames=frames.transpose((0, 2, 1)))
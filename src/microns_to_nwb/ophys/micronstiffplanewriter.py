@@ -0,0 +1,140 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional
+
+import numpy as np
+from h5py import File
+from neuroconv.utils import FilePathType
+
+from ophys.micronstiffchunkwriter import make_chunk_writer
+from ophys.micronstiffimagingextractor import MicronsTiffImagingExtractor
+from tools.compression import get_compression_kwargs
+
+
+def write_plane(
+    dataset,
+    tiff_file_path: FilePathType,
+    plane_index: int,
+    num_frames_per_plane: int,
+    sampling_frequency: float,
+    num_frames: Optional[int] = None,
+    buffer_gb: float = 1.0,
+    max_compression_workers: Optional[int] = None,
+):
+    """
+    Fill the pre-allocated (frames, columns, rows) HDF5 dataset or Zarr array of one plane.
+
+    When 'max_compression_workers' is specified, the chunks are compressed in a pool of that many threads and
+    written with direct chunk writes (or written by the threads into the Zarr array).
+    """
+    imaging_extractor = MicronsTiffImagingExtractor(
+        file_path=tiff_file_path,
+        sampling_frequency=sampling_frequency,
+        plane_index=plane_index,
+        num_frames_per_plane=num_frames_per_plane,
+    )
+    num_frames = num_frames or dataset.shape[0]
+    chunks = dataset.chunks
+    frame_size_in_bytes = int(np.prod(imaging_extractor.get_image_size())) * imaging_extractor.get_dtype().itemsize
+
+    # The buffers are aligned to the chunks, so that each chunk is compressed exactly once
+    num_frames_per_buffer = max(chunks[0], int(buffer_gb * 1e9 // frame_size_in_bytes))
+    if num_frames_per_buffer > chunks[0]:
+        num_frames_per_buffer -= num_frames_per_buffer % chunks[0]
+
+    with ThreadPoolExecutor(max_workers=max_compression_workers or 1) as executor:
+        chunk_writer = None
+        if max_compression_workers is not None:
+            chunk_writer = make_chunk_writer(dataset=dataset, executor=executor)
+        for start_frame in range(0, num_frames, num_frames_per_buffer):
+            end_frame = min(start_frame + num_frames_per_buffer, num_frames)
+            video = imaging_extractor.get_video(start_frame=start_frame, end_frame=end_frame)
+            if chunk_writer is None:
+                dataset[start_frame:end_frame] = video.transpose((0, 2, 1))
+            else:
+                chunk_writer.write(start_frame=start_frame, frames=video.transpose((0, 2, 1)))
+
+
+def write_plane_to_file(
+    tiff_file_path: FilePathType,
+    plane_file_path: FilePathType,
+    plane_index: int,
+    num_frames_per_plane: int,
+    sampling_frequency: float,
+    chunks: tuple,
+    compression_options: Optional[dict] = None,
+    num_frames: Optional[int] = None,
+    buffer_gb: float = 1.0,
+    max_compression_workers: Optional[int] = None,
+):
+    """
+    Write the (frames, columns, rows) data of one plane into the 'data' dataset of its own HDF5 file.
+
+    The dataset is compressed with the codec selected for the 'TwoPhotonSeries' in 'compression_options'.
+    """
+    imaging_extractor = MicronsTiffImagingExtractor(
+        file_path=tiff_file_path,
+        sampling_frequency=sampling_frequency,
+        plane_index=plane_index,
+        num_frames_per_plane=num_frames_per_plane,
+    )
+    num_frames = num_frames or imaging_extractor.get_num_frames()
+    num_rows, num_columns = imaging_extractor.get_image_size()
+
+    with File(plane_file_path, "w") as file:
+        dataset = file.create_dataset(
+            name="data",
+            shape=(num_frames, num_columns, num_rows),
+            dtype=imaging_extractor.get_dtype(),
+            chunks=chunks,
+            **get_compression_kwargs(dataset_class="TwoPhotonSeries", compression_options=compression_options),
+        )
+        write_plane(
+            dataset=dataset,
+            tiff_file_path=tiff_file_path,
+            plane_index=plane_index,
+            num_frames_per_plane=num_frames_per_plane,
+            sampling_frequency=sampling_frequency,
+            num_frames=num_frames,
+            buffer_gb=buffer_gb,
+            max_compression_workers=max_compression_workers,
+        )
+
+
+def write_plane_to_zarr(
+    tiff_file_path: FilePathType,
+    nwbfile_path: FilePathType,
+    two_photon_series_name: str,
+    plane_index: int,
+    num_frames_per_plane: int,
+    sampling_frequency: float,
+    num_frames: Optional[int] = None,
+    buffer_gb: float = 1.0,
+    max_compression_workers: Optional[int] = None,
+):
+    """Fill the empty data of a TwoPhotonSeries in an NWB-Zarr store, which other processes can write concurrently."""
+    import zarr
+
+    dataset = zarr.open(str(nwbfile_path), mode="r+")["acquisition"][two_photon_series_name]["data"]
+    write_plane(
+        dataset=dataset,
+        tiff_file_path=tiff_file_path,
+        plane_index=plane_index,
+        num_frames_per_plane=num_frames_per_plane,
+        sampling_frequency=sampling_frequency,
+        num_frames=num_frames,
+        buffer_gb=buffer_gb,
+        max_compression_workers=max_compression_workers,
+    )
+
+
+def assemble_planes(nwbfile_path: FilePathType, plane_file_paths: Dict[str, FilePathType]):
+    """Replace the empty data of each TwoPhotonSeries in the NWB file with the dataset of its plane file."""
+    with File(nwbfile_path, "r+") as file:
+        for two_photon_series_name, plane_file_path in plane_file_paths.items():
+            two_photon_series_group = file["acquisition"][two_photon_series_name]
+            attributes = dict(two_photon_series_group["data"].attrs)
+            del two_photon_series_group["data"]
+            with File(plane_file_path, "r") as plane_file:
+                # Copying a dataset between files copies its compressed chunks without recompressing them
+                file.copy(plane_file["data"], two_photon_series_group, name="data")
+            two_photon_series_group["data"].attrs.update(attributes)
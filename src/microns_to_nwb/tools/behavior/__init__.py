@@ -1 +1,9 @@
-from .behavior import add_eye_tracking, add_treadmill, find_earliest_timestamp
+from .behavior import (
+    add_eye_tracking,
+    add_treadmill,
+    fetch_eye_tracking_data,
+    fetch_treadmill_data,
+)
+
+# find_earliest_timestamp moved to tools.clocks, it is still exported here for the existing imports
+from tools.clocks import find_earliest_timestamp
@@ -1,33 +1,57 @@
 import numpy as np
-from hdmf.backends.hdf5 import H5DataIO
-from phase3 import nda
 from pynwb import TimeSeries
 from pynwb.behavior import PupilTracking, SpatialSeries, EyeTracking
 
+from tools.clocks import get_timing_kwargs
+from tools.compression import make_data_io
+from tools.database import fetch1
+
+
+def fetch_eye_tracking_data(scan_key):
+    attributes = ("pupil_times", "pupil_min_r", "pupil_maj_r", "pupil_x", "pupil_y")
+    return dict(zip(attributes, fetch1("RawManualPupil", scan_key, *attributes)))
+
+
+def fetch_treadmill_data(scan_key):
+    attributes = ("treadmill_timestamps", "treadmill_velocity")
+    return dict(zip(attributes, fetch1("RawTreadmill", scan_key, *attributes)))
 
-def add_eye_tracking(scan_key, nwb, timestamps):
-    pupil_minor_radius_data, pupil_major_radius_data, pupil_x, pupil_y = (nda.RawManualPupil & scan_key).fetch1(
-        "pupil_min_r", "pupil_maj_r", "pupil_x", "pupil_y"
-    )
+
+def add_eye_tracking(
+    scan_key, nwb, timestamps, eye_tracking_data=None, compression_options=None, jitter_tolerance=None
+):
+    eye_tracking_data = eye_tracking_data or fetch_eye_tracking_data(scan_key)
+    pupil_minor_radius_data = eye_tracking_data["pupil_min_r"]
+    pupil_major_radius_data = eye_tracking_data["pupil_maj_r"]
+    pupil_x = eye_tracking_data["pupil_x"]
+    pupil_y = eye_tracking_data["pupil_y"]
 
     good_indices = _crop_indices(pupil_minor_radius_data)
+    pupil_timestamps = timestamps[good_indices]
 
     pupil_minor_radius = TimeSeries(
         name="pupil_minor_radius",
-        description="Minor radius extracted from the pupil tracking ellipse."
-        "The values are estimated in the relative pixel units.",
-        data=H5DataIO(pupil_minor_radius_data[good_indices], compression=True),
-        timestamps=H5DataIO(timestamps[good_indices], compression=True),
+        data=make_data_io(pupil_minor_radius_data[good_indices], "behavior", compression_options),
         unit="px",
+        **get_timing_kwargs(
+            pupil_timestamps,
+            description="Minor radius extracted from the pupil tracking ellipse."
+            "The values are estimated in the relative pixel units.",
+            compression_options=compression_options,
+            jitter_tolerance=jitter_tolerance,
+        ),
     )
 
     pupil_major_radius = TimeSeries(
         name="pupil_major_radius",
-        description="Major radius extracted from the pupil tracking ellipse."
-        "The values are estimated in the relative pixel units.",
-        data=H5DataIO(pupil_major_radius_data[good_indices], compression=True),
-        timestamps=pupil_minor_radius,
+        data=make_data_io(pupil_major_radius_data[good_indices], "behavior", compression_options),
         unit="px",
+        **get_timing_kwargs(
+            pupil_timestamps,
+            description="Major radius extracted from the pupil tracking ellipse."
+            "The values are estimated in the relative pixel units.",
+            timestamps_series=pupil_minor_radius,
+        ),
     )
 
     pupil_tracking = PupilTracking(time_series=[pupil_minor_radius, pupil_major_radius])
@@ -38,11 +62,14 @@ def add_eye_tracking(scan_key, nwb, timestamps):
 
     eye_position = SpatialSeries(
         name="eye_position",
-        description="The x,y position of the pupil." "The values are estimated in the relative pixel units.",
-        data=H5DataIO(np.c_[pupil_x_position, pupil_y_position], compression=True),
-        timestamps=pupil_minor_radius,
+        data=make_data_io(np.c_[pupil_x_position, pupil_y_position], "behavior", compression_options),
         unit="px",
         reference_frame="unknown",
+        **get_timing_kwargs(
+            pupil_timestamps,
+            description="The x,y position of the pupil." "The values are estimated in the relative pixel units.",
+            timestamps_series=pupil_minor_radius,
+        ),
     )
 
     eye_position_tracking = EyeTracking(eye_position)
@@ -50,20 +77,24 @@ def add_eye_tracking(scan_key, nwb, timestamps):
     nwb.add_acquisition(eye_position_tracking)
 
 
-def add_treadmill(scan_key, nwb, timestamps):
-    treadmill_velocity = (nda.RawTreadmill & scan_key).fetch1(
-        "treadmill_velocity",
-    )
+def add_treadmill(scan_key, nwb, timestamps, treadmill_data=None, compression_options=None, jitter_tolerance=None):
+    treadmill_data = treadmill_data or fetch_treadmill_data(scan_key)
+    treadmill_velocity = treadmill_data["treadmill_velocity"]
 
     good_indices = _crop_indices(behavior_data=treadmill_velocity)
 
     treadmill_velocity_raw = TimeSeries(
         name="treadmill_velocity",
-        data=H5DataIO(treadmill_velocity[good_indices], compression=True),
-        timestamps=H5DataIO(timestamps[good_indices], compression=True),
-        description="Cylindrical treadmill rostral-caudal position extracted at ~60-100 Hz and converted into velocity.",
+        data=make_data_io(treadmill_velocity[good_indices], "behavior", compression_options),
         unit="m/s",
         conversion=0.01,
+        **get_timing_kwargs(
+            timestamps[good_indices],
+            description="Cylindrical treadmill rostral-caudal position extracted at ~60-100 Hz and converted into "
+            "velocity.",
+            compression_options=compression_options,
+            jitter_tolerance=jitter_tolerance,
+        ),
     )
 
     nwb.add_acquisition(treadmill_velocity_raw)
@@ -82,9 +113,3 @@ def _crop_indices(behavior_data):
 
     indices = np.arange(first_value_index, last_value_index)
     return indices
-
-
-def find_earliest_timestamp(behavior_timestamps_arrays):
-    return min(
-        [timestamps[np.isnan(timestamps).argmin()] for timestamps in behavior_timestamps_arrays],
-    )
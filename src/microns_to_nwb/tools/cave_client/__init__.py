@@ -1 +1,3 @@
-from .cave import get_functional_coreg_table
+from .cave import get_functional_coreg_table, cache_functional_coreg_table
+from .cache import get_latest_cached_version, invalidate_functional_coreg_cache
+from .coregistration import MISSING_COREGISTRATION_VALUE, get_coregistration_columns
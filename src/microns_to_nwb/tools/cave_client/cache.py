@@ -0,0 +1,145 @@
+import json
+import os
+import shutil
+import tempfile
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+DEFAULT_CACHE_FOLDER_PATH = Path.home() / ".cache" / "microns_to_nwb" / "functional_coreg"
+
+
+def _get_cache_folder_path(cache_folder_path: Optional[str] = None) -> Path:
+    if cache_folder_path is None:
+        cache_folder_path = os.environ.get("MICRONS_CAVE_CACHE", DEFAULT_CACHE_FOLDER_PATH)
+    return Path(cache_folder_path)
+
+
+def _get_version_folder_path(cache_folder_path: Path, materialization_version: int) -> Path:
+    return cache_folder_path / f"v{materialization_version}"
+
+
+def _get_partition_folder_path(version_folder_path: Path, session: int, scan_idx: int) -> Path:
+    return version_folder_path / f"session_{session}_scan_{scan_idx}"
+
+
+def _column_to_array(values: pd.Series) -> np.ndarray:
+    if isinstance(values.dtype, pd.DatetimeTZDtype):
+        values = values.dt.tz_convert(None)
+    array = values.to_numpy()
+    if array.dtype == object:
+        # The missing values are stored as empty strings along with a mask (see '_get_missing_values')
+        array = np.array(values.where(values.notna(), "").astype(str).tolist(), dtype=str)
+    return array
+
+
+def _get_missing_values(values: pd.Series) -> Optional[np.ndarray]:
+    """The mask of the missing values of an object column, which are restored as None when it is read."""
+    if values.to_numpy().dtype != object or not values.isna().any():
+        return None
+    return values.isna().to_numpy()
+
+
+def is_functional_coreg_table_cached(materialization_version: int, cache_folder_path: Optional[str] = None) -> bool:
+    version_folder_path = _get_version_folder_path(_get_cache_folder_path(cache_folder_path), materialization_version)
+    return (version_folder_path / "meta.json").is_file()
+
+
+def get_latest_cached_version(cache_folder_path: Optional[str] = None) -> Optional[int]:
+    """The latest materialization version of the functional_coreg table in the cache, if any."""
+    cache_folder_path = _get_cache_folder_path(cache_folder_path)
+    cached_versions = [
+        int(version_folder_path.name[1:])
+        for version_folder_path in cache_folder_path.glob("v*")
+        if version_folder_path.name[1:].isdigit() and (version_folder_path / "meta.json").is_file()
+    ]
+    return max(cached_versions, default=None)
+
+
+def write_functional_coreg_cache(
+    coreg_table: pd.DataFrame,
+    materialization_version: int,
+    cache_folder_path: Optional[str] = None,
+) -> Path:
+    """
+    Store the functional_coreg table of one materialization version partitioned by (session, scan_idx).
+
+    Each partition is a folder with one .npy file per column, so a worker only reads the rows of its own scan.
+    """
+    cache_folder_path = _get_cache_folder_path(cache_folder_path)
+    version_folder_path = _get_version_folder_path(cache_folder_path, materialization_version)
+
+    cache_folder_path.mkdir(parents=True, exist_ok=True)
+    temporary_folder_path = Path(tempfile.mkdtemp(prefix=f".{version_folder_path.name}_", dir=cache_folder_path))
+    for (session, scan_idx), partition in coreg_table.groupby(["session", "scan_idx"], sort=False):
+        partition_folder_path = _get_partition_folder_path(temporary_folder_path, int(session), int(scan_idx))
+        partition_folder_path.mkdir()
+        for column_name in coreg_table.columns:
+            np.save(partition_folder_path / f"{column_name}.npy", _column_to_array(partition[column_name]))
+            missing_values = _get_missing_values(partition[column_name])
+            if missing_values is not None:
+                np.save(partition_folder_path / f"{column_name}_missing.npy", missing_values)
+
+    columns = {column_name: str(_column_to_array(coreg_table[column_name][:0]).dtype) for column_name in coreg_table}
+    with open(temporary_folder_path / "meta.json", "w") as f:
+        json.dump(dict(materialization_version=int(materialization_version), columns=columns), f)
+
+    try:
+        os.rename(temporary_folder_path, version_folder_path)
+    except OSError:
+        # Another worker cached the same version in the meantime
+        shutil.rmtree(temporary_folder_path, ignore_errors=True)
+
+    return version_folder_path
+
+
+def read_functional_coreg_cache(
+    scan_key: dict,
+    materialization_version: int,
+    cache_folder_path: Optional[str] = None,
+) -> pd.DataFrame:
+    """Read the rows of the cached functional_coreg table for a single (session, scan_idx)."""
+    version_folder_path = _get_version_folder_path(_get_cache_folder_path(cache_folder_path), materialization_version)
+    with open(version_folder_path / "meta.json", "r") as f:
+        columns = json.load(f)["columns"]
+
+    partition_folder_path = _get_partition_folder_path(
+        version_folder_path, int(scan_key["session"]), int(scan_key["scan_idx"])
+    )
+    if not partition_folder_path.exists():
+        # The scan has no coregistered units in this version
+        return pd.DataFrame({column_name: np.empty(0, dtype=dtype) for column_name, dtype in columns.items()})
+
+    coreg_table = pd.DataFrame(
+        {column_name: np.load(partition_folder_path / f"{column_name}.npy") for column_name in columns},
+    )
+    for column_name in columns:
+        missing_values_file_path = partition_folder_path / f"{column_name}_missing.npy"
+        if missing_values_file_path.is_file():
+            column = coreg_table[column_name].astype(object)
+            column[np.load(missing_values_file_path)] = None
+            coreg_table[column_name] = column
+    return coreg_table
+
+
+def invalidate_functional_coreg_cache(
+    cache_folder_path: Optional[str] = None, keep_version: Optional[int] = None
+) -> list:
+    """Remove the cached versions of the functional_coreg table, except 'keep_version' when specified."""
+    cache_folder_path = _get_cache_folder_path(cache_folder_path)
+    if not cache_folder_path.exists():
+        return []
+
+    removed_versions = []
+    for version_folder_path in cache_folder_path.glob("v*"):
+        if not version_folder_path.name[1:].isdigit():
+            continue
+        materialization_version = int(version_folder_path.name[1:])
+        if materialization_version == keep_version:
+            continue
+        shutil.rmtree(version_folder_path, ignore_errors=True)
+        removed_versions.append(materialization_version)
+
+    return removed_versions
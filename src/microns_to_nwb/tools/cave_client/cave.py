@@ -1,8 +1,16 @@
 import os
+from typing import Optional
 
 from caveclient import CAVEclient
 from caveclient.base import AuthException
 
+from .cache import (
+    is_functional_coreg_table_cached,
+    write_functional_coreg_cache,
+    read_functional_coreg_cache,
+    invalidate_functional_coreg_cache,
+)
+
 
 def get_client():
     try:
@@ -24,18 +32,54 @@ def get_client():
     return client
 
 
-def get_functional_coreg_table(scan_key):
-    client = get_client()
+def cache_functional_coreg_table(
+    client=None,
+    cache_folder_path: Optional[str] = None,
+    materialization_version: Optional[int] = None,
+    invalidate_other_versions: bool = False,
+) -> int:
+    """
+    Download the functional_coreg table once for a materialization version of the datastack.
+
+    The 'materialization_version' is by default the current version of the datastack. The other cached versions
+    are only removed with 'invalidate_other_versions', which must not be requested while another conversion may be
+    reading them. The 'client' can be any object exposing 'materialize.version' and 'materialize.query_table'.
+    Returns the materialization version the cache is keyed by.
+    """
+    if materialization_version is None:
+        client = client or get_client()
+        materialization_version = client.materialize.version
+
+    if not is_functional_coreg_table_cached(materialization_version, cache_folder_path=cache_folder_path):
+        client = client or get_client()
+        coreg_table = client.materialize.query_table(
+            table="functional_coreg",
+            split_positions=True,
+            materialization_version=materialization_version,
+        )
+        write_functional_coreg_cache(
+            coreg_table=coreg_table,
+            materialization_version=materialization_version,
+            cache_folder_path=cache_folder_path,
+        )
+    if invalidate_other_versions:
+        invalidate_functional_coreg_cache(cache_folder_path=cache_folder_path, keep_version=materialization_version)
+
+    return materialization_version
 
-    coreg_table = client.materialize.query_table(
-        table="functional_coreg",
-        split_positions=True,
+
+def get_functional_coreg_table(
+    scan_key, materialization_version: Optional[int] = None, client=None, cache_folder_path: Optional[str] = None
+):
+    """The functional_coreg rows of a scan in 'materialization_version' (by default the current version)."""
+    materialization_version = cache_functional_coreg_table(
+        client=client, cache_folder_path=cache_folder_path, materialization_version=materialization_version
     )
-    session = scan_key["session"]
-    scan = scan_key["scan_idx"]
 
-    coreg_table_for_this_scan = coreg_table[
-        (coreg_table["session"] == int(session)) & (coreg_table["scan_idx"] == int(scan))
-    ]
+    coreg_table_for_this_scan = read_functional_coreg_cache(
+        scan_key=scan_key,
+        materialization_version=materialization_version,
+        cache_folder_path=cache_folder_path,
+    )
 
     return coreg_table_for_this_scan
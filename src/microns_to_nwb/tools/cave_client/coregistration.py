@@ -0,0 +1,41 @@
+import numpy as np
+import pandas as pd
+
+POSITION_COLUMNS = dict(
+    pt_supervoxel_id="pt_supervoxel_id",
+    pt_root_id="pt_root_id",
+    pt_x_position="pt_position_x",
+    pt_y_position="pt_position_y",
+    pt_z_position="pt_position_z",
+)
+# The value of the 'pt_*' columns for the units without a match in the coregistration table
+MISSING_COREGISTRATION_VALUE = -1
+
+
+def get_coregistration_columns(functional_coreg_table: pd.DataFrame, unit_ids: np.ndarray) -> dict:
+    """
+    Align the functional coregistration table to the units of a field in a single grouped merge.
+
+    Returns the 'pt_*' columns with one int64 value per unit, taken from the first match of a unit that is matched
+    more than once, and MISSING_COREGISTRATION_VALUE for the units without a match. The ragged 'cave_ids' column is
+    returned as a flat int64 array with its 'cave_ids_index' of end offsets, the units without a match have no entries.
+    """
+    unit_ids = np.asarray(unit_ids)
+    matches = functional_coreg_table[functional_coreg_table["unit_id"].isin(unit_ids)]
+    unit_positions = pd.Index(unit_ids).get_indexer(matches["unit_id"])
+
+    # The first match of each unit provides the structural identifiers and position
+    is_first_match = ~matches["unit_id"].duplicated().to_numpy()
+    columns = dict()
+    for column_name, coreg_column_name in POSITION_COLUMNS.items():
+        column = np.full(len(unit_ids), MISSING_COREGISTRATION_VALUE, dtype=np.int64)
+        column[unit_positions[is_first_match]] = matches[coreg_column_name].to_numpy(dtype=np.int64)[is_first_match]
+        columns[column_name] = column
+
+    # All matches of each unit, grouped in the order of the units
+    order = np.argsort(unit_positions, kind="stable")
+    cave_ids = matches["id"].to_numpy(dtype=np.int64)[order]
+    cave_ids_index = np.cumsum(np.bincount(unit_positions, minlength=len(unit_ids)))
+
+    columns.update(cave_ids=cave_ids, cave_ids_index=cave_ids_index)
+    return columns
@@ -0,0 +1,10 @@
+from .clocks import (
+    CLOCK_ALIGNMENT_MODES,
+    align_clocks,
+    find_earliest_timestamp,
+    describe_regular_rate,
+    get_clock_offset,
+    get_regular_rate,
+    get_timing_kwargs,
+    shift_clock,
+)
@@ -0,0 +1,130 @@
+from typing import Optional, Tuple
+
+import numpy as np
+from pynwb import TimeSeries
+
+from tools.compression import make_data_io
+
+CLOCK_ALIGNMENT_MODES = ("copy", "in_place")
+
+
+def find_earliest_timestamp(behavior_timestamps_arrays):
+    return min(
+        [timestamps[np.isnan(timestamps).argmin()] for timestamps in behavior_timestamps_arrays],
+    )
+
+
+def get_clock_offset(behavior_clocks: list) -> float:
+    """The offset that shifts the earliest behavioral timestamp to zero when it is negative, otherwise zero."""
+    earliest_timestamp_in_behavior = find_earliest_timestamp(behavior_timestamps_arrays=behavior_clocks)
+    return float(-earliest_timestamp_in_behavior) if earliest_timestamp_in_behavior < 0 else 0.0
+
+
+def shift_clock(timestamps: np.ndarray, offset: float, in_place: bool = False) -> np.ndarray:
+    """
+    Shift the timestamps of a clock by 'offset' seconds.
+
+    With 'in_place', the offset is added to the array itself, which is only copied when it is read-only or not of
+    a floating point type (e.g. the blobs that are unpacked from the database buffers).
+    """
+    if not offset:
+        return timestamps
+    timestamps = np.asarray(timestamps)
+    if in_place and timestamps.flags.writeable and timestamps.dtype.kind == "f":
+        timestamps += offset
+        return timestamps
+    return timestamps + offset
+
+
+def align_clocks(clocks: dict, behavior_clock_names: list, mode: str = "copy") -> Tuple[dict, float]:
+    """
+    Shift every clock of a session by the offset that brings its earliest behavioral timestamp to zero.
+
+    The offset is computed once from the clocks named in 'behavior_clock_names' and applied once to each clock,
+    a clock that is a table (e.g. the trial times) has the offset applied to each of its columns. With mode="copy",
+    the clocks are returned as shifted copies, with mode="in_place" the offset is added to the arrays that are
+    passed (see 'shift_clock'). Returns the shifted clocks and the offset.
+    """
+    assert mode in CLOCK_ALIGNMENT_MODES, f"The clock alignment mode must be one of {CLOCK_ALIGNMENT_MODES}!"
+    offset = get_clock_offset(behavior_clocks=[clocks[clock_name] for clock_name in behavior_clock_names])
+    in_place = mode == "in_place"
+
+    aligned_clocks = dict()
+    for clock_name, clock in clocks.items():
+        if isinstance(clock, dict):
+            aligned_clocks[clock_name] = {
+                column_name: shift_clock(timestamps=column, offset=offset, in_place=in_place)
+                for column_name, column in clock.items()
+            }
+        else:
+            aligned_clocks[clock_name] = shift_clock(timestamps=clock, offset=offset, in_place=in_place)
+    return aligned_clocks, offset
+
+
+def get_regular_rate(timestamps: np.ndarray, jitter_tolerance: float) -> Optional[dict]:
+    """
+    The 'starting_time' and 'rate' of the regular series that fits the timestamps of a clock, when they deviate from
+    it by at most 'jitter_tolerance' of its sampling interval, along with that 'max_deviation' in seconds.
+
+    The regular series is the least-squares line through the timestamps, there is none for fewer than two or for
+    missing (NaN) timestamps.
+    """
+    timestamps = np.asarray(timestamps, dtype=float)
+    if len(timestamps) < 2 or not np.all(np.isfinite(timestamps)):
+        return None
+    sample_indices = np.arange(len(timestamps))
+    sampling_interval, starting_time = np.polyfit(sample_indices, timestamps, deg=1)
+    if sampling_interval <= 0:
+        return None
+    max_deviation = float(np.max(np.abs(timestamps - (starting_time + sampling_interval * sample_indices))))
+    if max_deviation > jitter_tolerance * sampling_interval:
+        return None
+    return dict(starting_time=float(starting_time), rate=float(1 / sampling_interval), max_deviation=max_deviation)
+
+
+def get_timing_kwargs(
+    timestamps: np.ndarray,
+    description: str,
+    compression_options: Optional[dict] = None,
+    jitter_tolerance: Optional[float] = None,
+    timestamps_series: Optional[TimeSeries] = None,
+) -> dict:
+    """
+    The 'description' and either the 'starting_time' and 'rate' or the 'timestamps' of a series on a clock.
+
+    'timestamps_series' is a series of the same clock that is already added, the series has its starting time and
+    rate when it has them, or links to its timestamps when they are equal to 'timestamps'. Otherwise, when
+    'jitter_tolerance' is specified and the timestamps are regular (see 'get_regular_rate'), the series has the
+    starting time and rate of the regular series, and their maximum deviation is added to its description.
+    Otherwise the timestamps are stored (see tools.compression.make_data_io).
+    """
+    if timestamps_series is not None and timestamps_series.rate is not None:
+        return dict(
+            description=_add_sentence(
+                description, f"The timestamps are the starting time and rate of '{timestamps_series.name}'."
+            ),
+            starting_time=timestamps_series.starting_time,
+            rate=timestamps_series.rate,
+        )
+    if timestamps_series is not None and np.array_equal(timestamps_series.timestamps[:], timestamps):
+        return dict(description=description, timestamps=timestamps_series)
+
+    regular_rate = get_regular_rate(timestamps, jitter_tolerance) if jitter_tolerance is not None else None
+    if regular_rate is not None:
+        return dict(
+            description=_add_sentence(description, describe_regular_rate(max_deviation=regular_rate["max_deviation"])),
+            starting_time=regular_rate["starting_time"],
+            rate=regular_rate["rate"],
+        )
+    return dict(description=description, timestamps=make_data_io(timestamps, "timestamps", compression_options))
+
+
+def describe_regular_rate(max_deviation: float) -> str:
+    return (
+        "The timestamps are stored as the starting time and rate of a regular series, "
+        f"from which the recorded timestamps deviate by at most {max_deviation:.3g} seconds."
+    )
+
+
+def _add_sentence(description: str, sentence: str) -> str:
+    return f"{description.rstrip('. ')}. {sentence}"
@@ -0,0 +1,8 @@
+from .compression import (
+    DATASET_CLASSES,
+    get_compression_kwargs,
+    make_data_io,
+    register_plugin_filters,
+    to_h5_data_io,
+    to_zarr_data_io,
+)
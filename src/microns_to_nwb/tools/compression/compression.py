@@ -0,0 +1,154 @@
+from typing import Optional
+
+import numpy as np
+from hdmf.backends.hdf5 import H5DataIO
+
+# The classes of datasets that can be compressed with different codecs
+DATASET_CLASSES = ("TwoPhotonSeries", "RoiResponseSeries", "image_masks", "timestamps", "behavior", "stimulus")
+
+# The codecs that are available as HDF5 filter plugins through 'hdf5plugin'
+_PLUGIN_CODECS = ("zstd", "lz4", "blosc-lz4", "blosc-zstd")
+
+
+def register_plugin_filters() -> bool:
+    """Register the HDF5 filters of 'hdf5plugin' to read plugin-compressed datasets, return whether it is installed."""
+    try:
+        import hdf5plugin  # noqa: F401 (importing it registers the filters with HDF5)
+    except ImportError:
+        return False
+    return True
+
+
+def _get_plugin_filter(codec: str, level: Optional[int] = None, shuffle: bool = False):
+    try:
+        import hdf5plugin
+    except ImportError:
+        raise ImportError(
+            f"The '{codec}' codec requires the 'hdf5plugin' package, install it with 'pip install hdf5plugin'."
+        )
+
+    if codec == "zstd":
+        return hdf5plugin.Zstd(clevel=level or 3)
+    if codec == "lz4":
+        return hdf5plugin.LZ4()
+
+    # Blosc applies the byte shuffle internally
+    cname = codec.split("-")[1]
+    return hdf5plugin.Blosc(
+        cname=cname,
+        clevel=level or 5,
+        shuffle=hdf5plugin.Blosc.SHUFFLE if shuffle else hdf5plugin.Blosc.NOSHUFFLE,
+    )
+
+
+def get_compression_kwargs(dataset_class: str, compression_options: Optional[dict] = None) -> dict:
+    """
+    Return the h5py compression arguments for a class of datasets.
+
+    'compression_options' maps the dataset classes to a dict with the 'codec' ('gzip', 'lzf', 'zstd', 'lz4',
+    'blosc-lz4', 'blosc-zstd' or None for no compression) and optionally its 'level' and whether to 'shuffle'
+    the bytes before compression, e.g. dict(TwoPhotonSeries=dict(codec="blosc-zstd", level=5, shuffle=True)).
+    The dataset classes that are not specified are compressed with gzip at its default level.
+    """
+    if dataset_class not in DATASET_CLASSES:
+        raise ValueError(f"The dataset class must be one of {DATASET_CLASSES}, not '{dataset_class}'.")
+    unknown_dataset_classes = set(compression_options or dict()) - set(DATASET_CLASSES)
+    if unknown_dataset_classes:
+        raise ValueError(f"The dataset classes {sorted(unknown_dataset_classes)} are not one of {DATASET_CLASSES}.")
+
+    codec_options = (compression_options or dict()).get(dataset_class, dict(codec="gzip"))
+    return _get_codec_kwargs(
+        codec=codec_options.get("codec"),
+        level=codec_options.get("level"),
+        shuffle=codec_options.get("shuffle", False),
+    )
+
+
+def _get_codec_kwargs(codec: Optional[str], level: Optional[int] = None, shuffle: bool = False) -> dict:
+    if codec is None:
+        return dict(compression=None)
+    if codec in ("gzip", "lzf"):
+        return dict(compression=codec, compression_opts=level, shuffle=shuffle)
+    if codec in _PLUGIN_CODECS:
+        plugin_filter = _get_plugin_filter(codec=codec, level=level, shuffle=shuffle)
+        return dict(
+            compression=plugin_filter.filter_id,
+            compression_opts=plugin_filter.filter_options,
+            shuffle=shuffle and not codec.startswith("blosc"),
+        )
+
+    raise ValueError(f"The codec must be one of {('gzip', 'lzf') + _PLUGIN_CODECS} or None, not '{codec}'.")
+
+
+def make_data_io(data, dataset_class: str, compression_options: Optional[dict] = None) -> H5DataIO:
+    """Wrap the data of a dataset class with the codec that is selected for it in 'compression_options'."""
+    compression_kwargs = get_compression_kwargs(dataset_class=dataset_class, compression_options=compression_options)
+    return H5DataIO(data, allow_plugin_filters=True, **compression_kwargs)
+
+
+# The registered HDF5 filter ids of the plugin codecs
+_BLOSC_FILTER_ID, _LZ4_FILTER_ID, _ZSTD_FILTER_ID = 32001, 32004, 32015
+
+# The numcodecs names of the compressors inside Blosc, in the order of their hdf5plugin filter codes
+_BLOSC_COMPRESSOR_NAMES = ("blosclz", "lz4", "lz4hc", "snappy", "zlib", "zstd")
+
+
+def to_zarr_data_io(data_io: H5DataIO):
+    """Return a ZarrDataIO with the chunks and the equivalent numcodecs codec of an H5DataIO."""
+    import numcodecs
+    from hdmf_zarr import ZarrDataIO
+
+    io_settings = data_io.io_settings
+    compression = io_settings.get("compression")
+    compression_opts = io_settings.get("compression_opts")
+
+    if compression is None:
+        compressor = False
+    elif compression == "gzip":
+        compressor = numcodecs.GZip(level=4 if compression_opts is None else compression_opts)
+    elif compression == _ZSTD_FILTER_ID:
+        compressor = numcodecs.Zstd(level=compression_opts[0])
+    elif compression == _LZ4_FILTER_ID:
+        compressor = numcodecs.LZ4()
+    elif compression == _BLOSC_FILTER_ID:
+        compressor = numcodecs.Blosc(
+            cname=_BLOSC_COMPRESSOR_NAMES[compression_opts[6]], clevel=compression_opts[4], shuffle=compression_opts[5]
+        )
+    else:
+        raise ValueError(f"The '{compression}' compression has no equivalent codec in Zarr.")
+
+    filters = None
+    if io_settings.get("shuffle"):
+        dtype = data_io.data.dtype if hasattr(data_io.data, "dtype") else np.asarray(data_io.data).dtype
+        filters = [numcodecs.Shuffle(elementsize=dtype.itemsize)]
+
+    # Zarr picks the chunks itself unless they are given explicitly
+    chunks = io_settings.get("chunks")
+    return ZarrDataIO(
+        data=data_io.data,
+        chunks=chunks if isinstance(chunks, (list, tuple)) else None,
+        fillvalue=io_settings.get("fillvalue"),
+        compressor=compressor,
+        filters=filters,
+    )
+
+
+def to_h5_data_io(data, compressor=None, filters=None, chunks: Optional[tuple] = None) -> H5DataIO:
+    """Wrap the data with the chunks and the HDF5 filter that are equivalent to a numcodecs compressor."""
+    shuffle = any(codec.codec_id == "shuffle" for codec in filters or [])
+    if compressor is None:
+        codec_kwargs = _get_codec_kwargs(codec=None)
+    elif compressor.codec_id in ("gzip", "zlib"):
+        codec_kwargs = _get_codec_kwargs(codec="gzip", level=compressor.level, shuffle=shuffle)
+    elif compressor.codec_id == "zstd":
+        codec_kwargs = _get_codec_kwargs(codec="zstd", level=compressor.level, shuffle=shuffle)
+    elif compressor.codec_id == "lz4":
+        codec_kwargs = _get_codec_kwargs(codec="lz4", shuffle=shuffle)
+    elif compressor.codec_id == "blosc" and compressor.cname in ("lz4", "zstd"):
+        codec_kwargs = _get_codec_kwargs(
+            codec=f"blosc-{compressor.cname}", level=compressor.clevel, shuffle=bool(compressor.shuffle)
+        )
+    else:
+        raise ValueError(f"The '{compressor.codec_id}' codec has no equivalent HDF5 filter.")
+
+    return H5DataIO(data, chunks=chunks, allow_plugin_filters=True, **codec_kwargs)
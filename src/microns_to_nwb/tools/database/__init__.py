@@ -0,0 +1,3 @@
+from .cache import get_cache_mode, set_cache_mode
+from .database import close_connection, close_thread_connections, fetch, fetch1, get_num_round_trips
+from .session import SessionData, clear_session_data, get_scans, get_session_data
@@ -0,0 +1,101 @@
+import gzip
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+from pathlib import Path
+from typing import Callable, Optional
+
+from datajoint import AndList
+
+DEFAULT_CACHE_FOLDER_PATH = Path.home() / ".cache" / "microns_to_nwb" / "nda"
+CACHE_MODES = ("live", "record", "replay", "prefer-cache")
+
+_cache_mode = os.environ.get("MICRONS_NDA_CACHE_MODE", "live")
+_cache_folder_path = None
+
+
+def set_cache_mode(mode: str, cache_folder_path: Optional[str] = None):
+    """
+    Select how the phase3.nda fetches use the local cache of their results.
+
+    With 'live', every fetch queries the database. With 'record', every fetch queries the database and stores its
+    result. With 'replay', every fetch is read from the cache, without connecting to the database, and fails when
+    it was not recorded. With 'prefer-cache', the recorded fetches are read from the cache and the others are
+    queried and stored. The cache is in 'cache_folder_path', by default in the 'MICRONS_NDA_CACHE' environment
+    variable or in '~/.cache/microns_to_nwb/nda'.
+    """
+    global _cache_mode, _cache_folder_path
+    if mode not in CACHE_MODES:
+        raise ValueError(f"The cache mode must be one of {', '.join(CACHE_MODES)}, not '{mode}'.")
+    _cache_mode = mode
+    _cache_folder_path = cache_folder_path
+
+
+def get_cache_mode() -> str:
+    return _cache_mode
+
+
+def _get_cache_folder_path() -> Path:
+    cache_folder_path = _cache_folder_path
+    if cache_folder_path is None:
+        cache_folder_path = os.environ.get("MICRONS_NDA_CACHE", DEFAULT_CACHE_FOLDER_PATH)
+    return Path(cache_folder_path)
+
+
+def _normalize(value):
+    """The JSON-compatible form of a restriction or of the fetch arguments, where "4" and 4 are the same key."""
+    if isinstance(value, dict):
+        return {str(name): _normalize(value[name]) for name in sorted(value)}
+    # Any of the conditions of a list must hold, while all of those of an AndList must hold
+    if isinstance(value, AndList):
+        return dict(AndList=[_normalize(item) for item in value])
+    if isinstance(value, (list, tuple)):
+        return [_normalize(item) for item in value]
+    if value is None or isinstance(value, bool):
+        return value
+    return str(value)
+
+
+def _get_entry_path(key: dict) -> Path:
+    table_names = key["table_names"]
+    table_names = [table_names] if isinstance(table_names, str) else table_names
+    key_hash = hashlib.sha1(json.dumps(_normalize(key), sort_keys=True).encode()).hexdigest()
+    return _get_cache_folder_path() / "_".join(table_names) / f"{key_hash}.pkl.gz"
+
+
+def _read_entry(entry_path: Path, key: dict):
+    with gzip.open(entry_path, "rb") as f:
+        entry = pickle.load(f)
+    if entry["key"] != _normalize(key):
+        raise KeyError(f"The cached entry '{entry_path}' does not match the fetch {key}.")
+    return entry["result"]
+
+
+def _write_entry(entry_path: Path, key: dict, result):
+    entry_path.parent.mkdir(parents=True, exist_ok=True)
+    file_descriptor, temporary_path = tempfile.mkstemp(prefix=f".{entry_path.name}_", dir=entry_path.parent)
+    os.close(file_descriptor)
+    with gzip.open(temporary_path, "wb", compresslevel=4) as f:
+        pickle.dump(dict(key=_normalize(key), result=result), f, protocol=pickle.HIGHEST_PROTOCOL)
+    # Concurrent workers recording the same fetch replace the entry with identical content
+    os.replace(temporary_path, entry_path)
+
+
+def cached_query(key: dict, query: Callable):
+    """Return the result of 'query', the fetch described by 'key', from the cache or the database per the mode."""
+    if _cache_mode == "live":
+        return query()
+
+    entry_path = _get_entry_path(key)
+    if _cache_mode in ("replay", "prefer-cache") and entry_path.is_file():
+        return _read_entry(entry_path, key)
+    if _cache_mode == "replay":
+        raise FileNotFoundError(
+            f"The fetch {key} is not recorded in '{_get_cache_folder_path()}', run it in the 'record' mode first."
+        )
+
+    result = query()
+    _write_entry(entry_path, key, result)
+    return result
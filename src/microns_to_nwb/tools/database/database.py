@@ -0,0 +1,114 @@
+import sys
+from functools import reduce
+from operator import mul
+from threading import Lock, current_thread, local, main_thread
+
+from .cache import cached_query
+
+# DataJoint shares a single connection between the threads of a process, which cannot run queries concurrently,
+# so the other threads than the main one query the phase3.nda schema on a connection of their own
+_thread_schemas = local()
+# The connections of the other threads, which 'close_connection' and 'close_thread_connections' close
+_thread_connections = []
+_thread_connections_lock = Lock()
+# Increased when the connections of the threads are closed, so that the threads that are still alive reconnect
+_connection_generation = 0
+_num_round_trips = 0
+_num_round_trips_lock = Lock()
+
+
+def _get_nda():
+    """The phase3.nda module in the main thread, otherwise a virtual module of its schema on a connection per thread."""
+    from phase3 import nda
+
+    if current_thread() is main_thread():
+        return nda
+    if getattr(_thread_schemas, "generation", None) != _connection_generation:
+        import datajoint as dj
+
+        connection = dj.Connection(
+            host=dj.config["database.host"], user=dj.config["database.user"], password=dj.config["database.password"]
+        )
+        with _thread_connections_lock:
+            _thread_connections.append((current_thread(), connection))
+        _thread_schemas.nda = dj.create_virtual_module("nda", nda.schema.database, connection=connection)
+        _thread_schemas.generation = _connection_generation
+    return _thread_schemas.nda
+
+
+def _get_query(table_names, restriction):
+    nda = _get_nda()
+    if isinstance(table_names, str):
+        table_names = [table_names]
+    tables = [getattr(nda, table_name)() for table_name in table_names]
+    return reduce(mul, tables) & restriction
+
+
+def get_num_round_trips() -> int:
+    """The number of queries sent to the database by this process."""
+    return _num_round_trips
+
+
+def _count_round_trip():
+    global _num_round_trips
+    with _num_round_trips_lock:
+        _num_round_trips += 1
+
+
+def _query(method_name, table_names, restriction, *attributes, **kwargs):
+    _count_round_trip()
+    return getattr(_get_query(table_names, restriction), method_name)(*attributes, **kwargs)
+
+
+def fetch(table_names, restriction, *attributes, order_by=None, as_dict=False):
+    """
+    Fetch from the join of the phase3.nda tables named in 'table_names' restricted by 'restriction'.
+
+    The restriction is any DataJoint restriction, e.g. a key, a condition string, a list of them of which any must hold
+    or a dj.AndList of them that must all hold.
+    The result is read from or stored in the local cache per the cache mode (see 'set_cache_mode').
+    """
+    key = dict(
+        method="fetch",
+        table_names=table_names,
+        restriction=restriction,
+        attributes=attributes,
+        order_by=order_by,
+        as_dict=as_dict,
+    )
+    return cached_query(
+        key, lambda: _query("fetch", table_names, restriction, *attributes, order_by=order_by, as_dict=as_dict)
+    )
+
+
+def fetch1(table_names, restriction, *attributes):
+    """Fetch the single entry of the join of the phase3.nda tables named in 'table_names'."""
+    key = dict(method="fetch1", table_names=table_names, restriction=restriction, attributes=attributes)
+    return cached_query(key, lambda: _query("fetch1", table_names, restriction, *attributes))
+
+
+def close_thread_connections(include_alive: bool = False):
+    """Close the connections of the threads that have ended (e.g. the workers of a thread pool that is shut down)."""
+    global _connection_generation
+    with _thread_connections_lock:
+        open_connections = []
+        for thread, connection in _thread_connections:
+            if include_alive or not thread.is_alive():
+                connection.close()
+            else:
+                open_connections.append((thread, connection))
+        _thread_connections[:] = open_connections
+        if include_alive:
+            _connection_generation += 1
+
+
+def close_connection():
+    """
+    Close the connections of this process to the phase3.nda schema, which its next queries open again.
+
+    The worker processes that are forked while they are open would otherwise share their sockets with this process.
+    """
+    close_thread_connections(include_alive=True)
+    phase3 = sys.modules.get("phase3")
+    if phase3 is not None:
+        phase3.nda.schema.connection.close()
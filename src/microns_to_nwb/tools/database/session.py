@@ -0,0 +1,143 @@
+from threading import Lock, RLock
+
+import numpy as np
+
+from .cache import get_cache_mode
+from .database import fetch, fetch1
+
+_session_data = dict()
+_session_data_lock = Lock()
+
+
+def _get_session_id(scan_key: dict) -> tuple:
+    return int(scan_key["session"]), int(scan_key["scan_idx"])
+
+
+def _partition_by_field(fields: np.ndarray, *values: np.ndarray) -> dict:
+    """Split the columns of a query over all the fields of a scan into the rows of each field, keeping their order."""
+    fields = np.asarray(fields)
+    return {int(field): tuple(value[fields == field] for value in values) for field in np.unique(fields)}
+
+
+def _get_field_rows(rows_by_field: dict, field: int, *dtypes) -> tuple:
+    """The columns of the rows of a field, which are empty columns of 'dtypes' for a field without rows."""
+    return rows_by_field.get(field, tuple(np.empty(0, dtype=dtype) for dtype in dtypes))
+
+
+class SessionData:
+    """
+    The phase3.nda data of a scan, fetched with one query per table for all of its fields.
+
+    Each table is fetched the first time it is used and partitioned by field in memory.
+    """
+
+    def __init__(self, scan_key: dict):
+        session, scan_idx = _get_session_id(scan_key)
+        self.scan_key = dict(session=session, scan_idx=scan_idx)
+        self._tables = dict()
+        self._table_locks = dict()
+        self._lock = Lock()
+
+    def _get_table(self, table_name: str, fetch_table):
+        # Each table is fetched once, while the other tables can be fetched concurrently by other threads
+        with self._lock:
+            table_lock = self._table_locks.setdefault(table_name, RLock())
+        with table_lock:
+            if table_name not in self._tables:
+                self._tables[table_name] = fetch_table()
+            return self._tables[table_name]
+
+    def get_scan(self) -> dict:
+        """The number of frames per field, the number of fields and the frame rate of the scan."""
+
+        def fetch_scan():
+            attributes = ("nframes", "nfields", "fps")
+            return dict(zip(attributes, fetch1("Scan", self.scan_key, *attributes)))
+
+        return self._get_table("Scan", fetch_scan)
+
+    def get_fields(self) -> list:
+        """The entries of 'nda.Field' for each field of the scan."""
+        return self._get_table("Field", lambda: fetch("Field", self.scan_key, as_dict=True, order_by="field"))
+
+    def _get_segmentation(self) -> dict:
+        def fetch_segmentation():
+            attributes = ("pixels", "weights", "mask_id", "mask_type")
+            values = fetch(
+                ("Segmentation", "MaskClassification"), self.scan_key, "field", *attributes, order_by="field, mask_id"
+            )
+            return _partition_by_field(*values)
+
+        return self._get_table("Segmentation", fetch_segmentation)
+
+    def _get_units(self) -> dict:
+        return self._get_table(
+            "ScanUnit", lambda: _partition_by_field(*fetch("ScanUnit", self.scan_key, "field", "unit_id"))
+        )
+
+    def _get_traces(self) -> dict:
+        def fetch_fluorescence():
+            return _partition_by_field(
+                *fetch("Fluorescence", self.scan_key, "field", "trace", order_by="field, mask_id")
+            )
+
+        return self._get_table("Fluorescence", fetch_fluorescence)
+
+    def _get_summary_images(self) -> dict:
+        def fetch_summary_images():
+            return _partition_by_field(*fetch("SummaryImages", self.scan_key, "field", "correlation", "average"))
+
+        return self._get_table("SummaryImages", fetch_summary_images)
+
+    def get_field_data(self, field: int, fetch_traces: bool = True) -> dict:
+        """The segmentation, units, traces and summary images of a single field, which are empty when it has none."""
+        field_data = dict()
+        (
+            field_data["mask_pixels"],
+            field_data["mask_weights"],
+            field_data["mask_ids"],
+            field_data["mask_types"],
+        ) = _get_field_rows(self._get_segmentation(), field, object, object, np.int64, object)
+        (field_data["unit_ids"],) = _get_field_rows(self._get_units(), field, np.int64)
+        if fetch_traces:
+            (field_data["traces"],) = _get_field_rows(self._get_traces(), field, object)
+        # A field without summary images has None for each of them
+        correlation_images, average_images = _get_field_rows(self._get_summary_images(), field, object, object)
+        field_data["correlation_image"] = correlation_images[0] if len(correlation_images) else None
+        field_data["average_image"] = average_images[0] if len(average_images) else None
+
+        return field_data
+
+
+def get_scans(scan_keys: list) -> list:
+    """The number of frames per field, the number of fields and the frame rate of each scan, fetched in one query."""
+    # The recordings of single sessions hold the entry of each scan instead, which are replayed without the database
+    if get_cache_mode() == "replay":
+        return [SessionData(scan_key).get_scan() for scan_key in scan_keys]
+    session_ids = [_get_session_id(scan_key) for scan_key in scan_keys]
+    attributes = ("nframes", "nfields", "fps")
+    rows = fetch(
+        "Scan",
+        [dict(session=session, scan_idx=scan_idx) for session, scan_idx in session_ids],
+        "session",
+        "scan_idx",
+        *attributes,
+        as_dict=True,
+    )
+    scans = {(int(row["session"]), int(row["scan_idx"])): {name: row[name] for name in attributes} for row in rows}
+    return [scans[session_id] for session_id in session_ids]
+
+
+def get_session_data(scan_key: dict) -> SessionData:
+    """The SessionData of a scan, shared by everything that is converted from it in this process."""
+    session_id = _get_session_id(scan_key)
+    with _session_data_lock:
+        if session_id not in _session_data:
+            _session_data[session_id] = SessionData(scan_key)
+        return _session_data[session_id]
+
+
+def clear_session_data(scan_key: dict):
+    """Release the data fetched for a scan once it is converted."""
+    with _session_data_lock:
+        _session_data.pop(_get_session_id(scan_key), None)
@@ -0,0 +1,10 @@
+from .inspection import (
+    INSPECTION_MODES,
+    WRITTEN_DATA_CHECKS,
+    inspect_folder,
+    inspect_nwbfile_object,
+    inspect_written_nwbfile,
+    get_report_path,
+    raise_for_critical_messages,
+    save_inspection_report,
+)
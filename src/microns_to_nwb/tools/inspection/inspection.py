@@ -0,0 +1,161 @@
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import List, Optional
+
+import h5py
+import numpy as np
+from neuroconv.utils import FilePathType, FolderPathType
+from nwbinspector import Importance, InspectorMessage, inspect_nwb, run_checks
+from nwbinspector.inspector_tools import format_messages, save_report
+from nwbinspector.nwbinspector import configure_checks
+from pynwb import NWBFile
+
+from tools.compression import register_plugin_filters
+
+# 'pre_write' checks the in-memory NWBFile before it is written, 'sampled' also validates the written file against
+# the schema and reads a sample of the chunks of its datasets, and 'full' inspects the whole written file
+INSPECTION_MODES = ("pre_write", "sampled", "full")
+# The checks of the shapes of the datasets, which are run on the written file since the streamed data (e.g. the
+# imaging planes and the stimulus movie) has no shape in memory
+WRITTEN_DATA_CHECKS = [
+    "check_image_series_data_size",
+    "check_data_orientation",
+    "check_timestamps_match_first_dimension",
+]
+
+
+def get_report_path(nwbfile_path: FilePathType, suffix: str = "report") -> Path:
+    nwbfile_path = Path(nwbfile_path)
+    return nwbfile_path.parent / f"{nwbfile_path.stem}_{suffix}.txt"
+
+
+def inspect_nwbfile_object(
+    nwbfile: NWBFile, importance_threshold: Importance = Importance.BEST_PRACTICE_SUGGESTION
+) -> List[InspectorMessage]:
+    """Run the nwbinspector checks on an in-memory NWBFile before it is written, except the WRITTEN_DATA_CHECKS."""
+    checks = configure_checks(ignore=WRITTEN_DATA_CHECKS, importance_threshold=importance_threshold)
+    return list(run_checks(nwbfile=nwbfile, checks=checks))
+
+
+def raise_for_critical_messages(messages: List[InspectorMessage]):
+    critical_messages = [message for message in messages if message.importance == Importance.CRITICAL]
+    if critical_messages:
+        raise ValueError(
+            f"The inspection found {len(critical_messages)} critical issue(s): "
+            + "; ".join(f"{message.location}: {message.message}" for message in critical_messages)
+        )
+
+
+def _sample_chunks(dataset: h5py.Dataset, num_sampled_chunks: int) -> Optional[str]:
+    """Check that the chunks of a dataset are all written, and read a sample of them. Returns the issue, if any."""
+    num_chunks_per_dimension = [
+        int(np.ceil(length / chunk_length)) for length, chunk_length in zip(dataset.shape, dataset.chunks)
+    ]
+    num_chunks = int(np.prod(num_chunks_per_dimension))
+    num_written_chunks = dataset.id.get_num_chunks()
+    if num_written_chunks < num_chunks:
+        return f"only {num_written_chunks} of the {num_chunks} chunks are written."
+
+    for chunk_index in np.unique(np.linspace(0, num_chunks - 1, num=min(num_sampled_chunks, num_chunks), dtype=int)):
+        chunk_position = np.unravel_index(chunk_index, num_chunks_per_dimension)
+        selection = tuple(
+            slice(position * chunk_length, (position + 1) * chunk_length)
+            for position, chunk_length in zip(chunk_position, dataset.chunks)
+        )
+        try:
+            dataset[selection]
+        except (OSError, ValueError) as e:
+            return f"the chunk at {selection} can not be read ({e})."
+    return None
+
+
+def inspect_written_nwbfile(
+    nwbfile_path: FilePathType, mode: str = "sampled", num_sampled_chunks: int = 8
+) -> List[InspectorMessage]:
+    """
+    Inspect a written NWB file.
+
+    The 'full' mode runs all the nwbinspector checks on the file, which reads the datasets that the checks use.
+    The 'sampled' mode validates the file against the schema and runs the WRITTEN_DATA_CHECKS, which only read
+    its metadata, then checks that the chunked datasets are completely written and reads 'num_sampled_chunks'
+    chunks of each of them, spread over the dataset (the checks of the values are run by 'inspect_nwbfile_object'
+    on the in-memory NWBFile before it is written).
+    """
+    assert mode in ("sampled", "full"), "The mode of the inspection of a written file is either 'sampled' or 'full'!"
+    nwbfile_path = str(nwbfile_path)
+    # The datasets compressed with the plugin codecs are only readable once the filters are registered, which has to
+    # happen in each process (e.g. the workers of 'inspect_folder')
+    register_plugin_filters()
+    if mode == "full":
+        return list(inspect_nwb(nwbfile_path=nwbfile_path))
+
+    messages = list(inspect_nwb(nwbfile_path=nwbfile_path, select=WRITTEN_DATA_CHECKS))
+
+    chunked_datasets = []
+
+    def collect_chunked_dataset(name: str, item):
+        if isinstance(item, h5py.Dataset) and item.chunks is not None and item.size:
+            chunked_datasets.append(item)
+
+    with h5py.File(nwbfile_path, "r") as file:
+        file.visititems(collect_chunked_dataset)
+        for dataset in chunked_datasets:
+            issue = _sample_chunks(dataset=dataset, num_sampled_chunks=num_sampled_chunks)
+            if issue is not None:
+                messages.append(
+                    InspectorMessage(
+                        message=f"The dataset '{dataset.name}' is not completely readable: {issue}",
+                        importance=Importance.CRITICAL,
+                        check_function_name="check_sampled_chunks",
+                        location=dataset.name,
+                        file_path=nwbfile_path,
+                    )
+                )
+    return messages
+
+
+def save_inspection_report(report_file_path: FilePathType, messages: List[InspectorMessage]):
+    save_report(
+        report_file_path=report_file_path,
+        formatted_messages=format_messages(messages, levels=["importance", "file_path"]),
+        overwrite=True,
+    )
+
+
+def _inspect_and_save_report(nwbfile_path: str, mode: str, num_sampled_chunks: int) -> List[InspectorMessage]:
+    messages = inspect_written_nwbfile(nwbfile_path=nwbfile_path, mode=mode, num_sampled_chunks=num_sampled_chunks)
+    save_inspection_report(report_file_path=get_report_path(nwbfile_path), messages=messages)
+    return messages
+
+
+def inspect_folder(
+    folder_path: FolderPathType, mode: str = "sampled", max_workers: Optional[int] = None, num_sampled_chunks: int = 8
+) -> dict:
+    """
+    Inspect the NWB files in a folder (and its subfolders) in 'max_workers' processes.
+
+    The report of each file is saved next to it. Returns the messages of each file by file path, with an error
+    message for the files that could not be inspected.
+    """
+    nwbfile_paths = sorted(str(nwbfile_path) for nwbfile_path in Path(folder_path).rglob("*.nwb"))
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            nwbfile_path: executor.submit(
+                _inspect_and_save_report, nwbfile_path=nwbfile_path, mode=mode, num_sampled_chunks=num_sampled_chunks
+            )
+            for nwbfile_path in nwbfile_paths
+        }
+        messages = dict()
+        for nwbfile_path, future in futures.items():
+            try:
+                messages[nwbfile_path] = future.result()
+            except Exception as e:
+                messages[nwbfile_path] = [
+                    InspectorMessage(
+                        message=f"The file could not be inspected: {e}",
+                        importance=Importance.ERROR,
+                        check_function_name="inspect_written_nwbfile",
+                        file_path=nwbfile_path,
+                    )
+                ]
+        return messages
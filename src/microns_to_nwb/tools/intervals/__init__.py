@@ -1 +1 @@
-from .intervals import add_trials
+from .intervals import add_trials, fetch_trials_data
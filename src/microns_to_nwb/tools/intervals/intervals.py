@@ -1,25 +1,111 @@
-from phase3 import nda
+import numpy as np
+import pandas as pd
+from hdmf.common import VectorData
 from pynwb.epoch import TimeIntervals
 
+from tools.database import fetch
 
-def add_trials(scan_key, nwb, trial_times):
+# The attributes fetched from the join of nda.Trial with each stimulus table
+_STIMULUS_ATTRIBUTES = dict(
+    Trippy=(
+        "trial_idx",
+        "condition_hash",
+        "type",
+        "rng_seed",
+        "tex_ydim",
+        "tex_xdim",
+        "duration",
+        "xnodes",
+        "ynodes",
+        "up_factor",
+        "temp_freq",
+        "temp_kernel_length",
+        "spatial_freq",
+    ),
+    Clip=(
+        "trial_idx",
+        "condition_hash",
+        "type",
+        "movie_name",
+        "short_movie_name",
+        "duration",
+    ),
+    Monet2=(
+        "trial_idx",
+        "condition_hash",
+        "type",
+        "rng_seed",
+        "duration",
+        "blue_green_saturation",
+        "pattern_width",
+        "pattern_aspect",
+        "temp_kernel",
+        "temp_bandwidth",
+        "ori_coherence",
+        "ori_fraction",
+        "ori_mix",
+        "n_dirs",
+    ),
+)
+
+
+def add_trials(scan_key, nwb, trial_times, trials_data=None):
+    """Add a table of the trials of each stimulus type, the types without any trials (e.g. in a stub) are skipped."""
+    trials_data = trials_data or dict()
     # Add trials from "Trippy" stimulus type
     trippy_times = trial_times[trial_times["type"] == "stimulus.Trippy"]
-    add_trials_from_trippy(nwb, scan_key=scan_key, trial_times=trippy_times)
+    if not trippy_times.empty:
+        add_trials_from_trippy(nwb, scan_key=scan_key, trial_times=trippy_times, trial_data=trials_data.get("Trippy"))
     # Add trials from "Clip" stimulus type
     clip_times = trial_times[trial_times["type"] == "stimulus.Clip"]
-    add_trials_from_clip(nwb, scan_key=scan_key, trial_times=clip_times)
+    if not clip_times.empty:
+        add_trials_from_clip(nwb, scan_key=scan_key, trial_times=clip_times, trial_data=trials_data.get("Clip"))
     # Add trials from "Monet2" stimulus type
     monet2_times = trial_times[trial_times["type"] == "stimulus.Monet2"]
-    add_trials_from_monet2(nwb, scan_key=scan_key, trial_times=monet2_times)
+    if not monet2_times.empty:
+        add_trials_from_monet2(nwb, scan_key=scan_key, trial_times=monet2_times, trial_data=trials_data.get("Monet2"))
 
 
-def add_trials_from_trippy(nwb, scan_key, trial_times):
-    trippy_table = TimeIntervals(
-        name="Trippy",
-        description="The stimulus table for the cosine of a smoothened noise phase movie.",
-    )
+def fetch_trials_data(scan_key):
+    return {
+        stimulus_table_name: _fetch_trial_data(scan_key, stimulus_table_name=stimulus_table_name)
+        for stimulus_table_name in _STIMULUS_ATTRIBUTES
+    }
 
+
+def _fetch_trial_data(scan_key, stimulus_table_name):
+    attributes = _STIMULUS_ATTRIBUTES[stimulus_table_name]
+    values = fetch(("Trial", stimulus_table_name), scan_key, *attributes, order_by="trial_idx")
+    return dict(zip(attributes, values))
+
+
+def _get_trial_start_and_stop_times(trial_times, trial_indices):
+    trial_times_by_index = trial_times.drop_duplicates(subset="trial_idx").set_index("trial_idx")
+    missing_trial_indices = pd.Index(trial_indices).difference(trial_times_by_index.index)
+    assert missing_trial_indices.empty, f"The times of trials {missing_trial_indices.tolist()} are missing!"
+    trial_times_by_index = trial_times_by_index.reindex(pd.Index(trial_indices, name="trial_idx"))
+    return trial_times_by_index["start_frame_time"].to_numpy(), trial_times_by_index["end_frame_time"].to_numpy()
+
+
+def _make_time_intervals(name, description, trial_times, trial_indices, columns, column_data):
+    """Construct the TimeIntervals from whole columns, ordered as the (name, description) pairs in 'columns'."""
+    start_times, stop_times = _get_trial_start_and_stop_times(trial_times=trial_times, trial_indices=trial_indices)
+    predefined_descriptions = {column["name"]: column["description"] for column in TimeIntervals.__columns__}
+    vector_data = [
+        VectorData(name="start_time", description=predefined_descriptions["start_time"], data=start_times),
+        VectorData(name="stop_time", description=predefined_descriptions["stop_time"], data=stop_times),
+    ]
+    for column_name, column_description in columns:
+        data = column_data[column_name]
+        # String attributes are fetched as object arrays, which are written as variable-length strings from lists
+        if data.dtype == object:
+            data = data.tolist()
+        vector_data.append(VectorData(name=column_name, description=column_description, data=data))
+
+    return TimeIntervals(name=name, description=description, id=trial_indices, columns=vector_data)
+
+
+def add_trials_from_trippy(nwb, scan_key, trial_times, trial_data=None):
     trippy_columns = [
         ("stimulus_type", "The type of stimulus."),
         ("condition_hash", "The hash for the stimulus condition."),
@@ -37,56 +123,35 @@ def add_trials_from_trippy(nwb, scan_key, trial_times):
         ),
         ("spatial_freq", "The approximate max spatial frequency. The actual frequencies may be higher. (cy/point)."),
     ]
-    for column_name, column_description in trippy_columns:
-        trippy_table.add_column(column_name, column_description)
-
-    all_trial_data = ((nda.Trial & scan_key) * nda.Trippy).fetch(
-        "trial_idx",
-        "condition_hash",
-        "type",
-        "rng_seed",
-        "tex_ydim",
-        "tex_xdim",
-        "duration",
-        "xnodes",
-        "ynodes",
-        "up_factor",
-        "temp_freq",
-        "temp_kernel_length",
-        "spatial_freq",
-        order_by="trial_idx",
-        as_dict=True,
+    trial_data = trial_data or _fetch_trial_data(scan_key, stimulus_table_name="Trippy")
+    column_data = dict(
+        stimulus_type=trial_data["type"],
+        condition_hash=trial_data["condition_hash"],
+        rng_seed=trial_data["rng_seed"],
+        texture_height=trial_data["tex_ydim"],
+        texture_width=trial_data["tex_xdim"],
+        duration=trial_data["duration"].astype(np.float64),
+        xnodes=trial_data["xnodes"],
+        ynodes=trial_data["ynodes"],
+        up_factor=trial_data["up_factor"],
+        temp_freq=trial_data["temp_freq"],
+        temp_kernel_length=trial_data["temp_kernel_length"],
+        spatial_freq=trial_data["spatial_freq"],
     )
 
-    for trial_data in all_trial_data:
-        trial_time = trial_times.loc[trial_times["trial_idx"] == trial_data["trial_idx"]]
-        trippy_table.add_interval(
-            id=trial_data["trial_idx"],
-            start_time=trial_time["start_frame_time"].values[0],
-            stop_time=trial_time["end_frame_time"].values[0],
-            condition_hash=trial_data["condition_hash"],
-            stimulus_type=trial_data["type"],
-            rng_seed=trial_data["rng_seed"],
-            texture_height=trial_data["tex_ydim"],
-            texture_width=trial_data["tex_xdim"],
-            duration=float(trial_data["duration"]),
-            xnodes=trial_data["xnodes"],
-            ynodes=trial_data["ynodes"],
-            up_factor=trial_data["up_factor"],
-            temp_freq=trial_data["temp_freq"],
-            temp_kernel_length=trial_data["temp_kernel_length"],
-            spatial_freq=trial_data["spatial_freq"],
-        )
+    trippy_table = _make_time_intervals(
+        name="Trippy",
+        description="The stimulus table for the cosine of a smoothened noise phase movie.",
+        trial_times=trial_times,
+        trial_indices=trial_data["trial_idx"],
+        columns=trippy_columns,
+        column_data=column_data,
+    )
 
     nwb.add_time_intervals(trippy_table)
 
 
-def add_trials_from_clip(nwb, scan_key, trial_times):
-    clip_table = TimeIntervals(
-        name="Clip",
-        description="Composed of 10 second clips from cinematic releases, Sports-1M dataset, or custom rendered first person POV videos in 3D environment in Unreal Engine.",
-    )
-
+def add_trials_from_clip(nwb, scan_key, trial_times, trial_data=None):
     clip_columns = [
         ("stimulus_type", "The type of stimulus."),
         ("condition_hash", "The hash for the stimulus condition."),
@@ -94,42 +159,28 @@ def add_trials_from_clip(nwb, scan_key, trial_times):
         ("short_movie_name", "The type of the clip (cinematic, sports1m, rendered)."),
         ("duration", "The clip duration in seconds."),
     ]
-    for column_name, column_description in clip_columns:
-        clip_table.add_column(column_name, column_description)
-
-    all_trial_data = ((nda.Trial & scan_key) * nda.Clip).fetch(
-        "trial_idx",
-        "condition_hash",
-        "type",
-        "movie_name",
-        "short_movie_name",
-        "duration",
-        order_by="trial_idx",
-        as_dict=True,
+    trial_data = trial_data or _fetch_trial_data(scan_key, stimulus_table_name="Clip")
+    column_data = dict(
+        stimulus_type=trial_data["type"],
+        condition_hash=trial_data["condition_hash"],
+        movie_name=trial_data["movie_name"],
+        short_movie_name=trial_data["short_movie_name"],
+        duration=trial_data["duration"].astype(np.float64),
     )
 
-    for trial_data in all_trial_data:
-        trial_time = trial_times.loc[trial_times["trial_idx"] == trial_data["trial_idx"]]
-        clip_table.add_interval(
-            id=trial_data["trial_idx"],
-            start_time=trial_time["start_frame_time"].values[0],
-            stop_time=trial_time["end_frame_time"].values[0],
-            condition_hash=trial_data["condition_hash"],
-            stimulus_type=trial_data["type"],
-            movie_name=trial_data["movie_name"],
-            short_movie_name=trial_data["short_movie_name"],
-            duration=float(trial_data["duration"]),
-        )
+    clip_table = _make_time_intervals(
+        name="Clip",
+        description="Composed of 10 second clips from cinematic releases, Sports-1M dataset, or custom rendered first person POV videos in 3D environment in Unreal Engine.",
+        trial_times=trial_times,
+        trial_indices=trial_data["trial_idx"],
+        columns=clip_columns,
+        column_data=column_data,
+    )
 
     nwb.add_time_intervals(clip_table)
 
 
-def add_trials_from_monet2(nwb, scan_key, trial_times):
-    monet2_table = TimeIntervals(
-        name="Monet2",
-        description="Generated from smoothened Gaussian noise and a global orientation and direction component.",
-    )
-
+def add_trials_from_monet2(nwb, scan_key, trial_times, trial_data=None):
     monet2_columns = [
         ("stimulus_type", "The type of stimulus."),
         ("condition_hash", "The hash for the stimulus condition."),
@@ -145,47 +196,30 @@ def add_trials_from_monet2(nwb, scan_key, trial_times):
         ("ori_mix", "The mixin-coefficient of orientation biased noise."),
         ("num_directions", "The number of directions."),
     ]
-    for column_name, column_description in monet2_columns:
-        monet2_table.add_column(column_name, column_description)
-
-    all_trial_data = ((nda.Trial & scan_key) * nda.Monet2).fetch(
-        "trial_idx",
-        "condition_hash",
-        "type",
-        "rng_seed",
-        "duration",
-        "blue_green_saturation",
-        "pattern_width",
-        "pattern_aspect",
-        "temp_kernel",
-        "temp_bandwidth",
-        "ori_coherence",
-        "ori_fraction",
-        "ori_mix",
-        "n_dirs",
-        order_by="trial_idx",
-        as_dict=True,
+    trial_data = trial_data or _fetch_trial_data(scan_key, stimulus_table_name="Monet2")
+    column_data = dict(
+        stimulus_type=trial_data["type"],
+        condition_hash=trial_data["condition_hash"],
+        rng_seed=trial_data["rng_seed"],
+        duration=trial_data["duration"].astype(np.float64),
+        blue_green_saturation=trial_data["blue_green_saturation"].astype(np.int64),
+        pattern_width=trial_data["pattern_width"],
+        pattern_aspect=trial_data["pattern_aspect"],
+        temp_kernel=trial_data["temp_kernel"],
+        temp_bandwidth=trial_data["temp_bandwidth"].astype(np.float64),
+        ori_coherence=trial_data["ori_coherence"].astype(np.float64),
+        ori_fraction=trial_data["ori_fraction"],
+        ori_mix=trial_data["ori_mix"],
+        num_directions=trial_data["n_dirs"],
     )
 
-    for trial_data in all_trial_data:
-        trial_time = trial_times.loc[trial_times["trial_idx"] == trial_data["trial_idx"]]
-        monet2_table.add_interval(
-            id=trial_data["trial_idx"],
-            start_time=trial_time["start_frame_time"].values[0],
-            stop_time=trial_time["end_frame_time"].values[0],
-            condition_hash=trial_data["condition_hash"],
-            stimulus_type=trial_data["type"],
-            rng_seed=trial_data["rng_seed"],
-            duration=float(trial_data["duration"]),
-            blue_green_saturation=int(trial_data["blue_green_saturation"]),
-            pattern_width=trial_data["pattern_width"],
-            pattern_aspect=trial_data["pattern_aspect"],
-            temp_kernel=trial_data["temp_kernel"],
-            temp_bandwidth=float(trial_data["temp_bandwidth"]),
-            ori_coherence=float(trial_data["ori_coherence"]),
-            ori_fraction=trial_data["ori_fraction"],
-            ori_mix=trial_data["ori_mix"],
-            num_directions=trial_data["n_dirs"],
-        )
+    monet2_table = _make_time_intervals(
+        name="Monet2",
+        description="Generated from smoothened Gaussian noise and a global orientation and direction component.",
+        trial_times=trial_times,
+        trial_indices=trial_data["trial_idx"],
+        columns=monet2_columns,
+        column_data=column_data,
+    )
 
     nwb.add_time_intervals(monet2_table)
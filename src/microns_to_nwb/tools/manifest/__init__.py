@@ -0,0 +1 @@
+from .manifest import SessionManifest, get_file_fingerprint, get_file_hash, get_manifest_path
@@ -0,0 +1,99 @@
+import hashlib
+import json
+import os
+import tempfile
+from functools import lru_cache
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+from neuroconv.utils import FilePathType
+
+
+def get_manifest_path(nwbfile_path: FilePathType) -> Path:
+    nwbfile_path = Path(nwbfile_path)
+    return nwbfile_path.parent / f"{nwbfile_path.stem}_manifest.json"
+
+
+def get_file_fingerprint(file_path: FilePathType) -> Optional[dict]:
+    """The name, size and modification time of a file, or None when it does not exist."""
+    file_path = Path(file_path)
+    if not file_path.is_file():
+        return None
+    stat = file_path.stat()
+    return dict(file_name=file_path.name, size=stat.st_size, mtime_ns=stat.st_mtime_ns)
+
+
+@lru_cache(maxsize=None)
+def _get_file_hash(file_path: str, size: int, mtime_ns: int) -> str:
+    file_hash = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(2**24), b""):
+            file_hash.update(block)
+    return file_hash.hexdigest()
+
+
+def get_file_hash(file_path: FilePathType) -> Optional[str]:
+    """The SHA-256 of the content of a file, computed once per process for each version of the file."""
+    fingerprint = get_file_fingerprint(file_path)
+    if fingerprint is None:
+        return None
+    return _get_file_hash(str(Path(file_path).resolve()), fingerprint["size"], fingerprint["mtime_ns"])
+
+
+def _to_json(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+class SessionManifest:
+    """
+    The completed stages of the conversion of a session, saved as JSON after each stage.
+
+    The stages are only valid for the fingerprints of the inputs and options they were completed with, so that a
+    rerun resumes a session from its last completed stage, or starts over when its inputs changed.
+    """
+
+    def __init__(self, file_path: FilePathType):
+        self.file_path = Path(file_path)
+        self._state = dict(fingerprints=None, stages=dict())
+        if self.file_path.is_file():
+            with open(self.file_path, "r") as f:
+                self._state = json.load(f)
+
+    def validate(self, fingerprints: dict):
+        """Discard the completed stages when they were completed with other 'fingerprints'."""
+        # The round trip through JSON compares tuples with lists and numpy scalars with numbers
+        fingerprints = json.loads(json.dumps(fingerprints, default=_to_json))
+        if self._state["fingerprints"] != fingerprints:
+            self.reset(fingerprints=fingerprints)
+
+    def reset(self, fingerprints: Optional[dict] = None):
+        """Discard the completed stages, and record the 'fingerprints' they are completed with from now on."""
+        fingerprints = self._state["fingerprints"] if fingerprints is None else fingerprints
+        self._state = dict(fingerprints=fingerprints, stages=dict())
+        self._save()
+
+    def get_fingerprint(self, name: str, default=None):
+        """The recorded fingerprint of 'name', e.g. of a source file that is removed since."""
+        return (self._state["fingerprints"] or dict()).get(name, default)
+
+    def is_done(self, stage: str) -> bool:
+        return stage in self._state["stages"]
+
+    def get(self, stage: str, default=None):
+        return self._state["stages"].get(stage, default)
+
+    def set_done(self, stage: str, value=True):
+        """Record that 'stage' is completed, with an optional JSON-compatible 'value' to resume from."""
+        self._state["stages"][stage] = value
+        self._save()
+
+    def _save(self):
+        self.file_path.parent.mkdir(parents=True, exist_ok=True)
+        file_descriptor, temporary_path = tempfile.mkstemp(prefix=f".{self.file_path.name}_", dir=self.file_path.parent)
+        with os.fdopen(file_descriptor, "w") as f:
+            json.dump(self._state, f, indent=2, default=_to_json)
+        # Replacing the file is atomic, so that an interrupted run never leaves a partial manifest
+        os.replace(temporary_path, self.file_path)
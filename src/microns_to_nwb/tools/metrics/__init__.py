@@ -0,0 +1 @@
+from .metrics import StageMetrics, get_metrics_path, get_size_in_bytes, read_metrics, summarize_metrics
@@ -0,0 +1,193 @@
+import json
+import os
+import signal
+import subprocess
+import sys
+from contextlib import contextmanager
+from cProfile import Profile
+from pathlib import Path
+from shutil import which
+from threading import Lock
+from time import perf_counter, time
+from typing import List, Optional
+
+from neuroconv.utils import FilePathType
+
+from tools.database import get_num_round_trips
+
+try:
+    import resource
+except ImportError:  # resource is not available on Windows
+    resource = None
+
+PROFILERS = ("cprofile", "py-spy")
+
+
+def get_metrics_path(nwbfile_path: FilePathType) -> Path:
+    nwbfile_path = Path(nwbfile_path)
+    return nwbfile_path.parent / f"{nwbfile_path.stem}_metrics.jsonl"
+
+
+def get_size_in_bytes(path: Optional[FilePathType]) -> int:
+    """The size of a file, or the total size of the files in a folder (e.g. an NWB-Zarr store)."""
+    if path is None or not Path(path).exists():
+        return 0
+    path = Path(path)
+    if path.is_file():
+        return path.stat().st_size
+    return sum(file_path.stat().st_size for file_path in path.rglob("*") if file_path.is_file())
+
+
+def _get_cpu_time() -> float:
+    # Includes the CPU time of the child processes that have ended (e.g. the plane writers)
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+
+def _get_peak_rss_in_mb() -> Optional[float]:
+    if resource is None:
+        return None
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # The peak RSS is reported in kilobytes on Linux and in bytes on macOS
+    return peak_rss / 1e6 if sys.platform == "darwin" else peak_rss / 1e3
+
+
+def _take_snapshot(output_path: Optional[FilePathType] = None) -> dict:
+    return dict(
+        wall_time=perf_counter(),
+        cpu_time=_get_cpu_time(),
+        peak_rss_mb=_get_peak_rss_in_mb(),
+        round_trips=get_num_round_trips(),
+        size=get_size_in_bytes(output_path),
+    )
+
+
+class StageMetrics:
+    """
+    Measure the stages of the conversion of a session and append each of them as a JSON line to 'file_path'.
+
+    The metrics of a stage are its wall time, the CPU time of the process (with its ended child processes), the
+    growth of the peak RSS of the process, the number of database round trips and the growth of the 'output_path',
+    along with the error of a stage that failed. The CPU time, the peak RSS growth and the round trips are totals of
+    the process, so they are None for the stages that are measured as 'concurrent' with other threads.
+    When 'profile_stage' is specified, that stage is profiled with 'profiler', either 'cprofile' (which profiles
+    the calling thread and saves the stats for pstats or snakeviz) or 'py-spy' (which samples all the threads of the
+    process and saves a speedscope profile); the profile is saved next to 'file_path'.
+    """
+
+    def __init__(
+        self,
+        file_path: Optional[FilePathType] = None,
+        session_id: Optional[str] = None,
+        profile_stage: Optional[str] = None,
+        profiler: str = "cprofile",
+    ):
+        assert profiler in PROFILERS, f"The profiler must be one of {PROFILERS}!"
+        if profiler == "py-spy" and profile_stage is not None and which("py-spy") is None:
+            raise ValueError("The 'py-spy' profiler requires py-spy to be installed ('pip install py-spy').")
+        self.file_path = Path(file_path) if file_path is not None else None
+        self.session_id = session_id
+        self.profile_stage = profile_stage
+        self.profiler = profiler
+        self.records = []
+        self._lock = Lock()
+
+    @contextmanager
+    def measure(self, stage_name: str, output_path: Optional[FilePathType] = None, concurrent: bool = False):
+        """Measure the code run in this context as the stage 'stage_name', alongside other threads when 'concurrent'."""
+        start_time, start = time(), _take_snapshot(output_path=output_path)
+        error = None
+        try:
+            with self._profile(stage_name=stage_name):
+                yield
+        except BaseException as e:
+            error = repr(e)
+            raise
+        finally:
+            end = _take_snapshot(output_path=output_path)
+            process_values = dict(
+                cpu_time=end["cpu_time"] - start["cpu_time"],
+                peak_rss_delta_mb=end["peak_rss_mb"] - start["peak_rss_mb"] if end["peak_rss_mb"] is not None else None,
+                round_trips=end["round_trips"] - start["round_trips"],
+            )
+            if concurrent:
+                # The totals of the process also count the work of the other threads
+                process_values = dict.fromkeys(process_values)
+            self.record(
+                stage_name=stage_name,
+                start_time=start_time,
+                wall_time=end["wall_time"] - start["wall_time"],
+                peak_rss_mb=end["peak_rss_mb"],
+                bytes_written=end["size"] - start["size"],
+                error=error,
+                **process_values,
+            )
+
+    def record(self, stage_name: str, **values):
+        """Record the 'values' measured for the stage 'stage_name'."""
+        record = dict(session=self.session_id, stage=stage_name, pid=os.getpid(), end_time=time(), **values)
+        with self._lock:
+            self.records.append(record)
+            if self.file_path is not None:
+                self.file_path.parent.mkdir(parents=True, exist_ok=True)
+                with open(self.file_path, "a") as f:
+                    f.write(json.dumps(record) + "\n")
+
+    def get_wall_times(self) -> dict:
+        return {record["stage"]: record["wall_time"] for record in self.records if record.get("wall_time") is not None}
+
+    @contextmanager
+    def _profile(self, stage_name: str):
+        if stage_name != self.profile_stage:
+            yield
+            return
+
+        profile_path = self._get_profile_path(stage_name=stage_name)
+        if self.profiler == "cprofile":
+            profile = Profile()
+            profile.enable()
+            try:
+                yield
+            finally:
+                profile.disable()
+                profile.dump_stats(profile_path)
+            return
+
+        command = ["py-spy", "record", "--pid", str(os.getpid()), "--format", "speedscope", "--output"]
+        process = subprocess.Popen(command + [str(profile_path)], stdout=subprocess.DEVNULL)
+        try:
+            yield
+        finally:
+            # py-spy saves the profile when it is interrupted
+            process.send_signal(signal.SIGINT)
+            process.wait()
+
+    def _get_profile_path(self, stage_name: str) -> Path:
+        suffix = ".prof" if self.profiler == "cprofile" else ".speedscope.json"
+        folder_path = self.file_path.parent if self.file_path is not None else Path.cwd()
+        file_name = "_".join(name for name in (self.session_id, stage_name.replace("/", "_")) if name is not None)
+        return folder_path / f"{file_name}{suffix}"
+
+
+def read_metrics(file_path: FilePathType) -> List[dict]:
+    """Read the records of a JSON lines metrics file."""
+    if not Path(file_path).is_file():
+        return []
+    with open(file_path, "r") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def summarize_metrics(records: List[dict]) -> dict:
+    """Aggregate the 'records' of many sessions by stage: the totals of the times, round trips and bytes written."""
+    summary = dict()
+    for record in records:
+        stage_summary = summary.setdefault(
+            record["stage"],
+            dict(count=0, wall_time=0.0, cpu_time=0.0, max_peak_rss_mb=None, round_trips=0, bytes_written=0),
+        )
+        stage_summary["count"] += 1
+        for name in ("wall_time", "cpu_time", "round_trips", "bytes_written"):
+            stage_summary[name] += record.get(name) or 0
+        if record.get("peak_rss_mb") is not None:
+            stage_summary["max_peak_rss_mb"] = max(stage_summary["max_peak_rss_mb"] or 0.0, record["peak_rss_mb"])
+    return summary
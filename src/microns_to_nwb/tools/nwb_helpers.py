@@ -1,4 +1,6 @@
 from datetime import datetime
+from inspect import signature
+from typing import Callable
 from uuid import uuid4
 
 from pynwb import NWBFile
@@ -12,6 +14,15 @@ def check_module(nwb, name, description=None):
         return nwb.create_processing_module(name, description or name)
 
 
+def allow_none_for_optional_options(conversion_options_schema: dict, run_conversion: Callable) -> dict:
+    """Let the options of 'run_conversion' that default to None also be None in its conversion options schema."""
+    for parameter in signature(run_conversion).parameters.values():
+        option_schema = conversion_options_schema["properties"].get(parameter.name)
+        if parameter.default is None and option_schema is not None and "type" in option_schema:
+            option_schema.update(type=[option_schema["type"], "null"])
+    return conversion_options_schema
+
+
 def start_nwb(scan_key):
     nwb = NWBFile(
         identifier=str(uuid4()),
@@ -1 +1 @@
-from .ophys import add_ophys
+from .ophys import add_ophys, fetch_ophys_data
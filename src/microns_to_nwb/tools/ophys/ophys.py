@@ -1,6 +1,4 @@
 import numpy as np
-from hdmf.backends.hdf5 import H5DataIO
-from phase3 import nda, func
 from pynwb.base import Images
 from pynwb.image import GrayscaleImage
 from pynwb.ophys import (
@@ -10,14 +8,43 @@ from pynwb.ophys import (
     OpticalChannel,
 )
 
-from tools.cave_client import get_functional_coreg_table
+from tools.cave_client import MISSING_COREGISTRATION_VALUE, get_functional_coreg_table, get_coregistration_columns
+from tools.clocks import get_timing_kwargs
+from tools.compression import make_data_io
+from tools.database import get_session_data
 from tools.nwb_helpers import check_module
+from .traces import FluorescenceTracesIterator
 
+PIXEL_MASK_DTYPE = [("x", "u4"), ("y", "u4"), ("weight", "f4")]
 
-def add_summary_images(field_key, nwb):
+
+def fetch_ophys_data(scan_key, coreg_materialization_version=None, fetch_traces=True):
+    """
+    Fetch everything 'add_ophys' writes for a scan: the field geometry, the per-field data and the coreg table.
+
+    The tables are fetched once for all the fields of the scan (see tools.database.SessionData).
+    """
+    session_data = get_session_data(scan_key)
+    all_field_data = [dict(field_data) for field_data in session_data.get_fields()]
+    for field_data in all_field_data:
+        field_data.update(session_data.get_field_data(field_data["field"], fetch_traces=fetch_traces))
+
+    # Get functional coregistration table from CAVE for this scan
+    functional_coreg_table = get_functional_coreg_table(
+        scan_key=scan_key,
+        materialization_version=coreg_materialization_version,
+    )
+
+    return dict(fields=all_field_data, functional_coreg_table=functional_coreg_table)
+
+
+def add_summary_images(field_key, nwb, field_data):
     ophys = check_module(nwb, "ophys")
 
-    correlation_image_data, average_image_data = (nda.SummaryImages & field_key).fetch1("correlation", "average")
+    correlation_image_data = field_data["correlation_image"]
+    average_image_data = field_data["average_image"]
+    if correlation_image_data is None or average_image_data is None:
+        return
 
     # The image dimensions are (height, width), for NWB it should be transposed to (width, height).
     correlation_image_data = correlation_image_data.transpose(1, 0)
@@ -40,11 +67,47 @@ def add_summary_images(field_key, nwb):
     ophys.add(segmentation_images)
 
 
-def add_plane_segmentation(field_key, nwb, imaging_plane, image_segmentation):
-    image_height, image_width = (nda.Field & field_key).fetch1("px_height", "px_width")
-    mask_pixels, mask_weights, mask_ids, mask_types = (nda.Segmentation * nda.MaskClassification & field_key).fetch(
-        "pixels", "weights", "mask_id", "mask_type", order_by="mask_id"
-    )
+def get_pixel_masks(mask_pixels, mask_weights, image_height):
+    """
+    Convert the segmentation pixels and weights into the (x, y, weight) entries of a ragged 'pixel_mask' column.
+
+    The pixels are one-based indices into the column-major flattened (height, width) image. Returns the flat
+    pixel masks and the list of end offsets of each mask for the column index.
+    """
+    if not len(mask_pixels):
+        return np.empty(0, dtype=PIXEL_MASK_DTYPE), []
+    num_pixels_per_mask = np.fromiter((np.size(pixels) for pixels in mask_pixels), dtype=np.int64)
+    pixels = np.concatenate([np.ravel(pixels) for pixels in mask_pixels]).astype(np.int64) - 1
+    weights = np.concatenate([np.ravel(weights) for weights in mask_weights])
+
+    pixel_masks = np.empty(len(pixels), dtype=PIXEL_MASK_DTYPE)
+    pixel_masks["x"] = pixels // image_height
+    pixel_masks["y"] = pixels % image_height
+    pixel_masks["weight"] = weights
+
+    return pixel_masks, np.cumsum(num_pixels_per_mask).tolist()
+
+
+def get_image_masks(mask_pixels, mask_weights, image_height, image_width):
+    """
+    Reshape the segmentation pixels and weights into dense (mask, width, height) image masks.
+
+    Equivalent to 'phase3.func.reshape_masks' transposed for NWB, without connecting to the database.
+    """
+    masks = np.zeros((len(mask_pixels), image_width * image_height), dtype=np.float32)
+    for mask_index, (pixels, weights) in enumerate(zip(mask_pixels, mask_weights)):
+        # The one-based pixels index the column-major flattened (height, width) image, i.e. the row-major
+        # (width, height) image
+        masks[mask_index, np.ravel(pixels).astype(np.int64) - 1] = np.ravel(weights)
+    return masks.reshape(len(mask_pixels), image_width, image_height)
+
+
+def add_plane_segmentation(
+    field_key, nwb, imaging_plane, image_segmentation, field_data, mask_format="image_mask", compression_options=None
+):
+    image_height, image_width = field_data["px_height"], field_data["px_width"]
+    mask_pixels, mask_weights = field_data["mask_pixels"], field_data["mask_weights"]
+    mask_ids, mask_types = field_data["mask_ids"], field_data["mask_types"]
 
     plane_segmentation = image_segmentation.create_plane_segmentation(
         name=f"PlaneSegmentation{field_key['field']}",
@@ -58,18 +121,28 @@ def add_plane_segmentation(field_key, nwb, imaging_plane, image_segmentation):
         id=mask_ids,
     )
 
-    # Reshape masks
-    masks = func.reshape_masks(mask_pixels, mask_weights, image_height, image_width)
-    # The masks dimensions are (height, width, number of frames), for NWB it should be
-    # transposed to (number of frames, width, height)
-    masks = masks.transpose(2, 1, 0)
-
-    # Add image masks
-    plane_segmentation.add_column(
-        name="image_mask",
-        description="The image masks for each ROI.",
-        data=H5DataIO(masks, compression=True),
-    )
+    if mask_format == "pixel_mask":
+        # Add the sparse pixel masks without reshaping them into a dense image stack
+        pixel_masks, pixel_masks_index = get_pixel_masks(mask_pixels, mask_weights, image_height)
+        plane_segmentation.add_column(
+            name="pixel_mask",
+            description="The (x, y, weight) pixel masks for each ROI.",
+            data=make_data_io(pixel_masks, "image_masks", compression_options),
+            # A field without masks has an empty column, whose index is created with index=True
+            index=pixel_masks_index or True,
+        )
+    elif mask_format == "image_mask":
+        # The masks dimensions are (number of frames, width, height) as in NWB
+        masks = get_image_masks(mask_pixels, mask_weights, image_height, image_width)
+
+        # Add image masks
+        plane_segmentation.add_column(
+            name="image_mask",
+            description="The image masks for each ROI.",
+            data=make_data_io(masks, "image_masks", compression_options),
+        )
+    else:
+        raise ValueError(f"The mask format must be 'image_mask' or 'pixel_mask', not '{mask_format}'.")
 
     # Add type of ROIs
     plane_segmentation.add_column(
@@ -85,76 +158,60 @@ def add_functional_coregistration_to_plane_segmentation(
     field_key,
     functional_coreg_table,
     plane_segmentation,
+    unit_ids,
 ):
     if functional_coreg_table.empty:
         return
 
-    pt_supervoxel_ids = []
-    pt_root_ids = []
-    pt_x_positions = []
-    pt_y_positions = []
-    pt_z_positions = []
-    cave_ids = []
-
-    # filter down to units for this field
-    unit_ids = (nda.ScanUnit() & field_key).fetch("unit_id")
-
     # skip when none of the units have entries in the coreg table
-    if not any(functional_coreg_table["unit_id"].isin(unit_ids)):
+    if not functional_coreg_table["unit_id"].isin(unit_ids).any():
         return
-    for unit_id in unit_ids:
-        df = functional_coreg_table[functional_coreg_table["unit_id"] == unit_id]
-        if df.empty:
-            pt_supervoxel_ids.append(np.nan)
-            pt_root_ids.append(np.nan)
-            pt_x_positions.append(np.nan)
-            pt_y_positions.append(np.nan)
-            pt_z_positions.append(np.nan)
-            cave_ids.append([np.nan])
-
-        else:
-            pt_supervoxel_ids.extend(df["pt_supervoxel_id"].drop_duplicates().astype(np.float64).tolist())
-            pt_root_ids.extend(df["pt_root_id"].drop_duplicates().astype(np.float64).tolist())
-            pt_x_positions.extend(df["pt_position_x"].drop_duplicates().astype(np.float64).tolist())
-            pt_y_positions.extend(df["pt_position_y"].drop_duplicates().astype(np.float64).tolist())
-            pt_z_positions.extend(df["pt_position_z"].drop_duplicates().astype(np.float64).tolist())
-            cave_ids.append(df["id"].astype(np.float64).values.tolist())
+    coregistration_columns = get_coregistration_columns(
+        functional_coreg_table=functional_coreg_table,
+        unit_ids=unit_ids,
+    )
+    first_match = (
+        " For a unit with more than one identifier in CAVE, this is the value of its first match, for a unit without"
+        f" an identifier in CAVE it is {MISSING_COREGISTRATION_VALUE}."
+    )
 
     plane_segmentation.add_column(
         name="cave_ids",
-        description=f"The identifier(s) in CAVE for field {field_key['field']}.",
-        data=cave_ids,
-        index=True,
+        description=f"The identifier(s) in CAVE for field {field_key['field']}, empty for a unit without a match.",
+        data=coregistration_columns["cave_ids"],
+        index=coregistration_columns["cave_ids_index"],
     )
 
     plane_segmentation.add_column(
         name="pt_supervoxel_id",
-        description="The ID of the supervoxel from the watershed segmentation that is under the pt_position.",
-        data=pt_supervoxel_ids,
+        description="The ID of the supervoxel from the watershed segmentation that is under the pt_position."
+        + first_match,
+        data=coregistration_columns["pt_supervoxel_id"],
     )
 
     plane_segmentation.add_column(
         name="pt_root_id",
-        description="The ID of the segment/root_id under the pt_position from the Proofread Segmentation (v343).",
-        data=pt_root_ids,
+        description="The ID of the segment/root_id under the pt_position from the Proofread Segmentation (v343)."
+        + first_match,
+        data=coregistration_columns["pt_root_id"],
     )
 
     plane_segmentation.add_column(
         name="pt_x_position",
-        description="The x location in 4,4,40 nm voxels at a cell body for the cell.",
-        data=pt_x_positions,
+        description="The x location in 4,4,40 nm voxels at a cell body for the cell." + first_match,
+        data=coregistration_columns["pt_x_position"],
     )
 
     plane_segmentation.add_column(
         name="pt_y_position",
-        description="The y location in 4,4,40 nm voxels at a cell body for the cell.",
-        data=pt_y_positions,
+        description="The y location in 4,4,40 nm voxels at a cell body for the cell." + first_match,
+        data=coregistration_columns["pt_y_position"],
     )
 
     plane_segmentation.add_column(
         name="pt_z_position",
-        description="The z location in 4,4,40 nm voxels at a cell body for the cell.",
-        data=pt_z_positions,
+        description="The z location in 4,4,40 nm voxels at a cell body for the cell." + first_match,
+        data=coregistration_columns["pt_z_position"],
     )
 
 
@@ -170,28 +227,83 @@ def _get_fluorescence(nwb, fluorescence_name):
     return fluorescence
 
 
-def add_roi_response_series(field_key, nwb, plane_segmentation, timestamps):
-    traces_for_each_mask = (nda.Fluorescence() & field_key).fetch("trace", order_by="mask_id")
-    continuous_traces = np.vstack(traces_for_each_mask).T
+def add_roi_response_series(
+    field_key,
+    nwb,
+    plane_segmentation,
+    timestamps,
+    field_data,
+    trace_buffer_gb=None,
+    compression_options=None,
+    jitter_tolerance=None,
+    timestamps_series=None,
+):
+    if not len(field_data["mask_ids"]):
+        # A field without masks has no traces
+        continuous_traces = np.empty((len(timestamps), 0), dtype=np.float32)
+        num_rois = 0
+    elif trace_buffer_gb is None:
+        traces_for_each_mask = field_data["traces"]
+        continuous_traces = np.vstack(traces_for_each_mask).T
+        num_rois = continuous_traces.shape[1]
+    else:
+        # Stream the traces from the database in batches of masks while writing
+        continuous_traces = FluorescenceTracesIterator(
+            field_key=field_key,
+            mask_ids=field_data["mask_ids"],
+            buffer_gb=trace_buffer_gb,
+            num_frames=len(timestamps),
+        )
+        num_rois = len(field_data["mask_ids"])
 
     roi_table_region = plane_segmentation.create_roi_table_region(
-        region=list(range(continuous_traces.shape[1])), description=f"all rois in field {field_key['field']}"
+        region=list(range(num_rois)), description=f"all rois in field {field_key['field']}"
     )
 
     roi_response_series = RoiResponseSeries(
         name=f"RoiResponseSeries{field_key['field']}",
-        description=f"The fluorescence traces for field {field_key['field']}",
-        data=H5DataIO(continuous_traces, compression=True),
+        data=make_data_io(continuous_traces, "RoiResponseSeries", compression_options),
         rois=roi_table_region,
-        timestamps=H5DataIO(timestamps, compression=True),
         unit="n.a.",
+        **get_timing_kwargs(
+            timestamps,
+            description=f"The fluorescence traces for field {field_key['field']}",
+            compression_options=compression_options,
+            jitter_tolerance=jitter_tolerance,
+            timestamps_series=timestamps_series,
+        ),
     )
 
     fluorescence = _get_fluorescence(nwb=nwb, fluorescence_name="Fluorescence")
     fluorescence.add_roi_response_series(roi_response_series)
 
+    return roi_response_series
+
+
+def add_ophys(
+    scan_key,
+    nwb,
+    timestamps,
+    coreg_materialization_version=None,
+    ophys_data=None,
+    mask_format="image_mask",
+    trace_buffer_gb=None,
+    compression_options=None,
+    jitter_tolerance=None,
+):
+    """
+    Add the imaging planes, the segmentation, the summary images and the fluorescence traces of each field.
+
+    The ROIs are stored as dense 'image_mask' or as sparse 'pixel_mask' per 'mask_format'. When 'trace_buffer_gb' is
+    specified, the traces are not fetched but streamed from the database while writing, in batches of masks that
+    fit into that many gigabytes.
+    """
+    ophys_data = ophys_data or fetch_ophys_data(
+        scan_key=scan_key,
+        coreg_materialization_version=coreg_materialization_version,
+        fetch_traces=trace_buffer_gb is None,
+    )
 
-def add_ophys(scan_key, nwb, timestamps):
     device = nwb.create_device(
         name="Microscope",
         description="two-photon random access mesoscope",
@@ -200,11 +312,8 @@ def add_ophys(scan_key, nwb, timestamps):
     image_segmentation = ImageSegmentation()
     ophys.add(image_segmentation)
 
-    # Get functional coregistration table from CAVE for this scan
-    functional_coreg_table = get_functional_coreg_table(scan_key=scan_key)
-
-    all_field_data = (nda.Field & scan_key).fetch(as_dict=True)
-    for field_data in all_field_data:
+    timestamps_series = None
+    for field_data in ophys_data["fields"]:
         optical_channel = OpticalChannel(
             name="OpticalChannel",
             description="an optical channel",
@@ -235,11 +344,33 @@ def add_ophys(scan_key, nwb, timestamps):
 
         field_key = {**scan_key, **dict(field=field_data["field"])}
 
-        plane_segmentation = add_plane_segmentation(field_key, nwb, imaging_plane, image_segmentation)
+        plane_segmentation = add_plane_segmentation(
+            field_key,
+            nwb,
+            imaging_plane,
+            image_segmentation,
+            field_data,
+            mask_format=mask_format,
+            compression_options=compression_options,
+        )
         add_functional_coregistration_to_plane_segmentation(
             field_key=field_key,
-            functional_coreg_table=functional_coreg_table,
+            functional_coreg_table=ophys_data["functional_coreg_table"],
             plane_segmentation=plane_segmentation,
+            unit_ids=field_data["unit_ids"],
+        )
+        roi_response_series = add_roi_response_series(
+            field_key,
+            nwb,
+            plane_segmentation,
+            timestamps,
+            field_data,
+            trace_buffer_gb=trace_buffer_gb,
+            compression_options=compression_options,
+            jitter_tolerance=jitter_tolerance,
+            timestamps_series=timestamps_series,
         )
-        add_roi_response_series(field_key, nwb, plane_segmentation, timestamps)
-        add_summary_images(field_key, nwb)
+        # The frame times are stored once, by the first series, and the series of the other fields link to them
+        if timestamps_series is None:
+            timestamps_series = roi_response_series
+        add_summary_images(field_key, nwb, field_data)
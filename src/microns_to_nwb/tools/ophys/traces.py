@@ -0,0 +1,68 @@
+from typing import Optional, Tuple
+
+import numpy as np
+from datajoint import AndList
+from hdmf.data_utils import GenericDataChunkIterator
+
+from tools.database import fetch
+
+
+def fetch_traces(field_key, mask_ids):
+    """Fetch the fluorescence traces of the increasing 'mask_ids' of a field as a (time, roi) array."""
+    mask_ids_condition = f"mask_id in ({', '.join(str(int(mask_id)) for mask_id in mask_ids)})"
+    traces_for_each_mask = fetch("Fluorescence", AndList([field_key, mask_ids_condition]), "trace", order_by="mask_id")
+    assert len(traces_for_each_mask) == len(mask_ids), f"The traces of some of the masks {mask_ids} are missing!"
+    return np.vstack(traces_for_each_mask).T
+
+
+class FluorescenceTracesIterator(GenericDataChunkIterator):
+    """
+    Stream the (time, roi) fluorescence traces of a field into a pre-sized chunked dataset.
+
+    The traces are fetched from the database in batches of masks that cover the whole time axis, with as many masks
+    per batch as fit into 'buffer_gb'. The field must have masks. Only the first 'num_frames' of the traces are
+    written when it is specified.
+    """
+
+    def __init__(
+        self,
+        field_key: dict,
+        mask_ids: np.ndarray,
+        buffer_gb: float = 1.0,
+        chunk_mb: float = 1.0,
+        num_frames: Optional[int] = None,
+    ):
+        self.field_key = field_key
+        self.mask_ids = np.asarray(mask_ids)
+        if not len(self.mask_ids):
+            raise ValueError(f"The field {field_key} has no masks to stream the traces of.")
+
+        first_trace = fetch_traces(field_key=field_key, mask_ids=self.mask_ids[:1])
+        self._num_frames = min(first_trace.shape[0], num_frames or first_trace.shape[0])
+        self._trace_dtype = first_trace.dtype
+
+        num_rois = len(self.mask_ids)
+        trace_bytes = self._num_frames * self._trace_dtype.itemsize
+        num_rois_per_buffer = int(min(num_rois, max(1, buffer_gb * 1e9 // trace_bytes)))
+        num_rois_per_chunk = min(num_rois_per_buffer, 8)
+        if num_rois_per_buffer != num_rois:
+            num_rois_per_buffer -= num_rois_per_buffer % num_rois_per_chunk
+        num_frames_per_chunk = int(
+            min(self._num_frames, max(1, chunk_mb * 1e6 // (num_rois_per_chunk * self._trace_dtype.itemsize)))
+        )
+
+        super().__init__(
+            buffer_shape=(self._num_frames, num_rois_per_buffer),
+            chunk_shape=(num_frames_per_chunk, num_rois_per_chunk),
+        )
+
+    def _get_data(self, selection: Tuple[slice]) -> np.ndarray:
+        frames_selection, rois_selection = selection
+        traces = fetch_traces(field_key=self.field_key, mask_ids=self.mask_ids[rois_selection])
+        return traces[frames_selection]
+
+    def _get_dtype(self) -> np.dtype:
+        return self._trace_dtype
+
+    def _get_maxshape(self) -> Tuple[int, int]:
+        return self._num_frames, len(self.mask_ids)
@@ -0,0 +1,3 @@
+from .pipeline import run_pipeline
+from .scheduler import estimate_session_resources, get_available_memory_gb
+from .upload import upload_to_dandi, upload_to_folder
@@ -0,0 +1,78 @@
+from concurrent.futures import FIRST_COMPLETED, Executor, wait
+from typing import Callable, List, Optional, Tuple
+from warnings import warn
+
+
+def run_pipeline(
+    jobs: list,
+    stages: List[Tuple[str, Callable, Executor]],
+    max_pending_jobs: Optional[int] = None,
+    on_job_done: Optional[Callable] = None,
+    job_costs: Optional[List[float]] = None,
+    max_total_cost: Optional[float] = None,
+) -> list:
+    """
+    Pass each job through the 'stages' in order, where each stage is a (name, function, executor).
+
+    The function of each stage is called with the job in its own executor, so that the stages of different jobs
+    overlap (e.g. the upload of one session with the conversion of the next). At most 'max_pending_jobs' jobs are
+    between the start of the first stage and the end of the last one, which bounds the queue in front of each
+    stage. A job that fails in a stage skips the following stages. Returns, for each job, the dictionary of the
+    results of its stages, with the exception of the failed stage.
+
+    When 'job_costs' are specified (e.g. the estimated peak memory of the first stage of each job), the jobs are
+    admitted in order while the total cost of the jobs in their first stage stays under 'max_total_cost'; the
+    later jobs that fit are admitted ahead of a job that does not. A job that exceeds 'max_total_cost' on its own
+    is admitted alone.
+    """
+    max_pending_jobs = max_pending_jobs or len(jobs)
+    job_costs = job_costs or [0.0] * len(jobs)
+    max_total_cost = float("inf") if max_total_cost is None else max_total_cost
+    results = [dict() for _ in jobs]
+    pending_jobs = list(range(len(jobs)))
+    running = dict()
+    first_stage_jobs = set()
+
+    def submit(job_index: int, stage_index: int):
+        stage_name, function, executor = stages[stage_index]
+        running[executor.submit(function, jobs[job_index])] = (job_index, stage_index)
+
+    def admit_jobs():
+        total_cost = sum(job_costs[job_index] for job_index in first_stage_jobs)
+        for job_index in list(pending_jobs):
+            if len(running) >= max_pending_jobs:
+                return
+            if first_stage_jobs and total_cost + job_costs[job_index] > max_total_cost:
+                continue
+            if job_costs[job_index] > max_total_cost:
+                warn(
+                    f"The cost of job {job_index} ({job_costs[job_index]:.1f}) exceeds the maximum total cost "
+                    f"({max_total_cost:.1f}), it is run alone."
+                )
+            pending_jobs.remove(job_index)
+            first_stage_jobs.add(job_index)
+            total_cost += job_costs[job_index]
+            submit(job_index=job_index, stage_index=0)
+
+    admit_jobs()
+    while running:
+        done, _ = wait(running, return_when=FIRST_COMPLETED)
+        for future in done:
+            job_index, stage_index = running.pop(future)
+            first_stage_jobs.discard(job_index)
+            stage_name = stages[stage_index][0]
+            if future.exception() is not None:
+                results[job_index][stage_name] = future.exception()
+                warn(
+                    f"The {stage_name} of job {job_index} failed and its next stages are skipped: {future.exception()}"
+                )
+            else:
+                results[job_index][stage_name] = future.result()
+                if stage_index + 1 < len(stages):
+                    submit(job_index=job_index, stage_index=stage_index + 1)
+                    continue
+            if on_job_done is not None:
+                on_job_done(job_index)
+        admit_jobs()
+
+    return results
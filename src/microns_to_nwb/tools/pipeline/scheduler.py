@@ -0,0 +1,69 @@
+import os
+from typing import Optional
+
+import numpy as np
+from neuroconv.utils import FilePathType
+from tifffile import TiffFile
+
+# The memory of the interpreter and of the libraries in each conversion process
+BASE_MEMORY_GB = 1.0
+# The throughput of reading, compressing and writing the data of a session, only used to order the sessions
+WRITE_THROUGHPUT_GB_PER_S = 0.05
+
+
+def get_available_memory_gb() -> float:
+    """The memory available for new processes, or the total memory where it is not reported."""
+    try:
+        with open("/proc/meminfo", "r") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) / 1e6
+    except OSError:
+        pass
+    return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") / 1e9
+
+
+def estimate_session_resources(
+    ophys_file_path: FilePathType,
+    num_frames: int,
+    num_fields: int,
+    mask_format: str = "image_mask",
+    trace_buffer_gb: Optional[float] = None,
+    plane_reader: str = "per_plane",
+    max_plane_workers: Optional[int] = None,
+    buffer_gb: float = 1.0,
+    num_rois_per_field: int = 1500,
+) -> dict:
+    """
+    Estimate the peak memory (in GB) and the relative runtime (in seconds) of the conversion of a session.
+
+    The frame size is read from the first page of the TIFF file and 'num_frames' (per field) and 'num_fields' are
+    those of 'nda.Scan'. The peak memory adds up the processed data held in memory (the traces of all the fields
+    unless they are streamed in 'trace_buffer_gb', and the dense image masks for 'num_rois_per_field' ROIs) and the
+    buffers of the plane readers, which read 'buffer_gb' at a time and hold a transposed copy of it.
+    """
+    # Only the first page is read, since the series of a ScanImage TIFF is only known once all its pages are parsed
+    with TiffFile(ophys_file_path) as tif:
+        num_pixels_per_frame = int(np.prod(tif.pages[0].shape))
+    tiff_gb = os.path.getsize(ophys_file_path) / 1e9
+
+    num_rois = num_fields * num_rois_per_field
+    traces_gb = num_rois * num_frames * np.dtype("float32").itemsize / 1e9
+    image_masks_gb = num_rois * num_pixels_per_frame * np.dtype("float32").itemsize / 1e9
+
+    # The traces are fetched as one array per ROI and stacked into a copy
+    processed_gb = 2 * traces_gb if trace_buffer_gb is None else 2 * trace_buffer_gb
+    if mask_format == "image_mask":
+        processed_gb += image_masks_gb
+
+    if plane_reader == "parallel":
+        num_plane_processes = min(max_plane_workers or num_fields, num_fields)
+        imaging_gb = num_plane_processes * (BASE_MEMORY_GB + 2 * buffer_gb)
+    else:
+        imaging_gb = 2 * buffer_gb
+
+    written_gb = tiff_gb + traces_gb + (image_masks_gb if mask_format == "image_mask" else 0.0)
+    return dict(
+        memory_gb=BASE_MEMORY_GB + processed_gb + imaging_gb,
+        runtime_s=written_gb / WRITE_THROUGHPUT_GB_PER_S,
+    )
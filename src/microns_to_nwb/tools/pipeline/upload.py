@@ -0,0 +1,17 @@
+import shutil
+from pathlib import Path
+
+from neuroconv.tools.data_transfers import automatic_dandi_upload
+from neuroconv.utils import FilePathType, FolderPathType
+
+
+def upload_to_dandi(nwbfile_path: FilePathType, dandiset_id: str = "000402"):
+    """Upload the folder of an NWB file to the DANDI archive."""
+    automatic_dandi_upload(dandiset_id=dandiset_id, nwb_folder_path=Path(nwbfile_path).parent, cleanup=False)
+
+
+def upload_to_folder(nwbfile_path: FilePathType, folder_path: FolderPathType):
+    """A local stand-in for 'upload_to_dandi' that copies the NWB file into 'folder_path'."""
+    folder_path = Path(folder_path)
+    folder_path.mkdir(parents=True, exist_ok=True)
+    shutil.copy2(nwbfile_path, folder_path / Path(nwbfile_path).name)
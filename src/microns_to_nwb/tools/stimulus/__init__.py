@@ -0,0 +1,7 @@
+from .stimulus import (
+    STIMULUS_STORAGE_MODES,
+    add_stimulus_templates,
+    get_stimulus_frame_keys,
+    get_template_indices,
+    verify_repeated_frames,
+)
@@ -0,0 +1,212 @@
+import hashlib
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+import cv2
+import numpy as np
+import pandas as pd
+from neuroconv.utils import FilePathType
+from pynwb import NWBFile
+from pynwb.base import ImageReferences, Images
+from pynwb.image import IndexSeries, RGBImage
+
+from tools.clocks import get_timing_kwargs
+from tools.compression import make_data_io
+
+# The stimulus movie is either written in full or as the unique frames of its conditions and an index series
+STIMULUS_STORAGE_MODES = ("movie", "templates")
+
+
+def get_stimulus_frame_keys(movie_times: np.ndarray, trial_times: pd.DataFrame, trials_data: dict) -> list:
+    """
+    The key of each frame of the stimulus movie, the frames with the same key show the same image.
+
+    The frames that are presented during a trial are keyed by the 'condition_hash' of the trial and their position
+    in it, so that the repeats of a condition share their frames. The other frames (e.g. between the trials) are
+    keyed by their own frame number.
+    """
+    condition_hashes = {
+        trial_idx: condition_hash
+        for trial_data in trials_data.values()
+        for trial_idx, condition_hash in zip(trial_data["trial_idx"], trial_data["condition_hash"])
+    }
+    trials = trial_times.drop_duplicates(subset="trial_idx")
+    start_frames = np.searchsorted(movie_times, trials["start_frame_time"].to_numpy(), side="left")
+    end_frames = np.searchsorted(movie_times, trials["end_frame_time"].to_numpy(), side="right")
+
+    frame_keys = list(range(len(movie_times)))
+    for trial_idx, start_frame, end_frame in zip(trials["trial_idx"], start_frames, end_frames):
+        if trial_idx not in condition_hashes:
+            continue
+        for frame_offset, frame in enumerate(range(start_frame, end_frame)):
+            frame_keys[frame] = (condition_hashes[trial_idx], frame_offset)
+    return frame_keys
+
+
+def get_template_indices(frame_keys: list) -> Tuple[np.ndarray, np.ndarray]:
+    """The movie frame of each template (the first frame of each key) and the template index of each movie frame."""
+    template_indices = dict()
+    indices = np.fromiter(
+        (template_indices.setdefault(key, len(template_indices)) for key in frame_keys),
+        dtype=np.uint32,
+        count=len(frame_keys),
+    )
+    _, template_frames = np.unique(indices, return_index=True)
+    return template_frames, indices
+
+
+def _iter_movie_frames(file_path: FilePathType, frame_numbers: List[int]):
+    """Yield the RGB frames with the increasing 'frame_numbers' from one sequential pass over the movie."""
+    video_capture = cv2.VideoCapture(str(file_path))
+    try:
+        current_frame_number = 0
+        for frame_number in frame_numbers:
+            # The frames in between are only grabbed, which skips their decoding
+            for _ in range(frame_number - current_frame_number):
+                video_capture.grab()
+            success, frame = video_capture.read()
+            if not success:
+                raise ValueError(f"The frame {frame_number} of '{file_path}' could not be read.")
+            current_frame_number = frame_number + 1
+            yield np.flip(frame, 2)
+    finally:
+        video_capture.release()
+
+
+def _get_presentations(frame_keys: list) -> list:
+    """The condition hash, the start frame and the number of frames of each presentation of a condition."""
+    presentations = []
+    for frame, key in enumerate(frame_keys):
+        if not isinstance(key, tuple):
+            continue
+        condition_hash, frame_offset = key
+        previous = presentations[-1] if presentations else None
+        is_continued = (
+            previous is not None
+            and previous[0] == condition_hash
+            and previous[1] + previous[2] == frame
+            and frame_offset == previous[2]
+        )
+        if is_continued:
+            previous[2] += 1
+        else:
+            presentations.append([condition_hash, frame, 1])
+    return presentations
+
+
+def verify_repeated_frames(movie_file_path: FilePathType, frame_keys: list, verification_interval: int = 1) -> list:
+    """
+    The 'frame_keys' where the repeats of a condition that differ from its first presentation are keyed by frame.
+
+    A repeat with another number of frames than the first presentation (e.g. with a dropped frame) differs from it.
+    The frames of the other repeats at the offsets in the trial that are multiples of 'verification_interval' (by
+    default every frame) and their last frame are decoded and compared by their hash with the frames of the first
+    presentation. The frames of a repeat that differs are keyed by their own frame number, so that they are stored
+    as they are.
+    """
+    if verification_interval < 1:
+        raise ValueError(f"The verification interval must be at least 1, not {verification_interval}.")
+
+    first_presentations = dict()
+    first_frames = dict()
+    # The number of frames of the presentations that differ by their start frame, and the presentation of each
+    # sampled frame
+    differing_presentations = dict()
+    sampled_presentations = dict()
+    for presentation in _get_presentations(frame_keys=frame_keys):
+        condition_hash, start_frame, num_frames = presentation
+        if condition_hash not in first_presentations:
+            first_presentations[condition_hash] = presentation
+            first_frames.update({frame_keys[frame]: frame for frame in range(start_frame, start_frame + num_frames)})
+        elif num_frames != first_presentations[condition_hash][2]:
+            differing_presentations[start_frame] = num_frames
+        else:
+            frame_offsets = set(range(0, num_frames, verification_interval)) | {num_frames - 1}
+            sampled_presentations.update(
+                {start_frame + frame_offset: (start_frame, num_frames) for frame_offset in frame_offsets}
+            )
+
+    if sampled_presentations:
+        frame_numbers = sorted(
+            set(sampled_presentations) | {first_frames[frame_keys[frame]] for frame in sampled_presentations}
+        )
+        frame_hashes = {
+            frame_number: hashlib.sha1(frame.tobytes()).hexdigest()
+            for frame_number, frame in zip(
+                frame_numbers, _iter_movie_frames(file_path=movie_file_path, frame_numbers=frame_numbers)
+            )
+        }
+        for frame, (start_frame, num_frames) in sampled_presentations.items():
+            if frame_hashes[frame] != frame_hashes[first_frames[frame_keys[frame]]]:
+                differing_presentations[start_frame] = num_frames
+    if not differing_presentations:
+        return frame_keys
+
+    frame_keys = list(frame_keys)
+    for start_frame, num_frames in differing_presentations.items():
+        frame_keys[start_frame : start_frame + num_frames] = range(start_frame, start_frame + num_frames)
+    return frame_keys
+
+
+def add_stimulus_templates(
+    nwbfile: NWBFile,
+    movie_file_path: FilePathType,
+    movie_times: np.ndarray,
+    trial_times: pd.DataFrame,
+    trials_data: dict,
+    compression_options: Optional[dict] = None,
+    jitter_tolerance: Optional[float] = None,
+    verification_interval: int = 1,
+):
+    """
+    Add the stimulus movie as the unique frames of its conditions and the index of the frame shown at each time.
+
+    The unique frames (see get_stimulus_frame_keys) are read from the movie in a single pass and added as an Images
+    container of stimulus templates, which is indexed by an IndexSeries of the stimulus with the 'movie_times'.
+    The repeats of the conditions are first checked against their first presentation (see verify_repeated_frames
+    with 'verification_interval'), and the repeats that differ are stored as they are. The IndexSeries has a
+    starting time and rate when the 'movie_times' are regular within 'jitter_tolerance' (see
+    tools.clocks.get_timing_kwargs).
+    """
+    movie_name = Path(movie_file_path).stem
+    frame_keys = get_stimulus_frame_keys(movie_times=movie_times, trial_times=trial_times, trials_data=trials_data)
+    frame_keys = verify_repeated_frames(
+        movie_file_path=movie_file_path, frame_keys=frame_keys, verification_interval=verification_interval
+    )
+    template_frames, indices = get_template_indices(frame_keys=frame_keys)
+
+    # The templates have no timing of their own, they are shown at the times of the IndexSeries
+    templates = [
+        RGBImage(name=f"template_{template_index}", data=make_data_io(frame, "stimulus", compression_options))
+        for template_index, frame in enumerate(
+            _iter_movie_frames(file_path=movie_file_path, frame_numbers=template_frames.tolist())
+        )
+    ]
+    stimulus_templates = Images(
+        name=f"Templates: {movie_name}",
+        images=templates,
+        description=(
+            f"The {len(templates)} unique frames of the visual stimulus, one for each frame of each stimulus "
+            "condition (see the 'condition_hash' of the trials) and for each frame outside of the trials or of a "
+            "repeat of a condition that differs from its first presentation."
+        ),
+        order_of_images=ImageReferences(name="order_of_images", data=templates),
+    )
+    nwbfile.add_stimulus_template(stimulus_templates)
+
+    stimulus = IndexSeries(
+        name=f"Video: {movie_name}",
+        data=make_data_io(indices, "stimulus", compression_options),
+        indexed_images=stimulus_templates,
+        unit="N/A",
+        **get_timing_kwargs(
+            movie_times,
+            description=(
+                "The visual stimulus is composed of natural movie clips ~60 fps, as the index of the stimulus "
+                "template that is shown at each frame."
+            ),
+            compression_options=compression_options,
+            jitter_tolerance=jitter_tolerance,
+        ),
+    )
+    nwbfile.add_stimulus(stimulus)
@@ -0,0 +1 @@
+from .stub import get_num_samples_until, get_stub_end_time, stub_ophys_data, stub_series_data, stub_trials
@@ -0,0 +1,62 @@
+from typing import Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+
+def get_stub_end_time(
+    frame_times: np.ndarray, stub_duration: Optional[float] = None, stub_frames: Optional[int] = None
+) -> float:
+    """
+    The end of the time window of a stub session, after 'stub_frames' imaging frames or 'stub_duration' seconds.
+
+    The window starts at the start of the session. The behavior, the traces, the imaging planes, the trials that end
+    in the window and the stimulus movie of a stub session are limited to it.
+    """
+    if (stub_duration is None) == (stub_frames is None):
+        raise ValueError("Either the 'stub_duration' or the 'stub_frames' must be specified.")
+    if stub_frames is not None and stub_frames < 1:
+        raise ValueError(f"The 'stub_frames' must be at least 1, not {stub_frames}.")
+    if stub_duration is not None and stub_duration < 0:
+        raise ValueError(f"The 'stub_duration' must be at least 0, not {stub_duration}.")
+    if stub_frames is not None:
+        return float(frame_times[min(stub_frames, len(frame_times)) - 1])
+    return float(frame_times[0] + stub_duration)
+
+
+def get_num_samples_until(timestamps: np.ndarray, end_time: float) -> int:
+    """The number of samples up to the last one at or before 'end_time', missing (NaN) timestamps are kept."""
+    indices = np.flatnonzero(np.asarray(timestamps) <= end_time)
+    return int(indices[-1] + 1) if len(indices) else 0
+
+
+def stub_series_data(series_data: dict, timestamps: np.ndarray, end_time: float) -> Tuple[dict, np.ndarray]:
+    """Limit the arrays of a fetched series (e.g. the pupil tracking) and their 'timestamps' to the time window."""
+    num_samples = get_num_samples_until(timestamps=timestamps, end_time=end_time)
+    series_data = {name: np.asarray(values)[:num_samples] for name, values in series_data.items()}
+    return series_data, timestamps[:num_samples]
+
+
+def stub_ophys_data(ophys_data: dict, num_frames: int) -> dict:
+    """Limit the fetched fluorescence traces of each field (see tools.ophys.fetch_ophys_data) to the first frames."""
+    fields = []
+    for field_data in ophys_data["fields"]:
+        field_data = dict(field_data)
+        # The traces are not fetched when they are streamed (see tools.ophys.add_roi_response_series)
+        if "traces" in field_data:
+            field_data["traces"] = [trace[:num_frames] for trace in field_data["traces"]]
+        fields.append(field_data)
+    return dict(ophys_data, fields=fields)
+
+
+def stub_trials(trial_times: pd.DataFrame, trials_data: dict, end_time: float) -> Tuple[pd.DataFrame, dict]:
+    """Limit the trial times and the fetched trials of each stimulus type to the trials that end in the window."""
+    trial_indices = trial_times.loc[trial_times["end_frame_time"] <= end_time, "trial_idx"].unique()
+    trial_times = trial_times[trial_times["trial_idx"].isin(trial_indices)]
+    stubbed_trials_data = dict()
+    for stimulus_type, trial_data in trials_data.items():
+        in_window = np.isin(trial_data["trial_idx"], trial_indices)
+        stubbed_trials_data[stimulus_type] = {
+            name: np.asarray(values)[in_window] for name, values in trial_data.items()
+        }
+    return trial_times, stubbed_trials_data
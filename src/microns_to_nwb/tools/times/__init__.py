@@ -1 +1,2 @@
 from .times import get_stimulus_times, get_trial_times, get_frame_times
+from .store import build_timestamps_store, load_timestamps_store
@@ -0,0 +1,181 @@
+import json
+import os
+import shutil
+import tempfile
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+KEY_COLUMNS = ("session", "scan_idx")
+
+
+def get_store_path(file_path: str) -> Path:
+    file_path = Path(file_path)
+    return file_path.parent / f"{file_path.stem}_store"
+
+
+def _get_source_fingerprint(file_path: Path) -> dict:
+    stat = file_path.stat()
+    return dict(file_name=file_path.name, size=stat.st_size, mtime_ns=stat.st_mtime_ns)
+
+
+def _is_ragged_column(values: pd.Series) -> bool:
+    is_array = values.map(lambda value: isinstance(value, np.ndarray)).to_numpy(dtype=bool)
+    if is_array.any() and not is_array.all():
+        raise ValueError(f"The column '{values.name}' mixes arrays with other values.")
+    return len(values) > 0 and is_array.all()
+
+
+def _to_fixed_width(values: pd.Series) -> np.ndarray:
+    array = values.to_numpy()
+    if array.dtype == object:
+        # Object columns (e.g. stimulus type names) are stored as fixed-width strings so that they can be memory-mapped,
+        # with their missing values as empty strings along with a mask (see '_get_missing_values')
+        array = np.array(values.where(values.notna(), "").astype(str).tolist(), dtype=str)
+    return array
+
+
+def _get_missing_values(values: pd.Series) -> Optional[np.ndarray]:
+    """The mask of the missing values of an object column, which are restored as None when it is read."""
+    if values.to_numpy().dtype != object or not values.isna().any():
+        return None
+    return values.isna().to_numpy()
+
+
+def build_timestamps_store(file_path: str, store_path: Optional[str] = None) -> Path:
+    """
+    Compile a v8 timestamps pickle (ScanTimes.pkl, Trial.pkl or v8_movie_timestamps.pkl) into an indexed store.
+
+    The rows are sorted by (session, scan_idx) and every column is saved as a separate .npy file that can be
+    memory-mapped. Array-valued columns (e.g. 'frame_times', 'full_flips') are concatenated into a flat array with
+    an accompanying offsets array. The 'keys.npy' index maps each (session, scan_idx) to its row range.
+    """
+    file_path = Path(file_path)
+    store_path = Path(store_path) if store_path is not None else get_store_path(file_path)
+
+    table = pd.read_pickle(file_path)
+    table = table.sort_values(list(KEY_COLUMNS), kind="stable").reset_index(drop=True)
+
+    sessions = table["session"].to_numpy(dtype=np.int64)
+    scan_indices = table["scan_idx"].to_numpy(dtype=np.int64)
+    is_new_key = np.ones(len(table), dtype=bool)
+    is_new_key[1:] = (sessions[1:] != sessions[:-1]) | (scan_indices[1:] != scan_indices[:-1])
+    key_starts = np.flatnonzero(is_new_key)
+    key_stops = np.append(key_starts[1:], len(table))
+
+    keys = np.empty(len(key_starts), dtype=[("session", "i8"), ("scan_idx", "i8"), ("start", "i8"), ("stop", "i8")])
+    keys["session"] = sessions[key_starts]
+    keys["scan_idx"] = scan_indices[key_starts]
+    keys["start"] = key_starts
+    keys["stop"] = key_stops
+
+    store_path.parent.mkdir(parents=True, exist_ok=True)
+    temporary_store_path = Path(tempfile.mkdtemp(prefix=f".{store_path.name}_", dir=store_path.parent))
+    try:
+        columns = dict()
+        for column_name in table.columns:
+            if column_name in KEY_COLUMNS:
+                continue
+            values = table[column_name]
+            if _is_ragged_column(values):
+                lengths = np.fromiter((len(value) for value in values), dtype=np.int64, count=len(values))
+                offsets = np.concatenate([[0], np.cumsum(lengths)])
+                np.save(temporary_store_path / f"{column_name}.npy", np.concatenate(values.tolist()))
+                np.save(temporary_store_path / f"{column_name}_offsets.npy", offsets)
+                columns[column_name] = "ragged"
+            else:
+                np.save(temporary_store_path / f"{column_name}.npy", _to_fixed_width(values))
+                missing_values = _get_missing_values(values)
+                if missing_values is not None:
+                    np.save(temporary_store_path / f"{column_name}_missing.npy", missing_values)
+                columns[column_name] = "scalar"
+        np.save(temporary_store_path / "keys.npy", keys)
+
+        with open(temporary_store_path / "meta.json", "w") as f:
+            json.dump(dict(source=_get_source_fingerprint(file_path), columns=columns), f)
+    except BaseException:
+        shutil.rmtree(temporary_store_path, ignore_errors=True)
+        raise
+
+    # Move the previous store aside before renaming the finished one into place, so that readers find either a
+    # complete store or, in between the two renames, none, but never a partially written or partially removed one
+    previous_store_path = Path(tempfile.mkdtemp(prefix=f".{store_path.name}_previous_", dir=store_path.parent))
+    try:
+        os.replace(store_path, previous_store_path)
+    except FileNotFoundError:
+        pass
+    try:
+        os.rename(temporary_store_path, store_path)
+    except OSError:
+        # Another process compiled the same pickle in the meantime
+        shutil.rmtree(temporary_store_path, ignore_errors=True)
+    shutil.rmtree(previous_store_path, ignore_errors=True)
+
+    if not _is_store_current(store_path=store_path, file_path=file_path):
+        raise RuntimeError(f"The store '{store_path}' could not be updated from '{file_path}'.")
+    return store_path
+
+
+def _is_store_current(store_path: Path, file_path: Path) -> bool:
+    meta_file_path = store_path / "meta.json"
+    if not meta_file_path.is_file():
+        return False
+    with open(meta_file_path, "r") as f:
+        meta = json.load(f)
+    return meta["source"] == _get_source_fingerprint(file_path)
+
+
+class TimestampsStore:
+    """Read-only access to the per-scan slices of a compiled timestamps store."""
+
+    def __init__(self, store_path: str):
+        self.store_path = Path(store_path)
+        with open(self.store_path / "meta.json", "r") as f:
+            self._columns = json.load(f)["columns"]
+        self._columns_with_missing_values = {
+            column_name for column_name in self._columns if (self.store_path / f"{column_name}_missing.npy").is_file()
+        }
+
+        keys = np.load(self.store_path / "keys.npy")
+        self._index = {
+            (int(session), int(scan_idx)): (int(start), int(stop)) for session, scan_idx, start, stop in keys.tolist()
+        }
+
+    def _load_column(self, file_name):
+        return np.load(self.store_path / file_name, mmap_mode="r")
+
+    def get_scan(self, scan_key: dict) -> dict:
+        """Return the columns for one (session, scan_idx); array-valued columns are returned as a list of arrays."""
+        key = (int(scan_key["session"]), int(scan_key["scan_idx"]))
+        if key not in self._index:
+            raise KeyError(f"There are no entries for session {key[0]} scan {key[1]} in '{self.store_path}'.")
+        start, stop = self._index[key]
+
+        scan_columns = dict(session=np.full(stop - start, key[0]), scan_idx=np.full(stop - start, key[1]))
+        for column_name, column_type in self._columns.items():
+            values = self._load_column(f"{column_name}.npy")
+            if column_type == "ragged":
+                offsets = self._load_column(f"{column_name}_offsets.npy")
+                scan_columns[column_name] = [
+                    np.array(values[offsets[row] : offsets[row + 1]]) for row in range(start, stop)
+                ]
+            else:
+                scan_columns[column_name] = np.array(values[start:stop])
+                if column_name in self._columns_with_missing_values:
+                    missing_values = self._load_column(f"{column_name}_missing.npy")[start:stop]
+                    scan_columns[column_name] = scan_columns[column_name].astype(object)
+                    scan_columns[column_name][missing_values] = None
+
+        return scan_columns
+
+
+def load_timestamps_store(file_path: str) -> TimestampsStore:
+    """Open the store for a timestamps pickle, compiling it first when it is missing or out of date."""
+    file_path = Path(file_path)
+    store_path = get_store_path(file_path)
+    if not _is_store_current(store_path=store_path, file_path=file_path):
+        build_timestamps_store(file_path=file_path, store_path=store_path)
+
+    return TimestampsStore(store_path=store_path)
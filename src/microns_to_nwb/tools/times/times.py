@@ -1,32 +1,27 @@
 import pandas as pd
 
+from .store import load_timestamps_store
+
 
 def get_frame_times(scan_key: dict, file_path: str):
-    frame_times = pd.read_pickle(file_path)
+    frame_times = load_timestamps_store(file_path).get_scan(scan_key=scan_key)
 
-    frame_times_for_this_scan = frame_times[
-        (frame_times["session"] == int(scan_key["session"])) & (frame_times["scan_idx"] == int(scan_key["scan_idx"]))
-    ]["frame_times"].values[0]
+    frame_times_for_this_scan = frame_times["frame_times"][0]
 
     return frame_times_for_this_scan
 
 
 def get_trial_times(scan_key: dict, file_path: str):
-    trial_times = pd.read_pickle(file_path)
+    trial_times = load_timestamps_store(file_path).get_scan(scan_key=scan_key)
 
-    trial_times_for_this_scan = trial_times[
-        (trial_times["session"] == int(scan_key["session"])) & (trial_times["scan_idx"] == int(scan_key["scan_idx"]))
-    ]
+    trial_times_for_this_scan = pd.DataFrame(trial_times)
 
     return trial_times_for_this_scan
 
 
 def get_stimulus_times(scan_key: dict, file_path: str):
-    stimulus_times = pd.read_pickle(file_path)
+    stimulus_times = load_timestamps_store(file_path).get_scan(scan_key=scan_key)
 
-    stimulus_times_for_this_scan = stimulus_times[
-        (stimulus_times["session"] == int(scan_key["session"]))
-        & (stimulus_times["scan_idx"] == int(scan_key["scan_idx"]))
-    ]["full_flips"].values[0]
+    stimulus_times_for_this_scan = stimulus_times["full_flips"][0]
 
     return stimulus_times_for_this_scan
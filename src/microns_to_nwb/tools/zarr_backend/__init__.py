@@ -0,0 +1 @@
+from .zarr_backend import export_to_hdf5, write_zarr_nwbfile
@@ -0,0 +1,111 @@
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from shutil import rmtree
+from typing import Optional, Tuple
+
+from hdmf.container import Data
+from hdmf.data_utils import DataIO, GenericDataChunkIterator
+from neuroconv.utils import FilePathType
+from pynwb import NWBFile
+
+
+def _get_nwb_zarr_io():
+    try:
+        from .zarr_io import MicronsNWBZarrIO
+    except ImportError:
+        raise ImportError(
+            "The 'zarr' backend requires the 'hdmf-zarr' package, install it with 'pip install hdmf-zarr'."
+        )
+    return MicronsNWBZarrIO
+
+
+def _get_datasets(nwbfile: NWBFile) -> list:
+    """Return the (neurodata object, field name, data) of each field, with no field name for the Data objects."""
+    datasets = []
+    for neurodata_object in nwbfile.objects.values():
+        if isinstance(neurodata_object, Data):
+            datasets.append((neurodata_object, None, neurodata_object.data))
+        datasets.extend(
+            (neurodata_object, field_name, field_value) for field_name, field_value in neurodata_object.fields.items()
+        )
+    return datasets
+
+
+def _defer_chunk_iterators(nwbfile: NWBFile) -> list:
+    """Take the buffers out of the GenericDataChunkIterators, so that writing the file only allocates their datasets."""
+    deferred_iterators = []
+    for neurodata_object, field_name, data in _get_datasets(nwbfile=nwbfile):
+        iterator = data.data if isinstance(data, DataIO) else data
+        if not isinstance(iterator, GenericDataChunkIterator):
+            continue
+        buffer_selections = list(iterator.buffer_selection_generator)
+        iterator.buffer_selection_generator = iter(())
+        deferred_iterators.append((neurodata_object, field_name, iterator, buffer_selections))
+    return deferred_iterators
+
+
+def _write_buffer(array, iterator: GenericDataChunkIterator, buffer_selection: Tuple[slice]):
+    array[buffer_selection] = iterator._get_data(selection=buffer_selection)
+
+
+def write_zarr_nwbfile(
+    nwbfile: NWBFile, nwbfile_path: FilePathType, overwrite: bool = False, max_workers: Optional[int] = None
+):
+    """
+    Write the NWBFile as an NWB-Zarr store.
+
+    The datasets are written with the ZarrDataIO of the equivalent codec of their H5DataIO, and the other numeric
+    arrays and lists uncompressed (see tools.zarr_backend.zarr_io.get_zarr_data_io). The datasets of the
+    GenericDataChunkIterators (e.g. the streamed fluorescence traces) are allocated with the file and their buffers
+    are written afterwards by a pool of 'max_workers' threads, as each chunk of a Zarr array is a separate object.
+    """
+    import zarr
+
+    NWBZarrIO = _get_nwb_zarr_io()
+
+    nwbfile_path = Path(nwbfile_path)
+    if nwbfile_path.exists():
+        if not overwrite:
+            raise FileExistsError(f"The NWB-Zarr store '{nwbfile_path}' already exists, set 'overwrite' to replace it.")
+        rmtree(nwbfile_path)
+
+    deferred_iterators = _defer_chunk_iterators(nwbfile=nwbfile)
+    with NWBZarrIO(str(nwbfile_path), mode="w") as io:
+        io.write(nwbfile)
+        dataset_paths = []
+        for neurodata_object, field_name, _, _ in deferred_iterators:
+            builder = io.manager.get_builder(neurodata_object)
+            if field_name is not None:
+                builder = builder[field_name]
+            # The path of the builders starts from the 'root' group
+            dataset_paths.append(builder.path.split("/", 1)[1])
+
+    if not deferred_iterators:
+        return
+    root = zarr.open(str(nwbfile_path), mode="r+")
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            executor.submit(_write_buffer, root[dataset_path], iterator, buffer_selection)
+            for dataset_path, (_, _, iterator, buffer_selections) in zip(dataset_paths, deferred_iterators)
+            for buffer_selection in buffer_selections
+        ]
+        for future in futures:
+            future.result()
+
+
+def export_to_hdf5(zarr_path: FilePathType, nwbfile_path: FilePathType, buffer_gb: Optional[float] = None):
+    """
+    Export an NWB-Zarr store to an NWB file in HDF5 (e.g. for the upload to DANDI).
+
+    The compressed or multi-chunk numeric arrays are streamed in buffers of 'buffer_gb' into datasets with the same
+    chunks and the equivalent HDF5 filters, the others are written as contiguous datasets.
+    """
+    NWBZarrIO = _get_nwb_zarr_io()
+    from .zarr_io import ZarrExportNWBHDF5IO
+
+    with NWBZarrIO(str(zarr_path), mode="r") as read_io:
+        nwbfile = read_io.read()
+        with ZarrExportNWBHDF5IO(
+            str(nwbfile_path), mode="w", manager=read_io.manager, buffer_gb=buffer_gb
+        ) as export_io:
+            export_io.export(src_io=read_io, nwbfile=nwbfile, write_args=dict(link_data=False))
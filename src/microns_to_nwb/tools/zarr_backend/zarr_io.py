@@ -0,0 +1,152 @@
+from numbers import Number
+from typing import Optional, Tuple
+
+import numpy as np
+from hdmf.backends.hdf5 import H5DataIO
+from hdmf.build import DatasetBuilder, GroupBuilder
+from hdmf.data_utils import GenericDataChunkIterator
+from hdmf_zarr import ZarrDataIO
+from hdmf.query import ReferenceResolver
+from hdmf_zarr.nwb import NWBZarrIO
+from pynwb import NWBHDF5IO
+from zarr import Array
+
+from tools.compression import to_h5_data_io, to_zarr_data_io
+
+
+class ZarrArrayDataChunkIterator(GenericDataChunkIterator):
+    """Iterate over a Zarr array in buffers of whole chunks."""
+
+    def __init__(self, array, buffer_gb: Optional[float] = None):
+        self.array = array
+        chunk_shape = tuple(min(chunk_length, length) for chunk_length, length in zip(array.chunks, array.shape))
+        super().__init__(buffer_gb=buffer_gb, chunk_shape=chunk_shape)
+
+    def _get_data(self, selection: Tuple[slice]) -> np.ndarray:
+        return self.array[selection]
+
+    def _get_dtype(self) -> np.dtype:
+        return self.array.dtype
+
+    def _get_maxshape(self) -> Tuple[int, ...]:
+        return self.array.shape
+
+
+def _is_numeric_array(data) -> bool:
+    if isinstance(data, np.ndarray):
+        return data.dtype.kind in "biuf" and data.size > 0
+    return isinstance(data, (list, tuple)) and len(data) > 0 and all(isinstance(value, Number) for value in data)
+
+
+def get_zarr_data_io(data) -> Optional[ZarrDataIO]:
+    """
+    The ZarrDataIO with the equivalent codec of an H5DataIO, or without compression for a numeric array or list.
+
+    The numeric arrays and lists without an H5DataIO are stored uncompressed, as they are in HDF5.
+    """
+    if isinstance(data, H5DataIO):
+        return to_zarr_data_io(data)
+    if _is_numeric_array(data):
+        return ZarrDataIO(data=data, compressor=False)
+    return None
+
+
+class _ZarrContainerResolver(ReferenceResolver):
+    """The containers of the builders of a dataset of object references read from an NWB-Zarr store."""
+
+    def __init__(self, builders: np.ndarray, manager):
+        self.builders = builders
+        self.manager = manager
+
+    @classmethod
+    def get_inverse_class(cls):
+        return cls
+
+    def invert(self) -> list:
+        return [self.manager.construct(builder) for builder in self.builders]
+
+    def __len__(self) -> int:
+        return len(self.builders)
+
+    def __getitem__(self, item):
+        # The builders are written as the references of the dataset when it is exported
+        return self.builders[item]
+
+
+def _iter_dataset_builders(builder: GroupBuilder):
+    for dataset_builder in builder.datasets.values():
+        yield dataset_builder
+    for group_builder in builder.groups.values():
+        yield from _iter_dataset_builders(group_builder)
+
+
+class MicronsNWBZarrIO(NWBZarrIO):
+    """
+    NWBZarrIO that writes the data of each dataset builder with the ZarrDataIO of 'get_zarr_data_io'.
+
+    The datasets of object references (e.g. the order of the stimulus templates) are read as their containers, which
+    hdmf-zarr leaves as builders.
+    """
+
+    def read_builder(self):
+        builder = super().read_builder()
+        for dataset_builder in _iter_dataset_builders(builder):
+            data = dataset_builder.data
+            if (
+                isinstance(data, np.ndarray)
+                and data.ndim == 1
+                and data.size
+                and isinstance(data[0], (DatasetBuilder, GroupBuilder))
+            ):
+                # The data of a builder cannot be set again, so it is replaced in the dictionary of its fields
+                dataset_builder["data"] = _ZarrContainerResolver(builders=data, manager=self.manager)
+        return builder
+
+    def write_dataset(self, parent, builder, **kwargs):
+        data = builder.data if kwargs.get("force_data") is None else kwargs["force_data"]
+        zarr_data_io = get_zarr_data_io(data)
+        if zarr_data_io is not None:
+            kwargs.update(force_data=zarr_data_io)
+        return super().write_dataset(parent, builder, **kwargs)
+
+
+class ZarrExportNWBHDF5IO(NWBHDF5IO):
+    """
+    NWBHDF5IO that exports the compressed or multi-chunk numeric arrays of an NWB-Zarr store in buffers of 'buffer_gb'.
+
+    The arrays are written with the same chunks and the equivalent HDF5 filters, the others are written as contiguous
+    datasets.
+    """
+
+    def __init__(self, *args, buffer_gb: Optional[float] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buffer_gb = buffer_gb
+        # The builders that are written in place of those of the streamed arrays, which are kept alive because the
+        # written builders are tracked by their id
+        self._streamed_builders = dict()
+
+    def write_dataset(self, parent, builder, **kwargs):
+        data = builder.data
+        if (
+            isinstance(data, Array)
+            and data.dtype.kind in "biuf"
+            and data.size > 0
+            and (data.compressor is not None or data.nchunks > 1)
+            and id(builder) not in self._streamed_builders
+        ):
+            iterator = ZarrArrayDataChunkIterator(array=data, buffer_gb=self.buffer_gb)
+            data_io = to_h5_data_io(
+                iterator, compressor=data.compressor, filters=data.filters, chunks=iterator.chunk_shape
+            )
+            # The data of a builder cannot be replaced, so the dataset is written from a copy of it with the new data
+            self._streamed_builders[id(builder)] = DatasetBuilder(
+                name=builder.name,
+                data=data_io,
+                dtype=builder.dtype,
+                attributes=builder.attributes,
+                maxshape=builder.maxshape,
+                chunks=builder.chunks,
+                parent=builder.parent,
+                source=builder.source,
+            )
+        return super().write_dataset(parent, self._streamed_builders.get(id(builder), builder), **kwargs)
@@ -0,0 +1,2 @@
+from .micronsvideodatachunkiterator import MicronsVideoDataChunkIterator
+from .micronsvideointerface import MicronsVideoInterface
@@ -0,0 +1,178 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Tuple
+
+import cv2
+import numpy as np
+from hdmf.data_utils import GenericDataChunkIterator
+from neuroconv.utils import FilePathType
+
+# The frame that is decoded to probe whether seeking is frame accurate, which is past the first keyframe interval of
+# the usual encoder settings and is not on a multiple of it (or the last frame of a shorter video)
+_SEEK_PROBE_FRAME = 499
+
+
+def _get_video_properties(file_path: FilePathType) -> Tuple[int, Tuple[int, int, int]]:
+    """The number of frames and the (height, width, 3) shape of the frames of a video, read from its header."""
+    video_capture = cv2.VideoCapture(str(file_path))
+    try:
+        if not video_capture.isOpened():
+            raise ValueError(f"The video '{file_path}' could not be opened.")
+        num_frames = int(video_capture.get(cv2.CAP_PROP_FRAME_COUNT))
+        frame_shape = (
+            int(video_capture.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+            int(video_capture.get(cv2.CAP_PROP_FRAME_WIDTH)),
+            3,
+        )
+    finally:
+        video_capture.release()
+    return num_frames, frame_shape
+
+
+def _seek(video_capture: cv2.VideoCapture, frame_number: int) -> bool:
+    """Seek to 'frame_number', returns whether the capture reports that it is at that frame."""
+    if not video_capture.set(cv2.CAP_PROP_POS_FRAMES, frame_number):
+        return False
+    return int(video_capture.get(cv2.CAP_PROP_POS_FRAMES)) == frame_number
+
+
+def _grab_frames(video_capture: cv2.VideoCapture, file_path: FilePathType, start_frame: int, stop_frame: int):
+    """Skip the frames from 'start_frame' to 'stop_frame' of a capture that is at 'start_frame'."""
+    for frame_number in range(start_frame, stop_frame):
+        if not video_capture.grab():
+            raise ValueError(f"The frame {frame_number} of '{file_path}' could not be read.")
+
+
+def _read_frames(video_capture: cv2.VideoCapture, file_path: FilePathType, start_frame: int, out: np.ndarray):
+    """Read the RGB frames of a capture that is at 'start_frame' into the (frames, height, width, 3) 'out'."""
+    for frame_index in range(len(out)):
+        success, frame = video_capture.read()
+        if not success:
+            raise ValueError(f"The frame {start_frame + frame_index} of '{file_path}' could not be read.")
+        out[frame_index] = frame[..., ::-1]
+
+
+def _is_seek_accurate(file_path: FilePathType, frame_number: int) -> bool:
+    """Whether seeking to 'frame_number' of a video decodes the same frame as reading the video up to it."""
+    video_capture = cv2.VideoCapture(str(file_path))
+    try:
+        _grab_frames(video_capture=video_capture, file_path=file_path, start_frame=0, stop_frame=frame_number)
+        success, expected_frame = video_capture.read()
+    finally:
+        video_capture.release()
+    if not success:
+        raise ValueError(f"The frame {frame_number} of '{file_path}' could not be read.")
+
+    video_capture = cv2.VideoCapture(str(file_path))
+    try:
+        if not _seek(video_capture=video_capture, frame_number=frame_number):
+            return False
+        success, frame = video_capture.read()
+    finally:
+        video_capture.release()
+    return success and np.array_equal(frame, expected_frame)
+
+
+def decode_frames(file_path: FilePathType, start_frame: int, out: np.ndarray):
+    """
+    Decode the consecutive RGB frames from 'start_frame' of a video into the (frames, height, width, 3) 'out'.
+
+    This seeks to 'start_frame', so it is only used for the videos where '_is_seek_accurate'. In case the capture
+    still does not land on 'start_frame', the frames before it are grabbed from the start of the video instead.
+    """
+    video_capture = cv2.VideoCapture(str(file_path))
+    try:
+        if start_frame and not _seek(video_capture=video_capture, frame_number=start_frame):
+            video_capture.release()
+            video_capture = cv2.VideoCapture(str(file_path))
+            _grab_frames(video_capture=video_capture, file_path=file_path, start_frame=0, stop_frame=start_frame)
+        _read_frames(video_capture=video_capture, file_path=file_path, start_frame=start_frame, out=out)
+    finally:
+        video_capture.release()
+
+
+class MicronsVideoDataChunkIterator(GenericDataChunkIterator):
+    """
+    Stream the RGB frames of a video into a chunked (frames, height, width, 3) dataset.
+
+    The video is read in buffers of as many frames as fit into 'buffer_gb', and each buffer is split into
+    consecutive frame ranges that are decoded in parallel by 'max_decode_workers' threads, each from its own
+    capture that seeks to the start of its range. Whether seeking is frame accurate is probed once per video, when
+    it is not, the buffers are decoded in a single pass over the video instead. Only the first 'num_frames' are
+    written when it is specified.
+    """
+
+    def __init__(
+        self,
+        file_path: FilePathType,
+        num_frames: Optional[int] = None,
+        buffer_gb: float = 1.0,
+        max_decode_workers: int = 1,
+    ):
+        self.file_path = file_path
+        self.max_decode_workers = max_decode_workers
+
+        num_video_frames, self._frame_shape = _get_video_properties(file_path=file_path)
+        self._num_frames = min(num_video_frames, num_frames or num_video_frames)
+        self.seek_is_accurate = self._num_frames < 2 or _is_seek_accurate(
+            file_path=file_path, frame_number=min(self._num_frames - 1, _SEEK_PROBE_FRAME)
+        )
+        # The capture and its next frame for the single pass over the video when seeking is not accurate
+        self._video_capture = None
+        self._next_frame = 0
+
+        frame_size_in_bytes = int(np.prod(self._frame_shape))
+        num_frames_per_buffer = int(min(self._num_frames, max(1, buffer_gb * 1e9 // frame_size_in_bytes)))
+        super().__init__(
+            buffer_shape=(num_frames_per_buffer, *self._frame_shape),
+            chunk_shape=(1, *self._frame_shape),
+        )
+
+    def _get_data(self, selection: Tuple[slice]) -> np.ndarray:
+        # The buffers hold whole frames
+        start_frame, stop_frame = selection[0].start, selection[0].stop
+        frames = np.empty((stop_frame - start_frame, *self._frame_shape), dtype=np.uint8)
+        if not self.seek_is_accurate:
+            self._decode_frames_in_single_pass(start_frame=start_frame, out=frames)
+            return frames
+
+        # The frame ranges are decoded into their slices of the buffer, as the decoding releases the GIL
+        num_segments = min(self.max_decode_workers, len(frames))
+        segment_starts = np.linspace(0, len(frames), num_segments + 1).astype(int)
+        with ThreadPoolExecutor(max_workers=num_segments) as executor:
+            futures = [
+                executor.submit(
+                    decode_frames,
+                    file_path=self.file_path,
+                    start_frame=start_frame + segment_start,
+                    out=frames[segment_start:segment_stop],
+                )
+                for segment_start, segment_stop in zip(segment_starts[:-1], segment_starts[1:])
+            ]
+            for future in futures:
+                future.result()
+        return frames
+
+    def _decode_frames_in_single_pass(self, start_frame: int, out: np.ndarray):
+        # The buffers are requested in order, so the capture only goes back to the start of the video if they are not
+        if self._video_capture is None or start_frame < self._next_frame:
+            if self._video_capture is not None:
+                self._video_capture.release()
+            self._video_capture = cv2.VideoCapture(str(self.file_path))
+            self._next_frame = 0
+        _grab_frames(
+            video_capture=self._video_capture,
+            file_path=self.file_path,
+            start_frame=self._next_frame,
+            stop_frame=start_frame,
+        )
+        _read_frames(video_capture=self._video_capture, file_path=self.file_path, start_frame=start_frame, out=out)
+        self._next_frame = start_frame + len(out)
+        if self._next_frame >= self._num_frames:
+            self._video_capture.release()
+            self._video_capture = None
+
+    def _get_dtype(self) -> np.dtype:
+        return np.dtype("uint8")
+
+    def _get_maxshape(self) -> Tuple[int, int, int, int]:
+        return self._num_frames, *self._frame_shape
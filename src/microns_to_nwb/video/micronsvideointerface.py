@@ -0,0 +1,123 @@
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+from hdmf.backends.hdf5.h5_utils import H5DataIO
+from neuroconv.datainterfaces import VideoInterface
+from neuroconv.tools.nwb_helpers import make_or_load_nwbfile
+from neuroconv.utils import OptionalFilePathType, calculate_regular_series_rate
+from pynwb import NWBFile
+from pynwb.image import ImageSeries
+
+from tools.clocks import describe_regular_rate, get_regular_rate
+from tools.nwb_helpers import allow_none_for_optional_options
+from video.micronsvideodatachunkiterator import MicronsVideoDataChunkIterator
+
+
+class MicronsVideoInterface(VideoInterface):
+    """Data interface for the stimulus movie, which can also be limited to its first frames."""
+
+    @classmethod
+    def get_conversion_options_schema(cls):
+        conversion_options_schema = super().get_conversion_options_schema()
+        # The timestamps are also accepted as an array, which is not a JSON array
+        conversion_options_schema["properties"]["timestamps"].pop("type")
+        return allow_none_for_optional_options(
+            conversion_options_schema=conversion_options_schema, run_conversion=cls.run_conversion
+        )
+
+    def run_conversion(
+        self,
+        nwbfile_path: OptionalFilePathType = None,
+        nwbfile: Optional[NWBFile] = None,
+        metadata: Optional[dict] = None,
+        overwrite: bool = False,
+        stub_test: bool = False,
+        stub_frames: Optional[int] = None,
+        external_mode: bool = True,
+        starting_times: Optional[list] = None,
+        starting_frames: Optional[list] = None,
+        timestamps: Optional[list] = None,
+        chunk_data: bool = True,
+        module_name: Optional[str] = None,
+        module_description: Optional[str] = None,
+        compression: Optional[str] = "gzip",
+        compression_options: Optional[int] = None,
+        max_decode_workers: Optional[int] = None,
+        buffer_gb: float = 1.0,
+        jitter_tolerance: Optional[float] = None,
+    ):
+        """
+        Add the stimulus movie as an ImageSeries (see VideoInterface.run_conversion).
+
+        When 'max_decode_workers' is specified, the frames are decoded by that many threads and streamed into the
+        dataset in buffers of 'buffer_gb' (see MicronsVideoDataChunkIterator), and the 'timestamps' (a list or an
+        array) are written as they are. With 'stub_test', only the first 'stub_frames' of the movie are written along
+        with their 'timestamps' when it is specified, and the movie is not added when it is 0, whereas the
+        'stub_test' of the VideoInterface always writes its first 10 frames. When 'jitter_tolerance' is specified and
+        the 'timestamps' are regular within it (see tools.clocks.get_regular_rate), the series has the starting time
+        and rate of the regular series instead.
+        """
+        if stub_test and stub_frames == 0:
+            if self.verbose:
+                print("The stub session has no frame of the stimulus movie, it is not added to nwbfile.")
+            return
+        if stub_frames is None and max_decode_workers is None and jitter_tolerance is None:
+            return super().run_conversion(
+                nwbfile_path=nwbfile_path,
+                nwbfile=nwbfile,
+                metadata=metadata,
+                overwrite=overwrite,
+                stub_test=stub_test,
+                external_mode=external_mode,
+                starting_times=starting_times,
+                starting_frames=starting_frames,
+                timestamps=timestamps,
+                chunk_data=chunk_data,
+                module_name=module_name,
+                module_description=module_description,
+                compression=compression,
+                compression_options=compression_options,
+            )
+
+        file_path = self.source_data["file_paths"][0]
+        frames_iterator = MicronsVideoDataChunkIterator(
+            file_path=file_path,
+            num_frames=stub_frames if stub_test else None,
+            buffer_gb=buffer_gb,
+            max_decode_workers=max_decode_workers or 1,
+        )
+        timestamps = np.asarray(timestamps)[: frames_iterator.maxshape[0]]
+
+        image_series_kwargs = dict(metadata["Behavior"]["Movies"][0])
+        image_series_kwargs.update(
+            data=H5DataIO(frames_iterator, compression=compression, compression_opts=compression_options)
+        )
+        rate = calculate_regular_series_rate(series=timestamps)
+        regular_rate = None
+        if rate is None and jitter_tolerance is not None:
+            regular_rate = get_regular_rate(timestamps=timestamps, jitter_tolerance=jitter_tolerance)
+        if rate is not None:
+            image_series_kwargs.update(starting_time=timestamps[0], rate=rate)
+        elif regular_rate is not None:
+            image_series_kwargs.update(
+                starting_time=regular_rate["starting_time"],
+                rate=regular_rate["rate"],
+                description=(
+                    f"{image_series_kwargs.get('description', '')} "
+                    f"{describe_regular_rate(max_deviation=regular_rate['max_deviation'])}"
+                ).strip(),
+            )
+        else:
+            image_series_kwargs.update(
+                timestamps=H5DataIO(timestamps, compression=compression, compression_opts=compression_options)
+            )
+
+        with make_or_load_nwbfile(
+            nwbfile_path=nwbfile_path, nwbfile=nwbfile, metadata=metadata, overwrite=overwrite, verbose=self.verbose
+        ) as nwbfile_out:
+            nwbfile_out.add_acquisition(ImageSeries(**image_series_kwargs))
+            if self.verbose:
+                print(f"{frames_iterator.maxshape[0]} frames of {Path(file_path).name} are added to nwbfile.")
+
+        return nwbfile_out
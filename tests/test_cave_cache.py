@@ -0,0 +1,122 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from tools.cave_client import (
+    cache_functional_coreg_table,
+    get_functional_coreg_table,
+    get_latest_cached_version,
+    invalidate_functional_coreg_cache,
+)
+from tools.cave_client.cache import read_functional_coreg_cache, write_functional_coreg_cache
+
+
+def make_coreg_table(materialization_version: int = 1) -> pd.DataFrame:
+    return pd.DataFrame(
+        dict(
+            id=np.array([10, 11, 12, 13]),
+            valid=np.array(["t", "t", None, "f"], dtype=object),
+            pt_supervoxel_id=np.array([100, 101, 102, 103], dtype=np.int64),
+            pt_root_id=np.array([200, 201, 202, 203], dtype=np.int64) * materialization_version,
+            pt_position_x=np.array([1, 2, 3, 4], dtype=np.int64),
+            session=[4, 4, 5, 4],
+            scan_idx=[7, 7, 2, 8],
+            unit_id=[1, 2, 1, 1],
+            field=[1, 1, 1, 1],
+        )
+    )
+
+
+class MaterializeClient:
+    """A stand-in for the 'materialize' client of CAVE that records its queries."""
+
+    def __init__(self, version: int):
+        self.version = version
+        self.queried_versions = []
+
+    def query_table(self, table: str, split_positions: bool, materialization_version: int) -> pd.DataFrame:
+        assert table == "functional_coreg" and split_positions
+        self.queried_versions.append(materialization_version)
+        return make_coreg_table(materialization_version=materialization_version)
+
+
+@pytest.fixture
+def client():
+    return SimpleNamespace(materialize=MaterializeClient(version=1))
+
+
+def test_cache_partition_round_trip(tmp_path):
+    coreg_table = make_coreg_table()
+    version_folder_path = write_functional_coreg_cache(
+        coreg_table, materialization_version=1, cache_folder_path=tmp_path
+    )
+
+    assert sorted(path.name for path in version_folder_path.iterdir()) == [
+        "meta.json",
+        "session_4_scan_7",
+        "session_4_scan_8",
+        "session_5_scan_2",
+    ]
+    for (session, scan_idx), expected_rows in coreg_table.groupby(["session", "scan_idx"]):
+        rows = read_functional_coreg_cache(
+            dict(session=session, scan_idx=scan_idx), materialization_version=1, cache_folder_path=tmp_path
+        )
+        pd.testing.assert_frame_equal(rows, expected_rows.reset_index(drop=True), check_dtype=False)
+        assert rows["pt_root_id"].dtype == np.int64
+
+    # The missing values of an object column are read back as None
+    rows = read_functional_coreg_cache(
+        dict(session=5, scan_idx=2), materialization_version=1, cache_folder_path=tmp_path
+    )
+    assert rows["valid"].tolist() == [None]
+
+
+def test_cache_of_scan_without_units(tmp_path):
+    write_functional_coreg_cache(make_coreg_table(), materialization_version=1, cache_folder_path=tmp_path)
+
+    rows = read_functional_coreg_cache(
+        dict(session=9, scan_idx=9), materialization_version=1, cache_folder_path=tmp_path
+    )
+    assert rows.empty
+    assert list(rows.columns) == list(make_coreg_table().columns)
+    assert rows["pt_root_id"].dtype == np.int64
+
+
+def test_cache_is_downloaded_once_per_version(tmp_path, client):
+    scan_key = dict(session=4, scan_idx=7)
+
+    rows = get_functional_coreg_table(scan_key, client=client, cache_folder_path=tmp_path)
+    get_functional_coreg_table(scan_key, client=client, cache_folder_path=tmp_path)
+    assert client.materialize.queried_versions == [1]
+    assert rows["unit_id"].tolist() == [1, 2]
+
+    # A new materialization version of the datastack is cached next to the previous one
+    client.materialize.version = 2
+    rows = get_functional_coreg_table(scan_key, client=client, cache_folder_path=tmp_path)
+    assert client.materialize.queried_versions == [1, 2]
+    assert rows["pt_root_id"].tolist() == [400, 402]
+    assert get_latest_cached_version(cache_folder_path=tmp_path) == 2
+
+    # A requested version is read from the cache without asking the datastack for its current version
+    rows = get_functional_coreg_table(scan_key, materialization_version=1, client=None, cache_folder_path=tmp_path)
+    assert rows["pt_root_id"].tolist() == [200, 201]
+
+
+def test_cache_version_invalidation(tmp_path, client):
+    assert get_latest_cached_version(cache_folder_path=tmp_path) is None
+    for version in (1, 2, 3):
+        cache_functional_coreg_table(client=client, cache_folder_path=tmp_path, materialization_version=version)
+    assert get_latest_cached_version(cache_folder_path=tmp_path) == 3
+
+    # The other versions are kept unless their invalidation is requested
+    assert cache_functional_coreg_table(client=client, cache_folder_path=tmp_path) == 1
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["v1", "v2", "v3"]
+
+    cache_functional_coreg_table(client=client, cache_folder_path=tmp_path, invalidate_other_versions=True)
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["v1"]
+    assert client.materialize.queried_versions == [1, 2, 3]
+
+    assert invalidate_functional_coreg_cache(cache_folder_path=tmp_path) == [1]
+    assert get_latest_cached_version(cache_folder_path=tmp_path) is None
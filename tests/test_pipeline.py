@@ -0,0 +1,78 @@
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+
+import pytest
+
+from tools.pipeline import run_pipeline, upload_to_folder
+
+
+class StageRecorder:
+    """The stage functions of a pipeline, which record the jobs they run at the same time."""
+
+    def __init__(self):
+        self.lock = Lock()
+        self.running = set()
+        self.max_running = 0
+
+    def convert(self, job):
+        with self.lock:
+            self.running.add(job)
+            self.max_running = max(self.max_running, len(self.running))
+        if job == "failing":
+            raise RuntimeError("The conversion failed.")
+        with self.lock:
+            self.running.discard(job)
+        return f"{job}.nwb"
+
+    @staticmethod
+    def upload(job):
+        return f"uploaded {job}"
+
+
+def test_run_pipeline_stages():
+    recorder = StageRecorder()
+    done_jobs = []
+    with ThreadPoolExecutor(max_workers=2) as convert_executor, ThreadPoolExecutor(max_workers=1) as upload_executor:
+        with pytest.warns(UserWarning, match="The convert of job 1 failed"):
+            results = run_pipeline(
+                jobs=["a", "failing", "b"],
+                stages=[("convert", recorder.convert, convert_executor), ("upload", recorder.upload, upload_executor)],
+                on_job_done=done_jobs.append,
+            )
+
+    assert results[0] == dict(convert="a.nwb", upload="uploaded a")
+    assert results[2] == dict(convert="b.nwb", upload="uploaded b")
+    # The job that fails in a stage skips the following stages
+    assert list(results[1]) == ["convert"]
+    assert isinstance(results[1]["convert"], RuntimeError)
+    assert sorted(done_jobs) == [0, 1, 2]
+
+
+def test_run_pipeline_max_pending_jobs():
+    recorder = StageRecorder()
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        results = run_pipeline(
+            jobs=list("abcdef"), stages=[("convert", recorder.convert, executor)], max_pending_jobs=2
+        )
+
+    assert [result["convert"] for result in results] == [f"{job}.nwb" for job in "abcdef"]
+    assert recorder.max_running <= 2
+
+
+def test_upload_to_folder(tmp_path):
+    nwbfile_path = tmp_path / "sessions" / "session.nwb"
+    nwbfile_path.parent.mkdir()
+    nwbfile_path.write_bytes(b"nwb")
+
+    # The folder is created, and a file uploaded again is replaced
+    upload_to_folder(nwbfile_path=nwbfile_path, folder_path=tmp_path / "dandiset" / "000402")
+    nwbfile_path.write_bytes(b"nwb again")
+    upload_to_folder(nwbfile_path=nwbfile_path, folder_path=tmp_path / "dandiset" / "000402")
+
+    assert (tmp_path / "dandiset" / "000402" / "session.nwb").read_bytes() == b"nwb again"
+    assert nwbfile_path.is_file()
+
+
+def test_upload_to_folder_of_missing_file(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        upload_to_folder(nwbfile_path=tmp_path / "session.nwb", folder_path=tmp_path / "dandiset")
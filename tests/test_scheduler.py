@@ -0,0 +1,85 @@
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event, Lock
+
+import numpy as np
+import pytest
+from tifffile import imwrite
+
+from tools.pipeline import estimate_session_resources, run_pipeline
+
+
+class MemoryRecorder:
+    """A first stage that holds the memory of each job until its release, and records the peak memory in use."""
+
+    def __init__(self, job_costs: list):
+        self.job_costs = job_costs
+        self.lock = Lock()
+        self.memory_gb = 0.0
+        self.peak_memory_gb = 0.0
+        self.started_jobs = []
+        self.releases = [Event() for _ in job_costs]
+
+    def convert(self, job_index: int):
+        with self.lock:
+            self.started_jobs.append(job_index)
+            self.memory_gb += self.job_costs[job_index]
+            self.peak_memory_gb = max(self.peak_memory_gb, self.memory_gb)
+        assert self.releases[job_index].wait(timeout=10)
+        with self.lock:
+            self.memory_gb -= self.job_costs[job_index]
+        return job_index
+
+
+def run_admitted_jobs(job_costs: list, max_total_cost: float, release_order: list) -> MemoryRecorder:
+    """Run the jobs through the memory admission, releasing them in 'release_order' once they are all admitted."""
+    recorder = MemoryRecorder(job_costs=job_costs)
+
+    def release_next_job(_):
+        if release_order:
+            recorder.releases[release_order.pop(0)].set()
+
+    with ThreadPoolExecutor(max_workers=len(job_costs)) as executor:
+        # The first job is released here, and each job that is done releases the next one
+        recorder.releases[release_order.pop(0)].set()
+        results = run_pipeline(
+            jobs=list(range(len(job_costs))),
+            stages=[("convert", recorder.convert, executor)],
+            on_job_done=release_next_job,
+            job_costs=job_costs,
+            max_total_cost=max_total_cost,
+        )
+    assert [result["convert"] for result in results] == list(range(len(job_costs)))
+    return recorder
+
+
+def test_memory_admission_stays_under_budget():
+    recorder = run_admitted_jobs(job_costs=[3.0, 3.0, 4.0, 2.0], max_total_cost=6.0, release_order=[0, 1, 3, 2])
+
+    assert recorder.peak_memory_gb <= 6.0
+    # The later job that fits is admitted ahead of the one that does not
+    assert sorted(recorder.started_jobs[:2]) == [0, 1] and recorder.started_jobs[2] == 3
+
+
+def test_memory_admission_of_job_over_budget():
+    with pytest.warns(UserWarning, match="it is run alone"):
+        recorder = run_admitted_jobs(job_costs=[1.0, 8.0, 1.0], max_total_cost=6.0, release_order=[0, 2, 1])
+
+    # The job over the budget only starts once the others are done, and nothing starts along with it
+    assert sorted(recorder.started_jobs[:2]) == [0, 2] and recorder.started_jobs[2] == 1
+    assert recorder.peak_memory_gb == 8.0
+
+
+def test_estimate_session_resources(tmp_path):
+    ophys_file_path = tmp_path / "scan.tif"
+    imwrite(ophys_file_path, np.zeros((8, 64, 32), dtype=np.int16))
+    estimate_kwargs = dict(ophys_file_path=ophys_file_path, num_frames=10000, num_fields=4)
+
+    estimate = estimate_session_resources(**estimate_kwargs)
+    assert estimate["memory_gb"] > 1.0 and estimate["runtime_s"] > 0.0
+
+    # Streaming the traces and storing the masks as pixel masks lower the memory, the parallel plane readers raise it
+    assert estimate_session_resources(**estimate_kwargs, trace_buffer_gb=0.001)["memory_gb"] < estimate["memory_gb"]
+    assert estimate_session_resources(**estimate_kwargs, mask_format="pixel_mask")["memory_gb"] < estimate["memory_gb"]
+    parallel_estimate = estimate_session_resources(**estimate_kwargs, plane_reader="parallel", max_plane_workers=2)
+    assert parallel_estimate["memory_gb"] > estimate["memory_gb"]
+    assert parallel_estimate["runtime_s"] == estimate["runtime_s"]
@@ -0,0 +1,82 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from tools.times import build_timestamps_store, get_frame_times, get_trial_times, load_timestamps_store
+from tools.times.store import get_store_path
+
+
+@pytest.fixture
+def trial_file_path(tmp_path):
+    table = pd.DataFrame(
+        dict(
+            session=[5, 4, 4, 4],
+            scan_idx=[2, 7, 7, 7],
+            trial_idx=[0, 1, 0, 2],
+            type=["stimulus.Clip", None, "stimulus.Monet2", np.nan],
+            start_time=[1.0, 2.0, np.nan, 4.0],
+            flip_times=[np.arange(3.0), np.arange(2.0), np.arange(4.0), np.arange(0.0)],
+        )
+    )
+    file_path = tmp_path / "Trial.pkl"
+    table.to_pickle(file_path)
+    return file_path
+
+
+def test_store_round_trip(trial_file_path):
+    store = load_timestamps_store(trial_file_path)
+    assert store.store_path == get_store_path(trial_file_path)
+
+    # The rows of each scan keep their order in the pickle
+    scan_columns = store.get_scan(dict(session=4, scan_idx=7))
+    np.testing.assert_array_equal(scan_columns["session"], [4, 4, 4])
+    np.testing.assert_array_equal(scan_columns["trial_idx"], [1, 0, 2])
+    np.testing.assert_array_equal(scan_columns["start_time"], [2.0, np.nan, 4.0])
+    assert [len(flip_times) for flip_times in scan_columns["flip_times"]] == [2, 4, 0]
+    np.testing.assert_array_equal(scan_columns["flip_times"][1], np.arange(4.0))
+
+    scan_columns = store.get_scan(dict(session=5, scan_idx=2))
+    assert scan_columns["type"].tolist() == ["stimulus.Clip"]
+
+    with pytest.raises(KeyError):
+        store.get_scan(dict(session=4, scan_idx=1))
+
+
+def test_store_restores_missing_values_of_object_columns(trial_file_path):
+    store = load_timestamps_store(trial_file_path)
+
+    # The None and NaN of an object column are not read back as the strings 'None' and 'nan'
+    assert store.get_scan(dict(session=4, scan_idx=7))["type"].tolist() == [None, "stimulus.Monet2", None]
+
+    trial_times = get_trial_times(scan_key=dict(session=4, scan_idx=7), file_path=trial_file_path)
+    assert trial_times["type"].isna().tolist() == [True, False, True]
+
+
+def test_store_is_memory_mapped(trial_file_path):
+    store = load_timestamps_store(trial_file_path)
+
+    assert isinstance(store._load_column("flip_times.npy"), np.memmap)
+    # The arrays of a scan are copies, which stay valid once the memory map is closed
+    flip_times = store.get_scan(dict(session=5, scan_idx=2))["flip_times"][0]
+    assert not isinstance(flip_times, np.memmap)
+
+
+def test_store_is_rebuilt_when_the_pickle_changes(tmp_path):
+    file_path = tmp_path / "ScanTimes.pkl"
+    pd.DataFrame(dict(session=[4], scan_idx=[7], frame_times=[np.arange(3.0)])).to_pickle(file_path)
+    np.testing.assert_array_equal(get_frame_times(dict(session=4, scan_idx=7), file_path), np.arange(3.0))
+
+    pd.DataFrame(dict(session=[4], scan_idx=[7], frame_times=[np.arange(5.0)])).to_pickle(file_path)
+    np.testing.assert_array_equal(get_frame_times(dict(session=4, scan_idx=7), file_path), np.arange(5.0))
+
+    # Compiling again replaces the store in place
+    store_path = build_timestamps_store(file_path)
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["ScanTimes.pkl", store_path.name]
+
+
+def test_store_rejects_mixed_array_columns(tmp_path):
+    file_path = tmp_path / "ScanTimes.pkl"
+    pd.DataFrame(dict(session=[4, 4], scan_idx=[7, 8], frame_times=[np.arange(3.0), 1.0])).to_pickle(file_path)
+
+    with pytest.raises(ValueError, match="mixes arrays"):
+        build_timestamps_store(file_path)